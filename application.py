@@ -1,7 +1,10 @@
 #!flask/bin/python
 
-from listen_local_app import application
+from listen_local_app import create_app
 import config
 
+# AWS EB needs an app named "application" in the namespace
+application = create_app()
+
 if __name__ == '__main__':
     application.run(debug=config.debug)
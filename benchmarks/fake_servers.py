@@ -0,0 +1,253 @@
+#!/usr/bin/python
+
+'''
+Local stand-ins for the Seatgeek and Spotify APIs used by the benchmarks. Each endpoint
+can be given its own latency, error rate and 429 rate, and the Seatgeek server makes up
+as many events and performers as asked for.
+'''
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+
+class EndpointBehavior:
+    '''
+    How a fake endpoint misbehaves
+
+    Args:
+        latency (float): seconds to wait before answering (default: 0)
+        error_rate (float): fraction of calls answered with a 500 (default: 0)
+        throttle_rate (float): fraction of calls answered with a 429 (default: 0)
+        retry_after (int): ``Retry-After`` (s) sent with 429s (default: 0)
+    '''
+    def __init__(self, latency=0, error_rate=0, throttle_rate=0, retry_after=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    '''
+    Threaded HTTP server dispatching to ``routes``, a list of ``(method, regex, endpoint,
+    handler)``. ``handler(server, match, query, body)`` returns ``(status, payload)``.
+    '''
+    daemon_threads = True
+    routes = []
+
+    def __init__(self, behaviors=None, port=0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.behaviors = behaviors or {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method):
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        for route_method, pattern, endpoint, handler in self.server.routes:
+            match = re.fullmatch(pattern, parts.path)
+            if route_method == method and match:
+                break
+        else:
+            return self._send(404, {'error': 'not found'})
+
+        self.server.count(endpoint)
+        behavior = self.server.behaviors.get(endpoint) or EndpointBehavior()
+        if behavior.latency:
+            time.sleep(behavior.latency)
+        roll = random.random()
+        if roll < behavior.throttle_rate:
+            return self._send(429, {'error': 'rate limited'},
+                              {'Retry-After': str(behavior.retry_after)})
+        if roll < behavior.throttle_rate + behavior.error_rate:
+            return self._send(500, {'error': 'server error'})
+        status, payload = handler(self.server, match, query, body)
+        self._send(status, payload)
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _stable_id(*parts):
+    return hashlib.md5(':'.join(str(p) for p in parts).encode()).hexdigest()[:22]
+
+
+class FakeSeatgeek(FakeServer):
+    '''
+    Fake ``/2/events`` endpoint. Every search returns ``events`` events with
+    ``performers_per_event`` performers each, drawn from a pool of ``performer_pool``
+    names per zipcode (or shared by all zipcodes if ``shared_performers``).
+    '''
+    def __init__(self, behaviors=None, events=100, performers_per_event=2, performer_pool=150,
+                 shared_performers=False, port=0):
+        super().__init__(behaviors=behaviors, port=port)
+        self.events = events
+        self.performers_per_event = performers_per_event
+        self.performer_pool = performer_pool
+        self.shared_performers = shared_performers
+
+    def _events(self, match, query, body):
+        zipcode = query.get('geoip', '00000')
+        per_page = int(query.get('per_page', 10))
+        page = int(query.get('page', 1))
+        start = (page - 1) * per_page
+        date = query.get('datetime_local.gte', '2019-01-22T00:00:00')[:10]
+        pool_key = 'shared' if self.shared_performers else zipcode
+        events = []
+        for i in range(start, min(start + per_page, self.events)):
+            performers = []
+            for j in range(self.performers_per_event):
+                n = (i * self.performers_per_event + j) % self.performer_pool
+                performers.append({'id': int(_stable_id(pool_key, n)[:8], 16),
+                                   'short_name': f'Artist {pool_key} {n}',
+                                   'genres': [{'name': 'rock'}]})
+            events.append({
+                'id': int(_stable_id(zipcode, date, i)[:8], 16),
+                'title': f'Show {i}',
+                'datetime_local': f'{date}T{19 + i % 4:02d}:{i % 60:02d}:00',
+                'venue': {'id': i % 20, 'name': f'Venue {i % 20}', 'address': f'{i} Main St',
+                          'extended_address': f'Anytown, ST {zipcode}',
+                          'location': {'lat': 40.0 + (i % 20) / 1000, 'lon': -75.0}},
+                'performers': performers,
+            })
+        meta = {'total': self.events, 'page': page, 'per_page': per_page,
+                'geolocation': {'lat': 40.0, 'lon': -75.0, 'postal_code': zipcode}}
+        return 200, {'events': events, 'meta': meta}
+
+    routes = [('GET', r'/2/events', 'events', _events)]
+
+
+class FakeSpotify(FakeServer):
+    '''
+    Fake Spotify accounts and web API covering the calls the app makes. Every artist
+    searched for exists and has one top track.
+    '''
+    def __init__(self, behaviors=None, port=0):
+        super().__init__(behaviors=behaviors, port=port)
+        self.playlists = {}
+        self.playlist_names = {}
+        self.snapshots = {}
+
+    def _token(self, match, query, body):
+        return 200, {'access_token': 'fake-token', 'token_type': 'Bearer', 'expires_in': 3600}
+
+    def _search(self, match, query, body):
+        name = query.get('q', '').split(':', 1)[-1]
+        return 200, {'artists': {'items': [{'id': _stable_id('artist', name), 'name': name}]}}
+
+    def _top_tracks(self, match, query, body):
+        return 200, {'tracks': [{'id': _stable_id('track', match.group(1))}]}
+
+    def _me(self, match, query, body):
+        return 200, {'id': 'bench-user'}
+
+    def _playlist(self, playlist_id):
+        return {'id': playlist_id, 'uri': f'spotify:playlist:{playlist_id}',
+                'name': self.playlist_names.get(playlist_id), 'owner': {'id': 'bench-user'},
+                'snapshot_id': f'snapshot-{self.snapshots.get(playlist_id, 0)}'}
+
+    def _changed(self, playlist_id):
+        self.snapshots[playlist_id] = self.snapshots.get(playlist_id, 0) + 1
+        return {'snapshot_id': f'snapshot-{self.snapshots[playlist_id]}'}
+
+    def _my_playlists(self, match, query, body):
+        return 200, {'items': [self._playlist(playlist_id) for playlist_id in self.playlists],
+                     'next': None}
+
+    def _get_playlist(self, match, query, body):
+        playlist_id = match.group(1)
+        if playlist_id not in self.playlists:
+            return 404, {'error': {'status': 404, 'message': 'Not found'}}
+        items = [{'track': {'uri': uri}} for uri in self.playlists[playlist_id]]
+        return 200, dict(self._playlist(playlist_id), tracks={'items': items, 'next': None})
+
+    def _create_playlist(self, match, query, body):
+        playlist_id = _stable_id('playlist', len(self.playlists), time.time())
+        self.playlists[playlist_id] = []
+        self.playlist_names[playlist_id] = json.loads(body or b'{}').get('name')
+        return 201, self._playlist(playlist_id)
+
+    def _add_tracks(self, match, query, body):
+        payload = json.loads(body or b'{}')
+        tracks = self.playlists.setdefault(match.group(1), [])
+        position = payload.get('position', len(tracks))
+        if len(payload.get('uris', [])) > 100 or position > len(tracks):
+            return 400, {'error': {'status': 400, 'message': 'Invalid request'}}
+        tracks[position:position] = payload['uris']
+        return 201, self._changed(match.group(1))
+
+    def _remove_tracks(self, match, query, body):
+        removals = [(position, track['uri'])
+                    for track in json.loads(body or b'{}').get('tracks', [])
+                    for position in track.get('positions', [])]
+        tracks = self.playlists.setdefault(match.group(1), [])
+        if any(position >= len(tracks) or tracks[position] != uri for position, uri in removals):
+            return 400, {'error': {'status': 400, 'message': 'Could not remove tracks'}}
+        positions = {position for position, _ in removals}
+        tracks[:] = [uri for i, uri in enumerate(tracks) if i not in positions]
+        return 200, self._changed(match.group(1))
+
+    routes = [
+        ('POST', r'/api/token', 'token', _token),
+        ('GET', r'/v1/search', 'search', _search),
+        ('GET', r'/v1/artists/([^/]+)/top-tracks', 'top_tracks', _top_tracks),
+        ('GET', r'/v1/me', 'me', _me),
+        ('GET', r'/v1/me/playlists', 'my_playlists', _my_playlists),
+        ('POST', r'/v1/users/([^/]+)/playlists', 'create_playlist', _create_playlist),
+        ('GET', r'/v1/playlists/([^/]+)', 'get_playlist', _get_playlist),
+        ('POST', r'/v1/playlists/([^/]+)/tracks', 'add_tracks', _add_tracks),
+        ('DELETE', r'/v1/playlists/([^/]+)/tracks', 'remove_tracks', _remove_tracks),
+    ]
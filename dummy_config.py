@@ -16,3 +16,131 @@ seatgeek_client_id = ''
 secret_key = b''
 
 debug = False  # or true if dev mode
+
+# Seatgeek paging: how many later pages to fetch at once and the most pages to follow
+seatgeek_max_workers = 4
+seatgeek_max_pages = 20
+
+# Split searches over a range of up to seatgeek_max_shard_days days into whole day
+# searches cached on their own, so overlapping date ranges share them. Off by default:
+# a range that isn't cached yet then takes one request per day, and its events are
+# only passed on once every day has been fetched.
+seatgeek_shard_days = False
+seatgeek_max_shard_days = 31
+
+# Seatgeek response cache: entries kept and how long (s) a response stays fresh
+seatgeek_cache_size = 256
+seatgeek_cache_ttl = 10 * 60
+seatgeek_cache_path = None  # SQLite file to share cached responses between app processes
+
+# Local store of seatgeek events by venue location (SQLite, off unless event_store_path is
+# set). Searches around any zipcode whose area was fetched in the last event_store_ttl
+# seconds are answered from it, and otherwise only the area around the zipcode is fetched.
+# The store is a grid of event_store_cell_degrees cells; zipcodes are placed using the
+# locations seatgeek sends back and the zipcode,lat,lon (or Census ZCTA gazetteer) file at
+# zipcode_centroids_path.
+event_store_path = None
+event_store_ttl = 10 * 60
+event_store_cell_degrees = 0.05
+zipcode_centroids_path = None
+
+# Number of Spotify artist lookups to run at once, shared by all the searches of an app
+# process; keep it at most http_pool_size so every lookup gets a kept-open connection
+spotify_max_workers = 8
+
+# Spotify artist lookup cache. Set artist_cache_path to a file to keep the cache on disk
+# (SQLite) across restarts; TTLs are in seconds.
+artist_cache_size = 4096
+artist_cache_path = None
+artist_cache_ttl = 7 * 24 * 3600
+artist_not_found_ttl = 24 * 3600
+artist_no_tracks_ttl = 24 * 3600
+
+# Index of performers already matched to Spotify artists, used to skip the Spotify search
+# for known performers (kept in artist_cache_path when set). Names at least
+# artist_index_min_similarity alike (0-1, by trigrams) count as the same artist. At most
+# artist_index_max_names names are kept in memory, dropping the least recently matched.
+artist_index_ttl = 90 * 24 * 3600
+artist_index_min_similarity = 0.85
+artist_index_max_names = 50000
+
+# Identical seatgeek searches and artist lookups running at the same time wait for the
+# one already in flight (up to single_flight_timeout s) and share its result. Set
+# single_flight_lock_dir to a directory shared by every app process to coalesce across
+# processes too; that needs seatgeek_cache_path and artist_cache_path to share results.
+single_flight_lock_dir = None
+single_flight_timeout = 30
+
+# Outbound HTTP: timeout (s), retries with exponential backoff (s) on 5xx/connection
+# errors and 429s, connections kept open per host, and the longest Retry-After (s) to honor
+http_timeout = 10
+http_max_retries = 3
+http_backoff = 0.5
+http_pool_size = 16
+http_max_retry_after = 30
+
+# Run searches on background worker threads and show a progress page while they run.
+# Set job_store_path to a SQLite file when running several app processes so any of
+# them can report on a search, and so searches left unfinished by a process that stops
+# are run again by the next one started on the same host. Job state is kept for
+# job_ttl seconds, and a job's progress counts are saved at most every
+# job_progress_interval seconds.
+background_jobs = True
+job_workers = 4
+job_store_path = None
+job_ttl = 60 * 60
+job_progress_interval = 0.5
+
+# Stream the results page, sending listings as artists are looked up, instead of
+# showing a progress page (takes precedence over background_jobs)
+stream_results = False
+
+# Rendered results pages are kept for results_ttl seconds and served again from their
+# /results/<key> permalink, gzipped (and brotli compressed with the brotli package
+# installed). Pages in memory are capped at results_cache_bytes; set results_store_path
+# to a SQLite file so every app process can serve every permalink, keeping at most
+# results_store_max_pages pages in it.
+results_ttl = 24 * 3600
+results_cache_bytes = 32 * 1024 * 1024
+results_store_path = None
+results_store_max_pages = 10000
+
+# Pages of 50 of a user's playlists searched for the playlist of an earlier identical
+# search, which is then updated instead of making a new one
+playlist_search_pages = 10
+
+# Batch playlist building (python -m listen_local_app.bulk): markets run at once, most
+# upstream requests per second across all of them, and the Spotify refresh token of the
+# account the playlists are written to
+bulk_max_workers = 4
+bulk_rate_limit = 20
+spotify_refresh_token = None
+
+# Upstream API locations; only change these to point the app at stand-in servers
+seatgeek_api_url = 'https://api.seatgeek.com/2'
+spotify_api_url = 'https://api.spotify.com/v1'
+spotify_accounts_url = 'https://accounts.spotify.com'
+
+# Time search stages and upstream calls: adds a Server-Timing header to responses and
+# serves histograms for Prometheus at /metrics
+metrics_enabled = False
+
+# Profile /callback requests sent with an "X-Profile: <profiling_token>" header, plus a
+# random profiling_sample_rate share (0-1) of all of them. Profiles are written to
+# profiling_dir as pstats (.prof) and collapsed stack (.folded, for flame graphs) files;
+# only the latest profiling_keep are kept.
+profiling_enabled = False
+profiling_token = None
+profiling_sample_rate = 0.0
+profiling_dir = 'profiles'
+profiling_keep = 50
+
+# Cache warm-up for popular searches: (zipcode, radius (mi), days from today) targets,
+# listed here and/or in a zipcode,radius,days CSV file. With warmup_enabled the app warms
+# them every warmup_interval seconds (keep it below seatgeek_cache_ttl); each run stops
+# once it has sent warmup_budget upstream requests, part way through a search if need be.
+warmup_enabled = False
+warmup_targets = []  # e.g. [('19130', 10, 1), ('19130', 10, 7)]
+warmup_targets_path = None
+warmup_interval = 5 * 60
+warmup_budget = 500
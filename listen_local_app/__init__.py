@@ -1,12 +1,113 @@
-from flask import Flask
-from flask_wtf.csrf import CSRFProtect
-import config
+import importlib
+import time
 
-# AWS EB needs an app named "application" in the namespace
-application = app = Flask(__name__)
-csrf = CSRFProtect(app)
+_import_started = time.perf_counter()
 
-# from local_concert_playlist import callback, views
-from listen_local_app import views  # noqa
+from flask import Flask  # noqa: E402
+from flask import request  # noqa: E402
+from flask import Response  # noqa: E402
+from flask_wtf.csrf import CSRFProtect  # noqa: E402
+from listen_local_app import metrics  # noqa: E402
+from listen_local_app import profiling  # noqa: E402
 
-app.secret_key = config.secret_key
+csrf = CSRFProtect()
+
+
+def create_app(config_object='config'):
+    '''
+    Build and configure the Flask app. Heavy modules (pandas, spotipy) are not imported
+    here; they load the first time a search needs them.
+
+    Args:
+        config_object (str or object): config module (or its import path) loaded into
+            ``app.config`` and read for ``secret_key`` and ``warmup_enabled``. The other
+            modules read every other setting from the ``config`` module on import, so
+            those settings come from it whatever is passed here (default: 'config')
+    '''
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    if isinstance(config_object, str):
+        config_object = importlib.import_module(config_object)
+    app.secret_key = config_object.secret_key
+    csrf.init_app(app)
+
+    from listen_local_app import views
+    app.register_blueprint(views.bp)
+
+    if metrics.enabled:
+        _setup_metrics(app)
+    if profiling.enabled:
+        _setup_profiling(app)
+    if getattr(config_object, 'warmup_enabled', False):
+        from listen_local_app import warmup
+        warmup.start_background()
+    _track_startup_time(app)
+    return app
+
+
+def _setup_metrics(app):
+    '''
+    Send per-request stage timings in a ``Server-Timing`` header and serve the aggregate
+    histograms from ``/metrics``
+    '''
+    @app.before_request
+    def _start_timings():
+        metrics.start_request()
+
+    @app.after_request
+    def _add_server_timing(response):
+        server_timing = metrics.finish_request()
+        if server_timing:
+            response.headers['Server-Timing'] = server_timing
+        return response
+
+    def _metrics_view():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', _metrics_view)
+
+
+def _setup_profiling(app):
+    '''
+    Profile ``/callback`` requests picked by ``profiling.should_profile``, naming the
+    profile written for them in an ``X-Profile`` response header
+    '''
+    @app.before_request
+    def _start_profile():
+        if request.endpoint == 'views.process':
+            profiling.start_request('callback', request.headers.get(profiling.HEADER))
+
+    @app.after_request
+    def _add_profile_name(response):
+        session = profiling.current()
+        if session is not None:
+            response.headers[profiling.HEADER] = session.name
+        return response
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        profiling.finish_request()
+
+
+def _track_startup_time(app):
+    '''
+    Record how long the package took to import and build the app, and how long the first
+    request took to serve, in ``app.config['STARTUP_TIMINGS']`` (seconds)
+    '''
+    timings = app.config['STARTUP_TIMINGS'] = {
+        'create_app': time.perf_counter() - _import_started,
+    }
+    print(f"App created {timings['create_app']:.3f}s after import started")
+    first_request = {}
+
+    @app.before_request
+    def _start_first_request_timer():
+        if 'first_request' not in timings:
+            first_request.setdefault('started', time.perf_counter())
+
+    @app.after_request
+    def _stop_first_request_timer(response):
+        if 'first_request' not in timings and 'started' in first_request:
+            timings['first_request'] = time.perf_counter() - first_request['started']
+            print(f"First request served in {timings['first_request']:.3f}s")
+        return response
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+
+'''
+Local index of performers already matched to Spotify artists, so known performers can
+be resolved without a Spotify search
+'''
+
+import re
+import threading
+import unicodedata
+
+from collections import OrderedDict
+from listen_local_app.cache import SQLiteStore
+
+
+def match_key(name):
+    '''
+    Reduce a performer or artist name to the form names are matched on: accents,
+    punctuation, case and a leading "The" are dropped and "&" is read as "and", so
+    e.g. "The Beatles", "beatles" and "Beatles!" share a key
+
+    Args:
+        name (str): performer or artist name
+    '''
+    name = unicodedata.normalize('NFKD', name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = re.sub(r"[^\w\s]", "", name.casefold().replace("&", " and "))
+    words = name.split()
+    if len(words) > 1 and words[0] == 'the':
+        words = words[1:]
+    return " ".join(words)
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ArtistIndex:
+    '''
+    Thread-safe index of Spotify artist ids by performer name and by seatgeek performer
+    id. Names are looked up by ``match_key`` and, failing that, by trigram similarity so
+    near-exact spellings match too. With ``path`` set the index is kept in SQLite and
+    loaded on first use.
+
+    Args:
+        path (str): SQLite database file to keep the index in, or ``None`` to keep it in
+            memory only (default: None)
+        ttl (float): seconds an entry is kept on disk (default: 90 days)
+        min_similarity (float): smallest trigram similarity (0-1) between two names for
+            them to be taken as the same artist (default: 0.85)
+        seed (callable): returns ``(name, spotify_artist_id)`` pairs to add to the index
+            when it is first used, e.g. past resolutions from another cache (default: None)
+        max_names (int): most names kept in memory before the least recently matched are
+            dropped; they stay on disk with ``path`` set (default: 50000)
+    '''
+    def __init__(self, path=None, ttl=90 * 24 * 3600, min_similarity=0.85, seed=None,
+                 max_names=50000):
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self.seed = seed
+        self.max_names = max_names
+        self.hits = 0
+        self.misses = 0
+        # key -> (artist id, number of trigrams of key), least recently matched first
+        self._names = OrderedDict()
+        self._performers = {}
+        self._trigrams = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._names_store = SQLiteStore(path, table='artist_index_names') if path else None
+        self._performers_store = (SQLiteStore(path, table='artist_index_performers')
+                                  if path else None)
+
+    def _load(self):
+        # Called with ``self._lock`` held
+        if self._loaded:
+            return
+        self._loaded = True
+        for name, artist_id in (self.seed() if self.seed else []):
+            self._add_name(match_key(name), artist_id)
+        if self._names_store is not None:
+            for key, artist_id in self._names_store.items():
+                self._add_name(key, artist_id)
+            self._performers.update(self._performers_store.items())
+
+    def _add_name(self, key, artist_id, trigrams=None):
+        # Called with ``self._lock`` held
+        if not key:
+            return
+        if key in self._names:
+            self._names[key] = artist_id, self._names[key][1]
+            self._names.move_to_end(key)
+            return
+        trigrams = trigrams or _trigrams(key)
+        for trigram in trigrams:
+            self._trigrams.setdefault(trigram, set()).add(key)
+        self._names[key] = artist_id, len(trigrams)
+        while len(self._names) > self.max_names:
+            self._remove_name(next(iter(self._names)))
+
+    def _remove_name(self, key):
+        # Called with ``self._lock`` held
+        del self._names[key]
+        for trigram in _trigrams(key):
+            keys = self._trigrams.get(trigram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._trigrams[trigram]
+
+    def match(self, name, performer_id=None):
+        '''
+        Return the Spotify artist id for a performer, or ``None`` if the index has no
+        entry for their seatgeek id, their name or a near-exact spelling of it
+
+        Args:
+            name (str): performer name
+            performer_id: seatgeek performer id (default: None)
+        '''
+        key = match_key(name)
+        trigrams = _trigrams(key)
+        with self._lock:
+            self._load()
+            artist_id = self._performers.get(str(performer_id)) if performer_id else None
+            if artist_id is None:
+                closest = key if key in self._names else self._closest(trigrams)
+                if closest is not None:
+                    self._names.move_to_end(closest)
+                    artist_id = self._names[closest][0]
+            if artist_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return artist_id
+
+    def _closest(self, trigrams):
+        # Called with ``self._lock`` held. Returns the key most alike, or ``None``
+        shared = {}
+        for trigram in trigrams:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        # A candidate sharing fewer trigrams than this can't be alike enough
+        least_shared = self.min_similarity * len(trigrams)
+        best, best_similarity = None, self.min_similarity
+        for candidate, n in shared.items():
+            if n < least_shared:
+                continue
+            similarity = n / (len(trigrams) + self._names[candidate][1] - n)
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def add(self, name, artist_id, performer_id=None):
+        '''
+        Record that performer ``name`` (seatgeek id ``performer_id``) is Spotify artist
+        ``artist_id``
+        '''
+        key = match_key(name)
+        trigrams = _trigrams(key) if key else None
+        with self._lock:
+            self._load()
+            self._add_name(key, artist_id, trigrams)
+            if performer_id:
+                self._performers[str(performer_id)] = artist_id
+        if self._names_store is not None:
+            if key:
+                self._names_store.set(key, artist_id, self.ttl)
+            if performer_id:
+                self._performers_store.set(str(performer_id), artist_id, self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+            self._performers.clear()
+            self._trigrams.clear()
+            self._loaded = False
+            self.hits = self.misses = 0
+        if self._names_store is not None:
+            self._names_store.clear()
+            self._performers_store.clear()
+
+    def stats(self):
+        '''
+        Return a dictionary of hit/miss counters and the number of names indexed
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._names)}
+
+    def __len__(self):
+        return len(self._names)
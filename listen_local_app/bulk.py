@@ -0,0 +1,291 @@
+#!/usr/bin/python
+
+'''
+Batch mode: build playlists for many markets at once, outside the browser flow. Markets
+come from a CSV file of ``zipcode,daterange,radius,playlist`` rows, where ``daterange``
+is written as in the search form ('YYYY-MM-DD' or 'YYYY-MM-DD to YYYY-MM-DD') and
+``playlist`` is the playlist to fill: a Spotify playlist uri or link, a playlist name
+(found or made in the user's account) or blank for the name the app gives the search.
+
+Playlists are written for the user whose Spotify refresh token is given with
+``--refresh-token`` (or ``spotify_refresh_token`` in config.py)::
+
+    python -m listen_local_app.bulk markets.csv --workers 4 --rate 20
+
+Markets run ``--workers`` at a time, with every upstream request of the run held to
+``--rate`` per second. Finished markets are recorded in a checkpoint file as they
+complete, and a run started again with the same file skips them, so a crashed run can
+be resumed. A per-market report is printed at the end.
+'''
+
+import argparse
+import config
+import csv
+import json
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from listen_local_app import clients
+
+
+bulk_max_workers = getattr(config, 'bulk_max_workers', 4)
+bulk_rate_limit = getattr(config, 'bulk_rate_limit', 20)
+spotify_refresh_token = getattr(config, 'spotify_refresh_token', None)
+
+# Outcomes of markets that are not run again when a run is resumed
+FINISHED = ('done', 'no_concerts')
+
+_PLAYLIST_PREFIXES = ('spotify:playlist:', 'https://open.spotify.com/playlist/')
+
+
+def read_markets(path):
+    '''
+    Read markets from a CSV file of ``zipcode,daterange,radius,playlist`` rows. A header
+    row and blank lines are skipped, and the playlist column may be left out. Rows
+    missing a zipcode, daterange or radius are reported and skipped.
+
+    Args:
+        path (str): location of the CSV file
+
+    Returns:
+        list: market dictionaries with ``zipcode``, ``daterange``, ``radius`` and
+            ``playlist`` keys
+    '''
+    markets = []
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if not row or not row[0].strip() or row[0].strip() == 'zipcode':
+                continue
+            values = [value.strip() for value in row[:3]]
+            if len(values) < 3 or not all(values):
+                print(f"Skipping line {reader.line_num} of {path}, it needs a zipcode, "
+                      f"daterange and radius: {','.join(row)}")
+                continue
+            zipcode, daterange, radius = values
+            playlist = row[3].strip() if len(row) > 3 else ''
+            markets.append({'zipcode': zipcode, 'daterange': daterange, 'radius': radius,
+                            'playlist': playlist})
+    return markets
+
+
+def market_key(market):
+    return "|".join(market[field] for field in ('zipcode', 'daterange', 'radius', 'playlist'))
+
+
+class Checkpoint:
+    '''
+    Thread-safe record of the reports of finished markets, kept in a JSON file that is
+    rewritten (atomically) every time a market finishes
+
+    Args:
+        path (str): location of the checkpoint file, or ``None`` to keep no checkpoint
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.reports = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.reports = json.load(f)
+
+    def finished(self, market):
+        report = self.reports.get(market_key(market))
+        return report is not None and report['outcome'] in FINISHED
+
+    def record(self, report):
+        with self._lock:
+            self.reports[market_key(report)] = report
+            if not self.path:
+                return
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.reports, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+class UserToken:
+    '''
+    Thread-safe holder for a user's Spotify access token, renewed from their refresh
+    token once it is ``lifetime`` seconds old (tokens last an hour)
+
+    Args:
+        refresh_token (str): the user's refresh token
+        lifetime (float): seconds a token is used for (default: 50 minutes)
+    '''
+    def __init__(self, refresh_token, lifetime=50 * 60):
+        self.refresh_token = refresh_token
+        self.lifetime = lifetime
+        self._token = None
+        self._renewed = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        from listen_local_app.functions import refresh_access_token
+
+        with self._lock:
+            if self._token is None or time.time() - self._renewed >= self.lifetime:
+                self._token = refresh_access_token(self.refresh_token)
+                self._renewed = time.time()
+            return self._token
+
+
+def run_market(access_token, market):
+    '''
+    Fetch the concerts of one market, look up their artists and bring its playlist up to
+    date, the way ``pipeline.run_search`` does for a search from the app
+
+    Args:
+        access_token (str): ``Bearer`` token for the user the playlist belongs to
+        market (dict): see ``read_markets``
+
+    Returns:
+        dict: the market with its ``outcome`` ('done', 'no_concerts' or 'failed'),
+            ``playlist_uri``, counts of ``events``, ``artists`` and ``tracks`` found and
+            ``tracks_added``, the ``seconds`` it took and any ``error``
+    '''
+    from listen_local_app.functions import get_concert_information
+    from listen_local_app.functions import iter_performer_rows
+    from listen_local_app.functions import NoConcertsFound
+    from listen_local_app.functions import process_daterange
+    from listen_local_app.pipeline import save_playlist_tracks
+
+    report = dict(market, outcome='failed', playlist_uri=None, events=0, artists=0,
+                  tracks=0, tracks_added=0, seconds=0.0, error=None)
+    started = time.time()
+    try:
+        date1, date2 = process_daterange(market['daterange'])
+        data = get_concert_information(market['zipcode'], date1=date1, date2=date2,
+                                       dist=market['radius'], stream=True)
+        counts = {}
+        rows = sorted(iter_performer_rows(data, progress=counts.update), key=lambda x: x[0])
+        tracks = [f"spotify:track:{d['spotify_top_track_id']}" for _, _, d in rows
+                  if isinstance(d['spotify_top_track_id'], str)]
+        playlist_id, report['playlist_uri'], created = _target_playlist(access_token, market)
+        report['tracks_added'] = save_playlist_tracks(access_token, playlist_id, tracks,
+                                                      created)
+        report.update(outcome='done', events=counts.get('events_fetched', 0),
+                      artists=len(rows), tracks=len(tracks))
+    except NoConcertsFound:
+        report['outcome'] = 'no_concerts'
+    except Exception as e:
+        report['error'] = repr(e)
+    report['seconds'] = round(time.time() - started, 3)
+    return report
+
+
+def _target_playlist(access_token, market):
+    '''
+    Return ``(playlist_id, playlist_uri, created)`` for the playlist a market fills
+    '''
+    from listen_local_app.playlists import get_or_create_playlist
+
+    playlist = market['playlist']
+    for prefix in _PLAYLIST_PREFIXES:
+        if playlist.startswith(prefix):
+            playlist_id = playlist[len(prefix):].split('?')[0]
+            return playlist_id, f"spotify:playlist:{playlist_id}", False
+    return get_or_create_playlist(access_token, market['zipcode'], market['daterange'],
+                                  market['radius'], name=playlist or None)
+
+
+def run_markets(markets, get_token, max_workers=bulk_max_workers, checkpoint=None,
+                budget=None):
+    '''
+    Run every market not already finished in ``checkpoint``, ``max_workers`` at a time
+
+    Args:
+        markets (list): see ``read_markets``
+        get_token (callable): returns the ``Bearer`` token to use
+        max_workers (int): markets run at once (default: from config.py)
+        checkpoint (Checkpoint): where finished markets are recorded (default: None)
+        budget (int): most upstream requests to spend; markets not started by the time
+            it is spent are reported as 'skipped' (default: no limit)
+
+    Returns:
+        list: a report (see ``run_market``) for every market, in the order given, with
+            the reports of markets finished in an earlier run marked ``resumed``
+    '''
+    checkpoint = checkpoint or Checkpoint(None)
+    started_calls = clients.call_count()
+
+    def _run(market):
+        if budget is not None and clients.call_count() - started_calls >= budget:
+            return dict(market, outcome='skipped', seconds=0.0, error=None)
+        try:
+            report = run_market(get_token(), market)
+        except Exception as e:  # e.g. the token couldn't be renewed
+            report = dict(market, outcome='failed', seconds=0.0, error=repr(e))
+        checkpoint.record(report)
+        return report
+
+    reports = [dict(checkpoint.reports[market_key(market)], resumed=True)
+               if checkpoint.finished(market) else None for market in markets]
+    pending = [market for market, report in zip(markets, reports) if report is None]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        ran = iter(list(executor.map(_run, pending)))
+    return [report or next(ran) for report in reports]
+
+
+def format_report(reports, seconds=None):
+    '''
+    Lay out market reports as a table followed by totals
+
+    Args:
+        reports (list): reports from ``run_markets``
+        seconds (float): wall time of the run (default: None)
+    '''
+    header = ("zipcode", "daterange", "radius", "outcome", "tracks", "added", "seconds")
+    lines = ["{:<8} {:<26} {:>6} {:<12} {:>6} {:>6} {:>8}".format(*header)]
+    totals = {}
+    for report in reports:
+        outcome = report['outcome'] + (' (resumed)' if report.get('resumed') else '')
+        lines.append("{:<8} {:<26} {:>6} {:<12} {:>6} {:>6} {:>8.1f}".format(
+            report['zipcode'], report['daterange'], report['radius'], outcome,
+            report.get('tracks', 0), report.get('tracks_added', 0), report['seconds']))
+        if report.get('error'):
+            lines.append(f"    {report['error']}")
+        totals[report['outcome']] = totals.get(report['outcome'], 0) + 1
+    summary = ", ".join(f"{n} {outcome}" for outcome, n in sorted(totals.items()))
+    lines.append(f"{len(reports)} markets: {summary}"
+                 + (f" in {seconds:.1f}s" if seconds is not None else ""))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('markets', help='CSV file of zipcode,daterange,radius,playlist rows')
+    parser.add_argument('--checkpoint',
+                        help='checkpoint file (default: <markets>.checkpoint.json)')
+    parser.add_argument('--workers', type=int, default=bulk_max_workers,
+                        help='markets run at once')
+    parser.add_argument('--rate', type=float, default=bulk_rate_limit,
+                        help='most upstream API requests per second, across all markets')
+    parser.add_argument('--budget', type=int,
+                        help='most upstream API requests to spend in this run')
+    parser.add_argument('--refresh-token', default=spotify_refresh_token,
+                        help="Spotify refresh token of the user who owns the playlists")
+    parser.add_argument('--report', help='also write the reports to this JSON file')
+    args = parser.parse_args(argv)
+    if not args.refresh_token:
+        parser.error("a Spotify refresh token is needed (--refresh-token or "
+                     "spotify_refresh_token in config.py)")
+
+    clients.set_rate_limit(args.rate)
+    checkpoint = Checkpoint(args.checkpoint or args.markets + '.checkpoint.json')
+    started = time.time()
+    reports = run_markets(read_markets(args.markets), UserToken(args.refresh_token),
+                          max_workers=args.workers, checkpoint=checkpoint,
+                          budget=args.budget)
+    print(format_report(reports, seconds=time.time() - started))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=1)
+    return reports
+
+
+if __name__ == '__main__':
+    main()
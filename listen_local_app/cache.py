@@ -0,0 +1,194 @@
+#!/usr/bin/python
+
+'''
+Small caching helpers used to avoid repeating slow upstream API calls
+'''
+
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class TTLCache:
+    '''
+    Thread-safe in-process LRU cache where every entry carries its own expiry time
+
+    Args:
+        maxsize (int): maximum number of entries kept before the least recently used
+            one is evicted (default: 1024)
+    '''
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        '''
+        Return the value stored for ``key`` or ``default`` if it is missing or expired
+        '''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl):
+        '''
+        Store ``value`` under ``key`` for ``ttl`` seconds
+        '''
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        '''
+        Return a dictionary of hit/miss counters and current size
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteStore:
+    '''
+    On-disk key/value store with expiry, backed by a single SQLite table. Values must be
+    JSON serializable, as must keys that aren't strings (e.g. tuples), which are stored
+    as their JSON text. Each thread gets its own connection so the store can be shared
+    by worker threads and by several app processes pointing at the same file. Expired
+    entries, and the entries past ``max_rows`` that expire soonest, are deleted every
+    ``purge_every`` writes made through this object.
+
+    Args:
+        path (str): location of the SQLite database file
+        table (str): name of the table holding the entries (default: 'cache')
+        purge_every (int): writes between purges of expired entries (default: 500)
+        max_rows (int): most entries kept after a purge, or ``None`` for no limit
+            (default: None)
+    '''
+    def __init__(self, path, table='cache', purge_every=500, max_rows=None):
+        self.path = path
+        self.table = table
+        self.purge_every = purge_every
+        self.max_rows = max_rows
+        self._writes = itertools.count(1)
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                         '(key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def get(self, key):
+        '''
+        Return ``(value, expires)`` for ``key`` or ``None`` if it is missing or expired
+        '''
+        row = self._connection().execute(
+            f'SELECT value, expires FROM {self.table} WHERE key = ?',
+            (_store_key(key),)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, ttl):
+        with self._connection() as conn:
+            conn.execute(f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)',
+                         (_store_key(key), json.dumps(value), time.time() + ttl))
+        if next(self._writes) % self.purge_every == 0:
+            self.purge_expired()
+
+    def items(self):
+        '''
+        Return a list of ``(key, value)`` for every entry that has not expired, with keys
+        that aren't strings as their JSON text
+        '''
+        rows = self._connection().execute(
+            f'SELECT key, value FROM {self.table} WHERE expires > ?', (time.time(),))
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def purge_expired(self):
+        '''
+        Delete every expired entry from the table, and then the entries that expire
+        soonest until at most ``max_rows`` are left
+        '''
+        with self._connection() as conn:
+            conn.execute(f'DELETE FROM {self.table} WHERE expires <= ?', (time.time(),))
+            if self.max_rows is not None:
+                conn.execute(f'DELETE FROM {self.table} WHERE key IN (SELECT key FROM '
+                             f'{self.table} ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+                             (self.max_rows,))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute(f'DELETE FROM {self.table}')
+
+
+def _store_key(key):
+    return key if isinstance(key, str) else json.dumps(key)
+
+
+class TieredCache(TTLCache):
+    '''
+    ``TTLCache`` backed by an optional ``SQLiteStore``. Lookups that miss in memory fall
+    through to disk, and disk hits are promoted back into memory for the time they have
+    left to live.
+
+    Args:
+        maxsize (int): maximum number of in-memory entries (default: 1024)
+        path (str): SQLite database file for the on-disk tier, or ``None`` to keep the
+            cache in memory only (default: None)
+        table (str): SQLite table name for this cache (default: 'cache')
+    '''
+    def __init__(self, maxsize=1024, path=None, table='cache'):
+        super().__init__(maxsize=maxsize)
+        self.store = SQLiteStore(path, table=table) if path else None
+
+    def get(self, key, default=None):
+        value = super().get(key, default=default)
+        if value is not default or self.store is None:
+            return value
+        stored = self.store.get(key)
+        if stored is None:
+            return default
+        value, expires = stored
+        with self._lock:
+            # Count this as a hit rather than the miss recorded by the memory tier
+            self.misses -= 1
+            self.hits += 1
+        super().set(key, value, expires - time.time())
+        return value
+
+    def set(self, key, value, ttl):
+        super().set(key, value, ttl)
+        if self.store is not None:
+            self.store.set(key, value, ttl)
+
+    def clear(self):
+        super().clear()
+        if self.store is not None:
+            self.store.clear()
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+
+'''
+Shared, pooled HTTP sessions for talking to the Seatgeek and Spotify APIs. One session
+is kept per upstream host so connections (and TLS handshakes) are reused across calls,
+requests and worker threads.
+'''
+
+import config
+import random
+import requests
+import threading
+import time
+
+from listen_local_app import metrics
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+
+
+# Upstream API locations, overridable so the app can be pointed at stand-in servers
+seatgeek_api_url = getattr(config, 'seatgeek_api_url', 'https://api.seatgeek.com/2')
+spotify_api_url = getattr(config, 'spotify_api_url', 'https://api.spotify.com/v1')
+spotify_accounts_url = getattr(config, 'spotify_accounts_url', 'https://accounts.spotify.com')
+
+http_timeout = getattr(config, 'http_timeout', 10)
+http_max_retries = getattr(config, 'http_max_retries', 3)
+http_backoff = getattr(config, 'http_backoff', 0.5)
+http_pool_size = getattr(config, 'http_pool_size', 16)
+http_max_retry_after = getattr(config, 'http_max_retry_after', 30)
+
+# Methods that are safe to send again after a 5xx or a dropped connection. Anything else
+# (e.g. creating a playlist) is only retried when the server says it was never processed.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# Requests sent upstream by this process, retries included
+_calls = [0]
+_calls_lock = threading.Lock()
+
+# Process-wide limit on the rate requests are sent at, see ``set_rate_limit``
+_rate_limiter = None
+
+
+class RetrySession(requests.Session):
+    '''
+    ``requests.Session`` with a default timeout and a connection pool sized for our
+    worker threads, which retries failed requests with jittered exponential backoff.
+
+    * connection errors, timeouts and 5xx responses are retried for idempotent methods
+    * connect timeouts are retried for every method
+    * 429 responses are retried for every method after waiting for ``Retry-After``
+
+    Args:
+        timeout (float): default timeout (s) for every request (default: from config.py)
+        max_retries (int): number of retries after the first attempt (default: from config.py)
+        backoff (float): base delay (s) for exponential backoff (default: from config.py)
+        pool_size (int): connections kept open per host (default: from config.py)
+        max_retry_after (float): longest ``Retry-After`` (s) we are willing to wait; a 429
+            asking for longer is returned to the caller (default: from config.py)
+    '''
+    def __init__(self, timeout=http_timeout, max_retries=http_max_retries, backoff=http_backoff,
+                 pool_size=http_pool_size, max_retry_after=http_max_retry_after):
+        super().__init__()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        if not metrics.enabled:
+            return self._request(method, url, **kwargs)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self._request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            metrics.observe('listen_local_upstream_seconds', time.perf_counter() - started,
+                            host=urlsplit(url).netloc, status=status)
+
+    def _request(self, method, url, **kwargs):
+        # Callers such as spotipy pass ``timeout=None`` when they have no timeout of their own
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            if _rate_limiter is not None:
+                _rate_limiter.acquire()
+            with _calls_lock:
+                _calls[0] += 1
+            metrics.count_call()
+            try:
+                response = super().request(method, url, **kwargs)
+            except requests.exceptions.ConnectTimeout:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries or not idempotent:
+                    raise
+                delay = self._backoff_delay(attempt)
+            else:
+                if attempt >= self.max_retries:
+                    return response
+                if response.status_code == 429:
+                    delay = self._retry_after(response, attempt)
+                    if delay > self.max_retry_after:
+                        return response
+                elif response.status_code >= 500 and idempotent:
+                    delay = self._backoff_delay(attempt)
+                else:
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _backoff_delay(self, attempt):
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def _retry_after(self, response, attempt):
+        try:
+            return float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return self._backoff_delay(attempt)
+
+
+class RateLimiter:
+    '''
+    Thread-safe token bucket letting callers through at ``rate`` per second on average,
+    with bursts of up to ``burst``. Callers over the rate sleep until their turn.
+
+    Args:
+        rate (float): calls allowed per second
+        burst (int): calls allowed at once after a quiet spell (default: 1)
+    '''
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Take a token even if there is none yet, which books the caller a later turn
+            self._tokens -= 1
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SpotifyAppToken:
+    '''
+    Thread-safe holder for the app's Spotify client-credentials token. The token is
+    fetched on first use and refreshed ``refresh_margin`` seconds before it expires, so a
+    single instance can be shared by every request and worker thread. Implements the
+    ``get_access_token`` interface spotipy expects from a ``client_credentials_manager``.
+
+    Args:
+        authorization (str): ``Basic`` authorization header for the app
+            (default: from config.py)
+        refresh_margin (float): seconds before expiry to fetch a new token (default: 60)
+    '''
+    def __init__(self, authorization=None, refresh_margin=60):
+        self.authorization = authorization or config.spotify_authorization
+        self.refresh_margin = refresh_margin
+        self._token_info = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def get_access_token(self, as_dict=False):
+        with self._lock:
+            if self._token_info is None or time.time() >= self._expires_at - self.refresh_margin:
+                self._refresh()
+            return dict(self._token_info) if as_dict else self._token_info['access_token']
+
+    def _refresh(self):
+        headers = {'Authorization': self.authorization, 'Accept': 'application/json'}
+        r = post(f"{spotify_accounts_url}/api/token", headers=headers,
+                 data={'grant_type': 'client_credentials'})
+        r.raise_for_status()
+        token_info = r.json()
+        self._expires_at = time.time() + token_info.get('expires_in', 3600)
+        self._token_info = token_info
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def call_count():
+    '''
+    Return the number of requests sent upstream by this process so far, retries included
+    '''
+    return _calls[0]
+
+
+def set_rate_limit(rate, burst=None):
+    '''
+    Cap the rate of every request sent upstream by this process, retries included, at
+    ``rate`` per second shared by all threads, or lift the cap if ``rate`` is ``None``
+
+    Args:
+        rate (float): requests per second
+        burst (int): requests allowed at once after a quiet spell (default: ``rate``)
+    '''
+    global _rate_limiter
+    _rate_limiter = RateLimiter(rate, burst or max(1, int(rate))) if rate else None
+
+
+def get_session(url):
+    '''
+    Return the shared ``RetrySession`` for the host of ``url``
+
+    Args:
+        url (str): any url on the upstream host
+    '''
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = RetrySession()
+        return session
+
+
+def request(method, url, **kwargs):
+    '''
+    Send a request through the shared session for the host of ``url``
+    '''
+    return get_session(url).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+
+'''
+Local store of seatgeek events indexed by venue location, so radius searches around any
+zipcode in an area fetched recently are answered without a seatgeek request.
+
+Events are filed in a grid of cells ``cell_degrees`` on a side. A cell is covered for a
+day once a complete seatgeek search whose circle holds the whole cell has been made for
+that day, and a search can be answered from the store while every cell its circle
+touches is covered and fresh. Zipcodes are placed at their centroid, learned from the
+``meta.geolocation`` of seatgeek zipcode searches or loaded from a gazetteer file.
+'''
+
+import csv
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE = EARTH_RADIUS_MILES * math.pi / 180
+
+_LAT_COLUMNS = ('lat', 'latitude', 'intptlat')
+_LON_COLUMNS = ('lon', 'lng', 'longitude', 'intptlong')
+_ZIPCODE_COLUMNS = ('zipcode', 'zip', 'postal_code', 'geoid', 'zcta5')
+
+
+def distance_miles(lat1, lon1, lat2, lon2):
+    '''
+    Great-circle distance in miles between two points given in degrees
+    '''
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+def read_gazetteer(path):
+    '''
+    Read zipcode centroids from a CSV or tab separated file with a header row naming
+    zipcode, latitude and longitude columns, e.g. the Census ZCTA gazetteer file
+    (GEOID, INTPTLAT, INTPTLONG) or a plain ``zipcode,lat,lon`` file
+
+    Returns:
+        list: ``(zipcode, lat, lon)`` tuples
+    '''
+    with open(path, newline='') as f:
+        header = f.readline()
+        f.seek(0)
+        reader = csv.reader(f, delimiter='\t' if '\t' in header else ',')
+        columns = [column.strip().lower() for column in next(reader)]
+        zip_i, lat_i, lon_i = [next((i for i, c in enumerate(columns) if c in names), None)
+                               for names in (_ZIPCODE_COLUMNS, _LAT_COLUMNS, _LON_COLUMNS)]
+        if None in (zip_i, lat_i, lon_i):
+            raise ValueError(f"{path} needs zipcode, latitude and longitude columns")
+        return [(row[zip_i].strip(), float(row[lat_i]), float(row[lon_i]))
+                for row in reader if row and row[zip_i].strip()]
+
+
+class EventStore:
+    '''
+    SQLite store of seatgeek events and zipcode centroids. Each thread gets its own
+    connection so the store can be shared by worker threads and app processes.
+
+    Args:
+        path (str): location of the SQLite database file
+        ttl (float): seconds a fetched cell stays fresh (default: 10 minutes)
+        cell_degrees (float): side of the grid cells in degrees (default: 0.05, about
+            3.5mi north to south)
+        gazetteer (str): zipcode centroid file to load on first use, see
+            ``read_gazetteer`` (default: None)
+    '''
+    def __init__(self, path, ttl=10 * 60, cell_degrees=0.05, gazetteer=None):
+        self.path = path
+        self.ttl = ttl
+        self.cell_degrees = cell_degrees
+        self.gazetteer = gazetteer
+        self.hits = 0
+        self.misses = 0
+        self._gazetteer_loaded = gazetteer is None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().executescript('''
+            CREATE TABLE IF NOT EXISTS zipcodes
+                (zipcode TEXT PRIMARY KEY, lat REAL, lon REAL);
+            CREATE TABLE IF NOT EXISTS events
+                (id TEXT PRIMARY KEY, day TEXT, cell_i INTEGER, cell_j INTEGER,
+                 lat REAL, lon REAL, event TEXT, fetched REAL);
+            CREATE INDEX IF NOT EXISTS events_by_day_cell ON events (day, cell_i, cell_j);
+            CREATE TABLE IF NOT EXISTS coverage
+                (day TEXT, cell_i INTEGER, cell_j INTEGER, fetched REAL,
+                 PRIMARY KEY (day, cell_i, cell_j));
+        ''')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def centroid(self, zipcode):
+        '''
+        Return the ``(lat, lon)`` of ``zipcode`` or ``None`` if it isn't known
+        '''
+        if not self._gazetteer_loaded:
+            with self._lock:
+                if not self._gazetteer_loaded:
+                    try:
+                        self.add_centroids(read_gazetteer(self.gazetteer), replace=False)
+                    except (OSError, ValueError) as e:
+                        print(f"Could not load zipcode centroids from {self.gazetteer}: {e!r}")
+                    self._gazetteer_loaded = True
+        return self._connection().execute(
+            'SELECT lat, lon FROM zipcodes WHERE zipcode = ?', (str(zipcode),)).fetchone()
+
+    def add_centroids(self, centroids, replace=True):
+        '''
+        Record ``(zipcode, lat, lon)`` centroids, keeping those already known unless
+        ``replace`` is set
+        '''
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+        with self._connection() as conn:
+            conn.executemany(f'{verb} INTO zipcodes VALUES (?, ?, ?)',
+                             ((str(z), float(lat), float(lon)) for z, lat, lon in centroids))
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def cells(self, lat, lon, radius):
+        '''
+        Return the grid cells the circle of ``radius`` miles around ``(lat, lon)``
+        touches, as ``((i, j), farthest)`` pairs where ``farthest`` is the distance (mi)
+        from the center to the far corner of the cell
+        '''
+        size = self.cell_degrees
+        dlat = radius / MILES_PER_DEGREE
+        dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+        cells = []
+        for i in range(math.floor((lat - dlat) / size), math.floor((lat + dlat) / size) + 1):
+            lat0, lat1 = i * size, (i + 1) * size
+            for j in range(math.floor((lon - dlon) / size),
+                           math.floor((lon + dlon) / size) + 1):
+                lon0, lon1 = j * size, (j + 1) * size
+                nearest = distance_miles(lat, lon, min(max(lat, lat0), lat1),
+                                         min(max(lon, lon0), lon1))
+                if nearest > radius:
+                    continue
+                farthest = max(distance_miles(lat, lon, corner_lat, corner_lon)
+                               for corner_lat in (lat0, lat1) for corner_lon in (lon0, lon1))
+                cells.append(((i, j), farthest))
+        return cells
+
+    def covers(self, lat, lon, radius, days):
+        '''
+        Return whether every cell the search circle touches has been fetched for every
+        one of ``days`` (consecutive 'YYYY-MM-DD' dates) within the last ``ttl`` seconds
+        '''
+        cells = {cell for cell, _ in self.cells(lat, lon, radius)}
+        rows = self._connection().execute(
+            'SELECT day, cell_i, cell_j FROM coverage WHERE fetched > ? AND ' + _WITHIN,
+            [time.time() - self.ttl] + _bounds(cells, days))
+        fresh = {(day, (i, j)) for day, i, j in rows}
+        covered = all((day, cell) in fresh for day in days for cell in cells)
+        if covered:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return covered
+
+    def fetch_radius(self, lat, lon, radius):
+        '''
+        Return the radius (whole miles) of a search around ``(lat, lon)`` that would
+        cover every cell a search of ``radius`` touches
+        '''
+        return math.ceil(max([radius] + [farthest for _, farthest
+                                         in self.cells(lat, lon, radius)]))
+
+    def add_events(self, lat, lon, radius, days, events, complete=True):
+        '''
+        Store the events of a seatgeek search of ``radius`` miles around ``(lat, lon)``
+        for ``days``. When the search was ``complete`` (every page read) the cells it
+        fully covers are marked as fetched for those days, replacing what was stored
+        for them. Entries older than ``ttl`` are dropped.
+        '''
+        now = time.time()
+        rows = []
+        for event in events:
+            try:
+                location = event['venue']['location']
+                event_lat, event_lon = float(location['lat']), float(location['lon'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            rows.append((str(event['id']), event.get('datetime_local', '')[:10])
+                        + self._cell(event_lat, event_lon)
+                        + (event_lat, event_lon, json.dumps(event), now))
+        covered = [(day,) + cell for cell, farthest in self.cells(lat, lon, radius)
+                   if farthest <= radius for day in days] if complete else []
+        with self._connection() as conn:
+            conn.executemany('DELETE FROM events WHERE day = ? AND cell_i = ? AND cell_j = ?',
+                             covered)
+            conn.executemany('INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             rows)
+            conn.executemany('INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?)',
+                             [key + (now,) for key in covered])
+            conn.execute('DELETE FROM events WHERE fetched <= ?', (now - self.ttl,))
+            conn.execute('DELETE FROM coverage WHERE fetched <= ?', (now - self.ttl,))
+
+    def events(self, lat, lon, radius, days):
+        '''
+        Return the stored events within ``radius`` miles of ``(lat, lon)`` on ``days``
+        (consecutive 'YYYY-MM-DD' dates), ordered by start time
+        '''
+        cells = [cell for cell, _ in self.cells(lat, lon, radius)]
+        rows = self._connection().execute('SELECT lat, lon, event FROM events WHERE ' + _WITHIN,
+                                          _bounds(cells, days))
+        events = [json.loads(event) for event_lat, event_lon, event in rows
+                  if distance_miles(lat, lon, event_lat, event_lon) <= radius]
+        return sorted(events, key=lambda event: (event.get('datetime_local', ''),
+                                                 str(event['id'])))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM events')
+            conn.execute('DELETE FROM coverage')
+            conn.execute('DELETE FROM zipcodes')
+        self._gazetteer_loaded = self.gazetteer is None
+        self.hits = self.misses = 0
+
+    def stats(self):
+        '''
+        Return a dictionary of hit/miss counters for ``covers``
+        '''
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+# Rows for a range of days within a block of cells, see ``_bounds``
+_WITHIN = 'day BETWEEN ? AND ? AND cell_i BETWEEN ? AND ? AND cell_j BETWEEN ? AND ?'
+
+
+def _bounds(cells, days):
+    rows, columns = [i for i, _ in cells], [j for _, j in cells]
+    return [min(days), max(days), min(rows), max(rows), min(columns), max(columns)]
@@ -7,23 +7,94 @@ This file holds the functions necessary to process the data behind the scenes
 
 import config
 import json
-import pandas as pd
-import requests
-import spotipy
+import math
+import queue
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask
+from datetime import timedelta
+from itertools import chain
 from flask import request
-from numpy import nan
-from spotipy.oauth2 import SpotifyClientCredentials
+from listen_local_app import clients
+from listen_local_app import metrics
+from listen_local_app.artist_index import ArtistIndex
+from listen_local_app.artist_index import match_key
+from listen_local_app.cache import TieredCache
+from listen_local_app.event_store import distance_miles
+from listen_local_app.event_store import EventStore
+from listen_local_app.jsonstream import iter_array_items
+from listen_local_app.listings import format_local_datetime
+from listen_local_app.singleflight import SingleFlight
+from threading import Lock
+from threading import Thread
+
+# pandas and spotipy are slow to import, so they are only imported inside the functions
+# that need them, the first time a search actually runs. ``nan`` is the same float
+# numpy uses for missing values.
+nan = float('nan')
+
+# Marks the end of the performers submitted in ``iter_spotify_artist_tracks``
+_SUBMITTED = object()
 
-
-app = Flask(__name__)
-app.config.from_object('config')
-
-spotify_client_id = config.spotify_client_id.decode('utf-8')
-spotify_client_secret = config.spotify_client_secret.decode('utf-8')
 seatgeek_client_id = config.seatgeek_client_id
+seatgeek_max_workers = getattr(config, 'seatgeek_max_workers', 4)
+seatgeek_max_pages = getattr(config, 'seatgeek_max_pages', 20)
+seatgeek_shard_days = getattr(config, 'seatgeek_shard_days', False)
+seatgeek_max_shard_days = getattr(config, 'seatgeek_max_shard_days', 31)
+spotify_max_workers = getattr(config, 'spotify_max_workers', 8)
+
+# Searches run until this time on their last day; day shards cover the whole day
+DAY_END = '23:00:00'
+WHOLE_DAY_END = '23:59:59'
+
+# Cache of (zipcode, date1, date2) -> (radius, seatgeek response) for the largest radius
+# fetched recently; smaller radius searches are answered by filtering that response
+seatgeek_cache = TieredCache(maxsize=getattr(config, 'seatgeek_cache_size', 256),
+                             path=getattr(config, 'seatgeek_cache_path', None),
+                             table='seatgeek_events')
+seatgeek_cache_ttl = getattr(config, 'seatgeek_cache_ttl', 10 * 60)
+
+# Events by venue location, answering searches around any zipcode in an area fetched
+# recently; when it can't, only the area is fetched (by lat/lon) and stored
+event_store_path = getattr(config, 'event_store_path', None)
+event_store = (EventStore(event_store_path,
+                          ttl=getattr(config, 'event_store_ttl', 10 * 60),
+                          cell_degrees=getattr(config, 'event_store_cell_degrees', 0.05),
+                          gazetteer=getattr(config, 'zipcode_centroids_path', None))
+               if event_store_path else None)
+
+# Cache of performer name -> (spotify artist id, top track id) lookups
+artist_cache = TieredCache(maxsize=getattr(config, 'artist_cache_size', 4096),
+                           path=getattr(config, 'artist_cache_path', None),
+                           table='spotify_artists')
+artist_cache_ttl = getattr(config, 'artist_cache_ttl', 7 * 24 * 3600)
+artist_not_found_ttl = getattr(config, 'artist_not_found_ttl', 24 * 3600)
+artist_no_tracks_ttl = getattr(config, 'artist_no_tracks_ttl', 24 * 3600)
+
+# Concurrent identical seatgeek searches and artist lookups wait for the one in flight
+# and read its result from the cache. With a lock directory this spans app processes.
+single_flight_lock_dir = getattr(config, 'single_flight_lock_dir', None)
+single_flight_timeout = getattr(config, 'single_flight_timeout', 30)
+seatgeek_flights = SingleFlight('seatgeek', lock_dir=single_flight_lock_dir,
+                                timeout=single_flight_timeout)
+artist_flights = SingleFlight('spotify-artist', lock_dir=single_flight_lock_dir,
+                              timeout=single_flight_timeout)
+
+
+def _past_resolutions():
+    if artist_cache.store is None:
+        return []
+    return [(name, value[0]) for name, value in artist_cache.store.items()
+            if not _isnull(value[0])]
+
+
+# Index of performers already matched to Spotify artists, kept alongside the artist cache
+# and seeded from it, so known performers skip the Spotify search
+artist_index = ArtistIndex(path=getattr(config, 'artist_cache_path', None),
+                           ttl=getattr(config, 'artist_index_ttl', 90 * 24 * 3600),
+                           min_similarity=getattr(config, 'artist_index_min_similarity', 0.85),
+                           seed=_past_resolutions,
+                           max_names=getattr(config, 'artist_index_max_names', 50000))
 
 
 def process_daterange(daterange):
@@ -43,111 +114,709 @@ def process_daterange(daterange):
 
 
 def get_concert_information(zipcode, date1, date2, dist=3, per_page=100,
-                            client_id=seatgeek_client_id):
+                            client_id=seatgeek_client_id, stream=False,
+                            max_workers=seatgeek_max_workers, use_cache=True, refresh=False,
+                            shard=seatgeek_shard_days, end_time=DAY_END):
     '''
-    Fetch concert information from seatgeek
+    Fetch concert information from seatgeek, following the paging info in the response
+    ``meta`` so that searches with more than ``per_page`` results are not cut short
 
     Args:
         zipcode (str): zipcode to search near
         date1 (str): min date of search
         date2 (str): max date of search
         dist (str): distance (mi) around zipcode for search (default 3)
-        per_page (int): maximum number of results (default: 100)
+        per_page (int): number of results per page requested (default: 100)
         client_id (str): seatgeek client id (default: from config.py)
+        stream (bool): if True ``data['events']`` is a generator yielding events as
+            pages arrive instead of a list of every event (default: False)
+        max_workers (int): number of pages after the first to fetch at once
+            (default: from config.py)
+        use_cache (bool): answer from ``seatgeek_cache`` when a response for the same
+            zipcode and dates with the same or a larger radius is cached, or else from
+            ``event_store`` if there is one (default: True)
+        refresh (bool): with ``use_cache``, fetch from seatgeek even when a response is
+            cached and replace it (default: False)
+        shard (bool): with ``use_cache``, split ranges of up to ``seatgeek_max_shard_days``
+            days into whole day searches that are cached on their own, so overlapping
+            ranges share them. Missing days are fetched ``max_workers`` at a time.
+            (default: from config.py)
+        end_time (str): time of day on ``date2`` the search runs until (default:
+            ``DAY_END``)
+
+    Returns:
+        dict: first page of the seatgeek api response with ``events`` holding the events
+            from every page
     '''
     # Get dates in formate seatgeek likes
     if not date2:
         date2 = date1
+    if shard and use_cache and date1 != date2:
+        days = _days_between(date1, date2)
+        if 1 < len(days) <= seatgeek_max_shard_days:
+            return _get_sharded_concert_information(zipcode, days, dist, per_page, client_id,
+                                                    stream, max_workers, refresh)
     datetime1 = f'{date1}T00:00:00'
-    datetime2 = f'{date2}T23:00:00'
+    datetime2 = f'{date2}T{end_time}'
+
+    # Searches ending at another time than usual are cached apart
+    cache_key = (zipcode, date1, date2) if end_time == DAY_END else \
+        (zipcode, date1, date2, end_time)
+    flight = None
+    if use_cache and not refresh:
+        data = _get_cached_concert_information(cache_key, float(dist))
+        if data is None and event_store is not None and end_time == DAY_END:
+            data = _get_stored_concert_information(zipcode, date1, date2, float(dist),
+                                                   per_page, client_id, max_workers)
+        if data is None:
+            # Wait for any other caller already fetching this search instead of repeating it
+            flight = seatgeek_flights.lead(cache_key)
+            if flight is None:
+                data = _get_cached_concert_information(cache_key, float(dist))
+        if data is not None:
+            if len(data['events']) < 1:
+                raise NoConcertsFound
+            if stream:
+                data['events'] = iter(data['events'])
+            return data
 
     # seatgeek API request
-    params = {"geoip": zipcode, "type": "concert",
-              "per_page": per_page, "range": f"{dist}mi",
-              "datetime_local.gte": datetime1, "datetime_local.lte": datetime2}
-    base_url = f"https://api.seatgeek.com/2/events?client_id={client_id}"
-    param_str = "&".join([f"{i}={v}" for i, v in params.items()])
-    response = requests.get(base_url + "&" + param_str)
-    data = response.json()
-    if response.status_code == 200:
+    url = _seatgeek_events_url({"geoip": zipcode, "type": "concert",
+                                "per_page": per_page, "range": f"{dist}mi",
+                                "datetime_local.gte": datetime1,
+                                "datetime_local.lte": datetime2}, client_id)
+    try:
+        data = _get_seatgeek_page(url)
+        first_events = data['events']
+        first_event = next(first_events, None)
         # If there are no concerts raise exception
-        if len(data['events']) < 1:
+        if first_event is None:
+            data['events'] = []
+            if use_cache:
+                seatgeek_cache.set(cache_key, (float(dist), data), seatgeek_cache_ttl)
+                _store_seatgeek_events(cache_key, float(dist), data, [])
             raise NoConcertsFound
-        return data
-    else:
+
+        events = _iter_seatgeek_events(chain([first_event], first_events), data, url,
+                                       per_page, max_workers)
+        if use_cache:
+            events = _cache_seatgeek_events(cache_key, float(dist), data, events, flight)
+        data['events'] = events if stream else list(events)
+    except BaseException:
+        if flight is not None:
+            flight.done()
+        raise
+    return data
+
+
+def _seatgeek_events_url(params, client_id):
+    base_url = f"{clients.seatgeek_api_url}/events?client_id={client_id}"
+    return base_url + "&" + "&".join([f"{i}={v}" for i, v in params.items()])
+
+
+def _days_between(date1, date2):
+    '''
+    Return every day from ``date1`` to ``date2`` (both 'YYYY-MM-DD') as strings, or an
+    empty list if they can't be read as dates
+    '''
+    try:
+        first = datetime.strptime(date1, "%Y-%m-%d").date()
+        last = datetime.strptime(date2, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return []
+    return [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+
+
+def _get_sharded_concert_information(zipcode, days, dist, per_page, client_id, stream,
+                                     max_workers, refresh):
+    '''
+    Answer a multi-day search from whole day searches, each served from
+    ``seatgeek_cache`` when it can be, and merge them into one response. Events on the
+    last day after ``DAY_END`` are left out, as a search of the whole range would.
+    '''
+    def _get_day(day):
+        try:
+            return get_concert_information(zipcode, day, None, dist=dist, per_page=per_page,
+                                           client_id=client_id, max_workers=1,
+                                           refresh=refresh, shard=False,
+                                           end_time=WHOLE_DAY_END)
+        except NoConcertsFound:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        shards = [data for data in executor.map(metrics.propagate(_get_day), days)
+                  if data is not None]
+    if not shards:
+        raise NoConcertsFound
+
+    last = f'{days[-1]}T{DAY_END}'
+    events = list({event['id']: event for data in shards for event in data['events']
+                   if event.get('datetime_local', '') <= last}.values())
+    if not events:
+        raise NoConcertsFound
+    data = dict(shards[0], events=iter(events) if stream else events)
+    data['meta'] = dict(shards[0].get('meta') or {}, total=len(events), page=1)
+    return data
+
+
+def _get_cached_concert_information(cache_key, dist):
+    '''
+    Return a copy of the cached seatgeek response for ``cache_key`` narrowed down to
+    ``dist`` miles, or ``None`` if there is no cached response covering that radius
+    '''
+    cached = seatgeek_cache.get(cache_key)
+    if cached is None:
+        return None
+    cached_dist, cached_data = cached
+    if dist == cached_dist:
+        return dict(cached_data, events=list(cached_data['events']))
+    if dist > cached_dist:
+        return None
+
+    try:
+        center = cached_data['meta']['geolocation']
+        events = [event for event in cached_data['events']
+                  if distance_miles(center['lat'], center['lon'],
+                                    event['venue']['location']['lat'],
+                                    event['venue']['location']['lon']) <= dist]
+    except (KeyError, TypeError):
+        # Without coordinates we can't tell which events fall inside the smaller radius
+        return None
+    return dict(cached_data, events=events)
+
+
+def _cache_seatgeek_events(cache_key, dist, data, events, flight=None):
+    '''
+    Pass ``events`` through and store the complete response in ``seatgeek_cache`` once
+    every page has been read, then finish ``flight`` so waiting callers read it
+    '''
+    collected = []
+    try:
+        for event in events:
+            collected.append(event)
+            yield event
+        seatgeek_cache.set(cache_key, (dist, dict(data, events=collected)), seatgeek_cache_ttl)
+        _store_seatgeek_events(cache_key, dist, data, collected)
+    finally:
+        if flight is not None:
+            flight.done()
+
+
+def _store_seatgeek_events(cache_key, dist, data, events):
+    '''
+    Add the events of a complete zipcode search to ``event_store``, placed around the
+    zipcode location seatgeek sent back
+    '''
+    if event_store is None:
+        return
+    try:
+        center = data['meta']['geolocation']
+        lat, lon = float(center['lat']), float(center['lon'])
+    except (KeyError, TypeError, ValueError):
+        return
+    zipcode, date1, date2 = cache_key[:3]
+    event_store.add_centroids([(zipcode, lat, lon)])
+    event_store.add_events(lat, lon, dist, _days_between(date1, date2), events,
+                           complete=len(events) >= (data['meta'].get('total') or 0))
+
+
+def _get_stored_concert_information(zipcode, date1, date2, dist, per_page, client_id,
+                                    max_workers):
+    '''
+    Answer a search from ``event_store``, first fetching the events around the zipcode
+    if the cells the search touches aren't all covered and fresh. Returns ``None`` when
+    the zipcode's location or the dates aren't known.
+    '''
+    center = event_store.centroid(zipcode)
+    days = _days_between(date1, date2)
+    if center is None or not days:
+        return None
+    lat, lon = center
+    events = None
+    if not event_store.covers(lat, lon, dist, days):
+        flight = seatgeek_flights.lead(('area', lat, lon, dist, date1, date2))
+        if flight is not None:
+            try:
+                events = _fetch_area_events(lat, lon, dist, days, per_page, client_id,
+                                            max_workers)
+            finally:
+                flight.done()
+        elif not event_store.covers(lat, lon, dist, days):
+            return None
+    if events is None:
+        events = event_store.events(lat, lon, dist, days)
+    return {'events': events,
+            'meta': {'geolocation': {'lat': lat, 'lon': lon, 'postal_code': zipcode},
+                     'total': len(events), 'page': 1, 'per_page': per_page}}
+
+
+def _fetch_area_events(lat, lon, dist, days, per_page, client_id, max_workers):
+    '''
+    Fetch the events around ``(lat, lon)`` over a radius covering every cell a search
+    of ``dist`` touches and store them, returning those within ``dist``
+    '''
+    radius = event_store.fetch_radius(lat, lon, dist)
+    url = _seatgeek_events_url({"lat": lat, "lon": lon, "type": "concert",
+                                "per_page": per_page, "range": f"{radius}mi",
+                                "datetime_local.gte": f'{days[0]}T00:00:00',
+                                "datetime_local.lte": f'{days[-1]}T23:00:00'}, client_id)
+    data = _get_seatgeek_page(url)
+    events = list(_iter_seatgeek_events(data['events'], data, url, per_page, max_workers))
+    total = (data.get('meta') or {}).get('total') or 0
+    event_store.add_events(lat, lon, radius, days, events, complete=len(events) >= total)
+    return [event for event in events
+            if _event_distance(lat, lon, event) <= dist]
+
+
+def _event_distance(lat, lon, event):
+    try:
+        location = event['venue']['location']
+        return distance_miles(lat, lon, location['lat'], location['lon'])
+    except (KeyError, TypeError):
+        return math.inf
+
+
+def _get_seatgeek_page(url):
+    '''
+    Request a page of seatgeek events. The events are parsed one at a time as the
+    response is read and cut down to the fields we use (see ``_compact_event``), so the
+    full payload is never held in memory. The request is timed as the 'seatgeek' stage
+    and reading and parsing its events as 'seatgeek_events'.
+
+    Returns:
+        dict: the page, with ``events`` a generator of events. The other keys of the
+            response (e.g. ``meta``) are filled in once the events have been read.
+    '''
+    with metrics.timed('seatgeek'):
+        response = clients.get(url, stream=True)
+    if response.status_code != 200:
+        response.close()
         raise FailedApiRequestError
+    data = {}
+    data['events'] = metrics.timed_iter('seatgeek_events', _iter_page_events(response, data))
+    return data
+
+
+def _iter_page_events(response, data):
+    try:
+        for event in iter_array_items(response.iter_content(chunk_size=16 * 1024), 'events',
+                                      data):
+            yield _compact_event(event)
+    finally:
+        response.close()
+
+
+def _get_seatgeek_page_events(url):
+    return list(_get_seatgeek_page(url)['events'])
+
 
+_EVENT_FIELDS = ('id', 'title', 'datetime_local')
+_VENUE_FIELDS = ('id', 'name', 'address', 'extended_address')
 
-def build_df_and_get_spotify_info(data):
+
+def _compact_event(event):
+    '''
+    Keep only the parts of a seatgeek event used for listings, caching and distances
+    '''
+    compact = {field: event[field] for field in _EVENT_FIELDS if field in event}
+    venue = event.get('venue')
+    if venue is not None:
+        compact['venue'] = {field: venue[field] for field in _VENUE_FIELDS if field in venue}
+        location = venue.get('location')
+        if location is not None:
+            compact['venue']['location'] = {'lat': location.get('lat'),
+                                            'lon': location.get('lon')}
+    if 'performers' in event:
+        compact['performers'] = []
+        for performer in event['performers']:
+            p = {'id': performer.get('id'), 'short_name': performer.get('short_name')}
+            if performer.get('genres'):
+                p['genres'] = [{'name': performer['genres'][0].get('name')}]
+            compact['performers'].append(p)
+    return compact
+
+
+def _iter_seatgeek_events(first_events, first_page, url, per_page, max_workers):
+    '''
+    Yield ``first_events`` and then the events of every later page reported by the
+    ``meta.total`` of ``first_page`` (read once its events are). Later pages are fetched
+    in order, ``max_workers`` at a time.
+    '''
+    yield from first_events
+
+    total = (first_page.get('meta') or {}).get('total') or 0
+    n_pages = min(math.ceil(total / per_page), seatgeek_max_pages)
+    page_urls = [f"{url}&page={page}" for page in range(2, n_pages + 1)]
+    if max_workers > 1 and len(page_urls) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for events in executor.map(metrics.propagate(_get_seatgeek_page_events),
+                                       page_urls):
+                yield from events
+    else:
+        for page_url in page_urls:
+            yield from _get_seatgeek_page(page_url)['events']
+
+
+_spotify_client = None
+_spotify_client_lock = Lock()
+
+
+def get_spotify_client():
+    '''
+    Return the process-wide ``spotipy.Spotify`` client. It is created on first use and
+    shares one app token (see ``clients.SpotifyAppToken``) and one pooled session
+    across every request and worker thread.
+    '''
+    global _spotify_client
+    with _spotify_client_lock:
+        if _spotify_client is None:
+            import spotipy
+
+            # Use spotipy for its great support for large volume of requests
+            _spotify_client = spotipy.Spotify(
+                client_credentials_manager=clients.SpotifyAppToken(),
+                requests_session=clients.get_session(clients.spotify_api_url),
+                requests_timeout=clients.http_timeout)
+            _spotify_client.prefix = clients.spotify_api_url + '/'
+        return _spotify_client
+
+
+_lookup_pool = None
+_lookup_pool_lock = Lock()
+
+
+def get_lookup_pool():
+    '''
+    Return the process-wide pool of ``spotify_max_workers`` threads that runs Spotify
+    artist lookups for every search, so concurrent searches share the workers (and the
+    ``http_pool_size`` connections of the Spotify session) rather than each starting
+    their own.
+    '''
+    global _lookup_pool
+    with _lookup_pool_lock:
+        if _lookup_pool is None:
+            _lookup_pool = ThreadPoolExecutor(max_workers=spotify_max_workers,
+                                              thread_name_prefix='spotify-lookup')
+        return _lookup_pool
+
+
+def build_df_and_get_spotify_info(data, progress=None):
     '''
     Take cocert information from the seatgeek API, make a dataframe, and populate
     with Spotify artist and track infomration
 
     Args:
-        data (dict): dictionary from seatgeek api response
+        data (dict): dictionary from seatgeek api response, ``events`` may be a list or a
+            generator from ``get_concert_information(..., stream=True)``
+        progress (callable): called with keyword counts ``events_fetched``,
+            ``artists_found`` and ``artists_resolved`` as the work advances (default: None)
 
     Returns:
         pandas.DataFrame: dataframe with cncert and artist information in it
     '''
+    import pandas as pd
 
-    # Use spotipy for its great support for large volume of requests
-    client_credentials_manager = SpotifyClientCredentials(client_id=spotify_client_id,
-                                                          client_secret=spotify_client_secret)
-    sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+    # Put performers back in the order they were first seen in
+    performers = sorted(iter_performer_rows(data, progress=progress), key=lambda x: x[0])
 
-    # Pull select data fields and put into pandas dataframe
-    df_dict = {}
-    for event in data['events']:
-        for performer in event['performers']:
-            d = {}
-            d['performer'] = performer['short_name']
-            try:
-                d['genre'] = performer['genres'][0]['name']
-            except KeyError:
-                d['genre'] = "NA"
-            d['datetime_local'] = event['datetime_local']
-            dt = datetime.strptime(d['datetime_local'], "%Y-%m-%dT%H:%M:%S")
-            d['date_local'] = dt.strftime("%b %d %Y")
-            d['time_local'] = dt.strftime("%I:%M%p")
-            d['event_id'] = event['id']
-            d['event_title'] = event['title']
-            d['venue_name'] = event['venue']['name']
-            d['venue_id'] = event['venue']['id']
-            d['venue_address'] = f"{event['venue']['address']}, {event['venue']['extended_address']}"  # noqa
-
-            # # Spotify searching
-            spotify_artist_id, spotify_top_track_id = lookup_spotify_artist_track(sp, d['performer'])  # noqa
-            d['spotify_artist_id'] = spotify_artist_id
-            d['spotify_top_track_id'] = spotify_top_track_id
-
-            # Performer information to dictionary
-            df_dict[performer['id']] = d
-
-    df = pd.DataFrame(df_dict).T
+    df = pd.DataFrame.from_records([row.values() for _, _, row in performers],
+                                   index=[performer_id for _, performer_id, _ in performers],
+                                   columns=PerformerRow.__slots__)
     df['spotify_top_track_uri'] = df.spotify_top_track_id.dropna().apply(lambda x: f"spotify:track:{x}")  # noqa
     return df
 
 
-def lookup_spotify_artist_track(sp, performer_name):
+def iter_performer_rows(data, progress=None, should_stop=None):
+    '''
+    Pull select data fields for every performer in the seatgeek response and yield them,
+    with Spotify artist and track information, as soon as each performer's lookup is done.
+    Each new performer is handed to the Spotify lookup pool as soon as its event arrives,
+    so lookups for the first page of events run while later pages are still being fetched.
+    A performer playing several events is looked up once, and performers listed under
+    different ids with the same name share one lookup.
+
+    Args:
+        data (dict): dictionary from seatgeek api response, ``events`` may be a list or a
+            generator from ``get_concert_information(..., stream=True)``
+        progress (callable): see ``build_df_and_get_spotify_info`` (default: None)
+        should_stop (callable): see ``iter_spotify_artist_tracks`` (default: None)
+
+    Yields:
+        tuple: ``(position, performer_id, row)`` where ``position`` is the order in
+            which the performer was first seen and ``row`` its ``PerformerRow``
+    '''
+    sp = get_spotify_client()
+    rows = {}
+
+    def _new_performers():
+        for n_events, event in enumerate(data['events'], 1):
+            if progress:
+                progress(events_fetched=n_events, artists_found=len(rows))
+            for performer in event['performers']:
+                # Performers seen again keep their row (and lookup) but take the newer event
+                row = rows.get(performer['id'])
+                is_new = row is None
+                if is_new:
+                    row = rows[performer['id']] = PerformerRow()
+                row.set_event(event, performer)
+                if is_new:
+                    yield (len(rows) - 1, performer['id']), row.performer, performer['id']
+        if progress:
+            progress(artists_found=len(rows))
+
+    # Spotify searching, run concurrently across all performers
+    for (position, performer_id), spotify_info in iter_spotify_artist_tracks(
+            sp, _new_performers(), progress=progress, should_stop=should_stop):
+        row = rows[performer_id]
+        row.spotify_artist_id, row.spotify_top_track_id = spotify_info
+        yield position, performer_id, row
+
+
+class PerformerRow:
+    '''
+    Listing fields for one performer and the event they were last seen playing, with
+    their Spotify artist and top track ids. Fields can also be read and set by name,
+    e.g. ``row['venue_name']``.
+    '''
+    __slots__ = ('performer', 'genre', 'datetime_local', 'date_local', 'time_local',
+                 'event_id', 'event_title', 'venue_name', 'venue_id', 'venue_address',
+                 'spotify_artist_id', 'spotify_top_track_id')
+
+    def __init__(self):
+        self.spotify_artist_id = self.spotify_top_track_id = nan
+
+    def set_event(self, event, performer):
+        self.performer = performer['short_name']
+        try:
+            self.genre = performer['genres'][0]['name']
+        except (KeyError, IndexError):
+            self.genre = "NA"
+        self.datetime_local = event['datetime_local']
+        self.date_local, self.time_local = format_local_datetime(self.datetime_local)
+        self.event_id = event['id']
+        self.event_title = event['title']
+        venue = event['venue']
+        self.venue_name = venue['name']
+        self.venue_id = venue['id']
+        self.venue_address = f"{venue['address']}, {venue['extended_address']}"
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def values(self):
+        return [getattr(self, field) for field in self.__slots__]
+
+
+def lookup_spotify_artist_track(sp, performer_name, performer_id=None):
     '''
-    Look up the artist id and the top song by said artist for a given performer
+    Look up the artist id and the top song by said artist for a given performer. Known
+    performers are matched in ``artist_index`` without searching Spotify; otherwise the
+    search result whose name matches the performer's is used, falling back to the top
+    result, and added to the index.
 
     Args:
         sp (spotipy.Spotify): actively credentialed ``spotipy.Spotify`` object
         performer_name (str): name of performer to look up info on
+        performer_id: seatgeek id of the performer (default: None)
     '''
-    artist_sp_results = sp.search(q='artist:' + performer_name, type='artist')
-    # NEED TO MATCH EXACT MATCH THEN TOP RESULT
-    if len(artist_sp_results['artists']['items']) == 0:
-        return nan, nan
-    spotify_artist_id = artist_sp_results['artists']['items'][0]['id']
-    top_track_results = sp.artist_top_tracks(artist_id=spotify_artist_id)
+    spotify_artist_id = artist_index.match(performer_name, performer_id)
+    if spotify_artist_id is None:
+        with metrics.timed('spotify_search'):
+            artist_sp_results = sp.search(q='artist:' + performer_name, type='artist')
+        items = artist_sp_results['artists']['items']
+        if len(items) == 0:
+            return nan, nan
+        key = match_key(performer_name)
+        exact = [item for item in items if match_key(item.get('name', '')) == key]
+        spotify_artist_id = (exact or items)[0]['id']
+        artist_index.add(performer_name, spotify_artist_id, performer_id)
+    elif performer_id:
+        artist_index.add(performer_name, spotify_artist_id, performer_id)
+    with metrics.timed('spotify_top_tracks'):
+        top_track_results = sp.artist_top_tracks(artist_id=spotify_artist_id)
     if len(top_track_results['tracks']) == 0:
         return spotify_artist_id, nan
     spotify_top_track_id = top_track_results['tracks'][0]['id']
     return spotify_artist_id, spotify_top_track_id
 
 
+def normalize_performer_name(performer_name):
+    '''
+    Normalize a performer name for use as a cache key (case and whitespace insensitive)
+
+    Args:
+        performer_name (str): name of performer as listed by seatgeek
+    '''
+    return " ".join(performer_name.casefold().split())
+
+
+def cached_lookup_spotify_artist_track(sp, performer_name, performer_id=None):
+    '''
+    ``lookup_spotify_artist_track`` behind ``artist_cache``. Artists that are not found
+    and artists without top tracks are cached too, each with their own TTL.
+
+    Args:
+        sp (spotipy.Spotify): actively credentialed ``spotipy.Spotify`` object
+        performer_name (str): name of performer to look up info on
+        performer_id: seatgeek id of the performer (default: None)
+    '''
+    key = normalize_performer_name(performer_name)
+    cached = artist_cache.get(key)
+    if cached is not None:
+        return tuple(cached)
+
+    # Wait for any other search already looking up this performer instead of repeating it
+    flight = artist_flights.lead(key)
+    if flight is None:
+        cached = artist_cache.get(key)
+        if cached is not None:
+            return tuple(cached)
+    try:
+        spotify_artist_id, spotify_top_track_id = lookup_spotify_artist_track(
+            sp, performer_name, performer_id)
+        if _isnull(spotify_artist_id):
+            ttl = artist_not_found_ttl
+        elif _isnull(spotify_top_track_id):
+            ttl = artist_no_tracks_ttl
+        else:
+            ttl = artist_cache_ttl
+        artist_cache.set(key, [spotify_artist_id, spotify_top_track_id], ttl)
+    finally:
+        if flight is not None:
+            flight.done()
+    return spotify_artist_id, spotify_top_track_id
+
+
+def _isnull(value):
+    return value is None or value != value
+
+
+def resolve_spotify_artist_tracks(sp, performer_names, max_workers=None, progress=None):
+    '''
+    Look up artist and top track ids for many performers using a pool of worker threads
+
+    Args:
+        sp (spotipy.Spotify): actively credentialed ``spotipy.Spotify`` object
+        performer_names (iterable): names of performers to look up info on. Lookups are
+            submitted as names are produced, so this may be a generator.
+        max_workers (int): see ``iter_spotify_artist_tracks`` (default: None)
+        progress (callable): called with ``artists_resolved=<count>`` as results are
+            ready (default: None)
+
+    Returns:
+        list: ``(spotify_artist_id, spotify_top_track_id)`` tuples in the same order as
+            ``performer_names``. Repeated names are looked up once and share a result. A
+            performer whose lookup fails gets ``(nan, nan)`` rather than failing the whole
+            search.
+    '''
+    results = dict(iter_spotify_artist_tracks(sp, enumerate(performer_names),
+                                              max_workers=max_workers, progress=progress))
+    return [results[i] for i in range(len(results))]
+
+
+def iter_spotify_artist_tracks(sp, performers, max_workers=None, progress=None,
+                               should_stop=None):
+    '''
+    Look up artist and top track ids for many performers using a pool of worker threads,
+    yielding each result as soon as it is ready.
+
+    Each distinct performer (by ``normalize_performer_name``) is looked up only once per
+    call: keys whose name is already being looked up wait for that lookup and get its
+    result, so the number of lookups scales with unique artists rather than with keys.
+
+    Args:
+        sp (spotipy.Spotify): actively credentialed ``spotipy.Spotify`` object
+        performers (iterable): ``(key, performer_name)`` pairs, or ``(key, performer_name,
+            seatgeek_performer_id)`` to let ``artist_index`` match on the seatgeek id. The
+            iterable is read on a separate thread, so it may be a generator that blocks
+            (e.g. on seatgeek paging) without holding up the results of lookups already
+            submitted.
+        max_workers (int): maximum number of concurrent lookups on a pool of this call's
+            own, or ``None`` to run them on the shared ``get_lookup_pool`` (default: None)
+        progress (callable): called with ``artists_resolved=<count>`` as each key's
+            result is ready (default: None)
+        should_stop (callable): called before each performer is read; once it returns
+            True no more performers are read or looked up, and only the results of lookups
+            already submitted are yielded (default: None)
+
+    Yields:
+        tuple: ``(key, (spotify_artist_id, spotify_top_track_id))`` in completion order.
+            A performer whose lookup fails gets ``(nan, nan)``.
+    '''
+    results = queue.Queue()
+    resolved = {}
+    waiting = {}
+    n_resolved = [0]
+    lock = Lock()
+
+    def _put(keys, spotify_info):
+        # Called with ``lock`` held
+        for key in keys:
+            results.put((key, spotify_info))
+        if progress and keys:
+            n_resolved[0] += len(keys)
+            progress(artists_resolved=n_resolved[0])
+
+    def _lookup(name_key, performer_name, performer_id):
+        try:
+            spotify_info = cached_lookup_spotify_artist_track(sp, performer_name, performer_id)
+        except Exception as e:
+            print(f"Spotify lookup failed for {performer_name}: {e!r}")
+            spotify_info = nan, nan
+        with lock:
+            resolved[name_key] = spotify_info
+            _put(waiting.pop(name_key), spotify_info)
+
+    def _submit_all(executor):
+        submitted, error = 0, None
+        try:
+            performers_iter = iter(performers)
+            while should_stop is None or not should_stop():
+                try:
+                    key, performer_name, *performer_id = next(performers_iter)
+                except StopIteration:
+                    break
+                name_key = normalize_performer_name(performer_name)
+                submitted += 1
+                with lock:
+                    if name_key in resolved:
+                        _put([key], resolved[name_key])
+                        continue
+                    if name_key in waiting:
+                        waiting[name_key].append(key)
+                        continue
+                    waiting[name_key] = [key]
+                executor.submit(_lookup, name_key, performer_name,
+                                performer_id[0] if performer_id else None)
+        except Exception as e:
+            error = e
+        results.put((_SUBMITTED, (submitted, error)))
+
+    _lookup = metrics.propagate(_lookup)
+    if max_workers is None:
+        executor = get_lookup_pool()
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        Thread(target=metrics.propagate(_submit_all), args=(executor,), daemon=True).start()
+        received, submitted, error = 0, None, None
+        while submitted is None or received < submitted:
+            key, value = results.get()
+            if key is _SUBMITTED:
+                submitted, error = value
+                continue
+            received += 1
+            yield key, value
+    finally:
+        if max_workers is not None:
+            executor.shutdown()
+    if error is not None:
+        raise error
+
+
 def get_access_token(code):
     '''
     Get access token from spotify (second handshake)
@@ -157,7 +826,7 @@ def get_access_token(code):
         code (str): code recieved from first spotify handshake
     '''
     print('Getting the access token')
-    post_url = 'https://accounts.spotify.com/api/token'
+    post_url = f"{clients.spotify_accounts_url}/api/token"
     grant_type = 'authorization_code'
     callback_url = request.url_root + 'callback'
     authorization = config.spotify_authorization
@@ -166,7 +835,7 @@ def get_access_token(code):
     headers = {'Authorization': authorization, 'Accept': 'application/json',
                'Content-Type': 'application/x-www-form-urlencoded'}
 
-    r = requests.post(post_url, headers=headers, data=post)
+    r = clients.post(post_url, headers=headers, data=post)
     auth_json = json.loads(r.text)
     try:
         access_token = 'Bearer ' + auth_json['access_token']
@@ -177,6 +846,26 @@ def get_access_token(code):
         return "Something went wrong at the Spotify end"
 
 
+def refresh_access_token(refresh_token):
+    '''
+    Get a new access token for a user from a refresh token, to act for them outside the
+    browser sign-in (e.g. in ``bulk``)
+
+    Args:
+        refresh_token (str): refresh token recieved with an earlier access token
+
+    Returns:
+        str: ``Bearer`` authorization header value
+    '''
+    headers = {'Authorization': config.spotify_authorization, 'Accept': 'application/json',
+               'Content-Type': 'application/x-www-form-urlencoded'}
+    r = clients.post(f"{clients.spotify_accounts_url}/api/token", headers=headers,
+                     data={'grant_type': 'refresh_token', 'refresh_token': refresh_token})
+    if r.status_code != 200:
+        raise FailedApiRequestError
+    return 'Bearer ' + json.loads(r.text)['access_token']
+
+
 def make_spotify_play_button(uri, height=380, width=300):
     '''
     Make Spotify play button from the uri
@@ -0,0 +1,224 @@
+#!/usr/bin/python
+
+'''
+In-process background job queue so long searches don't tie up a request worker, with
+an optional on-disk queue so jobs outlive the process that queued them
+'''
+
+import config
+import copy
+import importlib
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from listen_local_app import profiling
+from listen_local_app.cache import SQLiteStore
+from listen_local_app.cache import TTLCache
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+job_workers = getattr(config, 'job_workers', 4)
+job_store_path = getattr(config, 'job_store_path', None)
+job_ttl = getattr(config, 'job_ttl', 60 * 60)
+job_progress_interval = getattr(config, 'job_progress_interval', 0.5)
+
+
+class JobQueue:
+    '''
+    Runs jobs on a pool of worker threads and keeps their state for ``ttl`` seconds.
+
+    Job state is a JSON serializable dictionary with ``id``, ``status`` (queued, running,
+    done or error), ``stage``, a ``progress`` dictionary of counts, the job's ``result``
+    and an ``error`` message. With ``path`` set the state is kept in SQLite instead of
+    memory, so every app process sharing that file can answer status and result requests
+    for jobs running in any of them. Progress counts are saved at most once every
+    ``progress_interval`` seconds; stage changes and the final state are saved at once.
+
+    With ``path`` set the queue is kept on disk as well: jobs whose function can be
+    imported by name record it and their (JSON serializable) arguments until they
+    finish. A queue started on the same host picks up the queued and running jobs of
+    app processes that have stopped and runs them again from the start.
+
+    Args:
+        max_workers (int): number of jobs run at once (default: from config.py)
+        path (str): SQLite database file for job state, or ``None`` to keep it in
+            memory (default: from config.py)
+        ttl (float): seconds job state is kept after its last update (default: from
+            config.py)
+        progress_interval (float): least seconds between saves of a job's progress
+            counts (default: from config.py)
+    '''
+    def __init__(self, max_workers=job_workers, path=job_store_path, ttl=job_ttl,
+                 progress_interval=job_progress_interval):
+        self.ttl = ttl
+        self.progress_interval = progress_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._store = SQLiteStore(path, table='jobs') if path else None
+        self._memory = TTLCache(maxsize=10000)
+        self._lock = threading.Lock()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        if self._store is not None:
+            self.recover()
+
+    def submit(self, fn, *args, **kwargs):
+        '''
+        Queue ``fn(*args, progress=<callable>, **kwargs)`` and return the new job's id.
+        ``progress`` takes keyword arguments; ``stage`` sets the job stage and anything
+        else is merged into the job's ``progress`` counts.
+        '''
+        job_id = uuid.uuid4().hex
+        job = {'id': job_id, 'status': 'queued', 'stage': 'queued', 'progress': {},
+               'result': None, 'error': None, 'created': time.time(), 'owner': self.owner,
+               'call': None}
+        task = _task_name(fn)
+        if self._store is not None and task is not None:
+            job['call'] = {'task': task, 'args': list(args), 'kwargs': kwargs}
+        self._save(job)
+        self._executor.submit(self._run, job_id, profiling.propagate(fn), args, kwargs)
+        return job_id
+
+    def recover(self):
+        '''
+        Take over the unfinished jobs on disk left by app processes on this host that have
+        stopped, and queue them again
+
+        Returns:
+            list: ids of the jobs taken over
+        '''
+        if self._store is None or fcntl is None:
+            return []
+        recovered = []
+        with open(self._store.path + '.lock', 'a') as lock_file:
+            # Only one process takes over a job
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            for job_id, job in self._store.items():
+                if not self._orphaned(job):
+                    continue
+                call = job['call']
+                try:
+                    module, name = call['task'].split(':')
+                    fn = getattr(importlib.import_module(module), name)
+                except (ImportError, AttributeError, ValueError) as e:
+                    print(f"Could not recover job {job_id}: {e!r}")
+                    continue
+                job.update(status='queued', stage='queued', owner=self.owner)
+                self._save(job)
+                self._executor.submit(self._run, job_id, fn, call['args'], call['kwargs'])
+                recovered.append(job_id)
+        return recovered
+
+    def _orphaned(self, job):
+        if job.get('status') not in ('queued', 'running') or not job.get('call'):
+            return False
+        host, _, pid = job.get('owner', '').rpartition(':')
+        if host != socket.gethostname() or job['owner'] == self.owner:
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except (OSError, ValueError):
+            pass
+        return False
+
+    def get(self, job_id):
+        '''
+        Return the state of job ``job_id`` or ``None`` if it is unknown or expired
+        '''
+        if self._store is not None:
+            stored = self._store.get(job_id)
+            return stored[0] if stored else None
+        return copy.deepcopy(self._memory.get(job_id))
+
+    def update(self, job_id, stage=None, status=None, result=None, error=None, **progress):
+        with self._lock:
+            job = self.get(job_id)
+            if job is None:
+                return
+            if stage is not None:
+                job['stage'] = stage
+            if status is not None:
+                job['status'] = status
+            if result is not None:
+                job['result'] = result
+            if error is not None:
+                job['error'] = error
+            if job['status'] in ('done', 'error'):
+                # The arguments hold the user's access token, so don't keep them
+                job['call'] = None
+            job['progress'].update(progress)
+            self._save(job)
+
+    def _save(self, job):
+        if self._store is not None:
+            self._store.set(job['id'], job, self.ttl)
+        else:
+            self._memory.set(job['id'], job, self.ttl)
+
+    def _run(self, job_id, fn, args, kwargs):
+        self.update(job_id, status='running')
+        pending = {}
+        saved = [time.monotonic()]
+        progress_lock = threading.Lock()
+
+        def _progress(**fields):
+            # Progress is reported for every event and artist, so counts are batched up
+            # and saved (in order) at most every ``progress_interval`` seconds
+            with progress_lock:
+                pending.update(fields)
+                now = time.monotonic()
+                if 'stage' not in fields and now - saved[0] < self.progress_interval:
+                    return
+                saved[0] = now
+                self.update(job_id, **pending)
+                pending.clear()
+
+        try:
+            result = fn(*args, progress=_progress, **kwargs)
+        except Exception:
+            traceback.print_exc()
+            with progress_lock:
+                self.update(job_id, status='error', stage='error',
+                            error="Something went wrong building your playlist", **pending)
+        else:
+            with progress_lock:
+                self.update(job_id, status='done', stage='done', result=result, **pending)
+
+
+def _task_name(fn):
+    '''
+    Return ``'module:name'`` for a module-level function, or ``None`` if ``fn`` can't be
+    found again by that name
+    '''
+    module, name = getattr(fn, '__module__', None), getattr(fn, '__qualname__', '')
+    if module is None or '.' in name or '<' in name:
+        return None
+    try:
+        found = getattr(importlib.import_module(module), name, None)
+    except ImportError:
+        return None
+    return f"{module}:{name}" if found is fn else None
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    '''
+    Return the process-wide ``JobQueue``, created on first use
+    '''
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+'''
+Incremental parsing of a JSON object whose bulk is one large array, such as a page of
+seatgeek events, so the array items can be used as they are read off the network
+instead of after the whole body has been loaded and parsed
+'''
+
+import codecs
+import json
+
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789.eE+-'
+
+
+class _Reader:
+    '''
+    Text buffer over an iterable of byte chunks, keeping only what is yet to be parsed
+    '''
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decode = codecs.getincrementaldecoder('utf-8')().decode
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        '''
+        Append the next chunk to the buffer, returning False at the end of the input
+        '''
+        if self.eof:
+            return False
+        for chunk in self._chunks:
+            text = self._decode(chunk)
+            if text:
+                self.buf = self.buf[self.pos:] + text
+                self.pos = 0
+                return True
+        self.eof = True
+        text = self._decode(b'', True)
+        if text:
+            self.buf = self.buf[self.pos:] + text
+            self.pos = 0
+            return True
+        return False
+
+    def skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return
+
+    def next_char(self):
+        self.skip_whitespace()
+        if self.pos >= len(self.buf):
+            raise ValueError("Unexpected end of JSON input")
+        char = self.buf[self.pos]
+        self.pos += 1
+        return char
+
+    def peek_char(self):
+        char = self.next_char()
+        self.pos -= 1
+        return char
+
+    def expect(self, expected):
+        char = self.next_char()
+        if char != expected:
+            raise ValueError(f"Expected {expected!r} in JSON input, found {char!r}")
+
+    def value(self):
+        '''
+        Parse the next complete JSON value, reading more input until it is all there
+        '''
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.fill():
+                    continue
+                raise
+            # A value running up to the end of the buffer (or a number stopping at a
+            # '.' or exponent that is still to come) may continue in the next chunk
+            if (end == len(self.buf) or (isinstance(value, (int, float))
+                                         and self.buf[end] in _NUMBER_CHARS)) \
+                    and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_array_items(chunks, key, other=None):
+    '''
+    Parse a JSON object from byte chunks, yielding the items of the array under ``key``
+    one at a time as soon as each is complete
+
+    Args:
+        chunks (iterable): the JSON document as ``bytes`` chunks, e.g.
+            ``response.iter_content(...)``
+        key (str): top-level key of the array to stream
+        other (dict): filled in with every other top-level key of the object as it is
+            parsed; keys after the array are there once the generator is exhausted
+            (default: None)
+
+    Yields:
+        the items of the array
+    '''
+    other = {} if other is None else other
+    reader = _Reader(chunks)
+    reader.expect('{')
+    if reader.peek_char() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key:
+            reader.expect('[')
+            if reader.peek_char() == ']':
+                reader.next_char()
+            else:
+                while True:
+                    yield reader.value()
+                    char = reader.next_char()
+                    if char == ']':
+                        break
+                    if char != ',':
+                        raise ValueError(f"Expected ',' or ']' in JSON input, found {char!r}")
+        else:
+            other[name] = reader.value()
+        char = reader.next_char()
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError(f"Expected ',' or '}}' in JSON input, found {char!r}")
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+'''
+The listings table on the results page. Rows are kept as small slotted records and the
+table is rendered by a precompiled template, giving the same html as
+``DataFrame.to_html`` did without building a DataFrame for it.
+'''
+
+import html
+
+from datetime import datetime
+from functools import lru_cache
+from jinja2 import Environment
+
+
+LISTING_FIELDS = ["date_local", "time_local", "event_title", "performer",
+                  "genre", "venue_name", "venue_address"]
+LISTING_COLUMNS = ["Date", "Time", "Event", "Performer",
+                   "Genre(s)", "Venue", "Address"]
+
+_TABLE_TEMPLATE = Environment(autoescape=False, trim_blocks=True, lstrip_blocks=True,
+                              keep_trailing_newline=False).from_string('''\
+<table  class="dataframe dataframe text-left">
+  <thead>
+    <tr style="text-align: right;">
+{% for column in columns %}
+      <th>{{ column }}</th>
+{% endfor %}
+    </tr>
+  </thead>
+  <tbody>
+{% for cells in rows %}
+    <tr>
+{% for cell in cells %}
+      <td>{{ cell }}</td>
+{% endfor %}
+    </tr>
+{% endfor %}
+  </tbody>
+</table>''')
+
+
+@lru_cache(maxsize=4096)
+def format_local_datetime(datetime_local):
+    '''
+    Split a seatgeek ``datetime_local`` into the date and time shown in the listings.
+    Many events share a start time, so results are cached.
+
+    Args:
+        datetime_local (str): formatted as 'YYYY-MM-DDTHH:MM:SS'
+
+    Returns:
+        tuple: ``(date_local, time_local)``, e.g. ``('Jan 22 2019', '08:00PM')``
+    '''
+    dt = datetime.strptime(datetime_local, "%Y-%m-%dT%H:%M:%S")
+    return dt.strftime("%b %d %Y"), dt.strftime("%I:%M%p")
+
+
+class Listing:
+    '''
+    One row of the listings table
+
+    Args:
+        position (int): order the performer was first seen in
+        row (dict): listing fields, see ``LISTING_FIELDS``
+    '''
+    __slots__ = ('position',) + tuple(LISTING_FIELDS)
+
+    def __init__(self, position, row):
+        self.position = position
+        for field in LISTING_FIELDS:
+            setattr(self, field, row[field])
+
+    def values(self):
+        return [getattr(self, field) for field in LISTING_FIELDS]
+
+    def cells(self):
+        return [_format_cell(value) for value in self.values()]
+
+
+def _format_cell(value):
+    # Mirror the DataFrame.to_html formatting: missing values as NaN, only <, > and &
+    # escaped
+    if value != value:
+        return 'NaN'
+    return html.escape(str(value), quote=False)
+
+
+def render_listings(listings):
+    '''
+    Render listings as an html table sorted by date then time, keeping the order they
+    are given in for listings at the same date and time
+
+    Args:
+        listings (iterable): ``Listing`` rows
+
+    Returns:
+        str: html table
+    '''
+    listings = sorted(listings, key=lambda listing: (listing.date_local, listing.time_local))
+    return _TABLE_TEMPLATE.render(columns=LISTING_COLUMNS,
+                                  rows=(listing.cells() for listing in listings))
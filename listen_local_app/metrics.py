@@ -0,0 +1,237 @@
+#!/usr/bin/python
+
+'''
+Lightweight timing instrumentation. Stages of a search and calls to upstream APIs are
+timed into histograms served in the Prometheus text format, and the stages timed while
+serving a request are sent back in its ``Server-Timing`` header.
+
+Everything here is a no-op unless ``metrics_enabled`` is set in config.py, except for
+``CallCounter``.
+'''
+
+import config
+import threading
+import time
+
+from listen_local_app import profiling
+
+
+enabled = getattr(config, 'metrics_enabled', False)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+_local = threading.local()
+
+
+class Histogram:
+    '''
+    Thread-safe cumulative histogram of durations (s)
+    '''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.sum += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+
+
+def observe(name, seconds, **labels):
+    '''
+    Record ``seconds`` in the histogram ``name`` with the given labels. Label values
+    are kept as strings, so histograms sort the same whatever type they were given as.
+    '''
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    histogram.observe(seconds)
+
+
+class _Timer:
+    __slots__ = ('stage', 'started')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+def _record(stage, seconds):
+    observe('listen_local_stage_seconds', seconds, stage=stage)
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        with timings['lock']:
+            total, count = timings['stages'].get(stage, (0.0, 0))
+            timings['stages'][stage] = (total + seconds, count + 1)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(stage):
+    '''
+    Context manager timing a stage of the search, e.g. ``with timed('seatgeek'): ...``
+    '''
+    return _Timer(stage) if enabled else _NULL_TIMER
+
+
+def timed_iter(stage, iterable):
+    '''
+    Yield the items of ``iterable``, timing the time spent producing them (but not the
+    time the consumer spends between items) as one call of ``stage``
+    '''
+    if not enabled:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    seconds = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - started
+            yield item
+    finally:
+        _record(stage, seconds)
+        if hasattr(iterator, 'close'):  # e.g. a generator left part read
+            iterator.close()
+
+
+def start_request():
+    '''
+    Start collecting stage timings for the request handled by this thread
+    '''
+    if enabled:
+        _local.timings = {'started': time.perf_counter(), 'stages': {},
+                          'lock': threading.Lock()}
+
+
+def finish_request():
+    '''
+    Stop collecting stage timings for this thread and return them as a ``Server-Timing``
+    header value, or ``None`` if nothing was being collected
+    '''
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    if timings is None:
+        return None
+    entries = [f'{stage};dur={total * 1000:.1f};desc="{count} call(s)"'
+               for stage, (total, count) in sorted(timings['stages'].items())]
+    entries.append(f"total;dur={(time.perf_counter() - timings['started']) * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class CallCounter:
+    '''
+    Context manager counting the upstream requests sent by the thread that entered it,
+    and by the work that thread hands to others through ``propagate``, e.g.::
+
+        with CallCounter() as calls:
+            ...
+        print(calls.count)
+    '''
+    def __init__(self):
+        self.count = 0
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'call_counter', None)
+        _local.call_counter = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.call_counter = self._previous
+        return False
+
+
+def count_call():
+    '''
+    Add an upstream request to the ``CallCounter`` of this thread, if there is one
+    '''
+    counter = getattr(_local, 'call_counter', None)
+    if counter is not None:
+        with counter._lock:
+            counter.count += 1
+
+
+def propagate(fn):
+    '''
+    Wrap ``fn`` so that when run on a worker thread its stage timings, upstream requests
+    (see ``CallCounter``) and profile (see ``profiling.propagate``) are added to those of
+    the request that submitted it. Returns ``fn`` itself when nothing is collected.
+    '''
+    fn = profiling.propagate(fn)
+    timings = getattr(_local, 'timings', None)
+    counter = getattr(_local, 'call_counter', None)
+    if timings is None and counter is None:
+        return fn
+
+    def _run(*args, **kwargs):
+        previous = getattr(_local, 'timings', None), getattr(_local, 'call_counter', None)
+        _local.timings, _local.call_counter = timings, counter
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.timings, _local.call_counter = previous
+    return _run
+
+
+def render():
+    '''
+    Return every histogram in the Prometheus text exposition format
+    '''
+    lines = []
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+    seen = set()
+    for (name, labels), histogram in items:
+        if name not in seen:
+            lines.append(f"# TYPE {name} histogram")
+            seen.add(name)
+        label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+        prefix = label_str + "," if label_str else ""
+        with histogram._lock:
+            counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+        for bound, n in zip(histogram.buckets, counts):
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {n}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {count}')
+        lines.append(f"{name}_sum{{{label_str}}} {total}")
+        lines.append(f"{name}_count{{{label_str}}} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _histograms_lock:
+        _histograms.clear()
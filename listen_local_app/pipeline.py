@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+'''
+The search pipeline behind the callback page: fetch concerts, look up artists on
+Spotify, write the playlist and build the listings table. It needs no request context
+so it can run inside a request or on a background worker.
+'''
+
+import time
+
+from listen_local_app import metrics
+from listen_local_app.functions import get_concert_information
+from listen_local_app.functions import iter_performer_rows
+from listen_local_app.functions import NoConcertsFound
+from listen_local_app.functions import process_daterange
+from listen_local_app.listings import Listing
+from listen_local_app.listings import LISTING_FIELDS
+from listen_local_app.listings import render_listings
+from listen_local_app.playlists import get_or_create_playlist
+from listen_local_app.playlists import sync_playlist_tracks
+from listen_local_app.playlists import write_playlist_tracks
+from listen_local_app.result_pages import search_key
+
+
+def run_search(access_token, zipcode, daterange, distance, progress=None):
+    '''
+    Build a playlist of the artists playing near ``zipcode`` and the listings to go with it
+
+    Args:
+        access_token (str): ``Bearer`` token for the user the playlist is made for
+        zipcode (str): zipcode to search near
+        daterange (str): daterange from the search form, see ``process_daterange``
+        distance (str): search radius (mi)
+        progress (callable): called with ``stage=<name>`` as the search moves through its
+            stages and with the counts reported by ``iter_performer_rows``
+            (default: None)
+
+    Returns:
+        dict: ``playlist_uri``, ``listings`` (html table) and the ``search_key`` the
+            results page is kept under, or ``error`` with a message for the user if no
+            concerts were found
+    '''
+    progress = progress or (lambda **kwargs: None)
+    date1, date2 = process_daterange(daterange)
+
+    # Get Concert information
+    progress(stage='fetching events')
+    try:
+        concert_data = get_concert_information(zipcode, date1=date1, date2=date2, dist=distance,
+                                               stream=True)
+    except NoConcertsFound:
+        return {'error': f"We didn't find any concerts near {zipcode} :-("}
+
+    progress(stage='resolving artists')
+    listings, tracks = [], []
+    # Put performers back in the order they were first seen in
+    for position, _, d in sorted(iter_performer_rows(concert_data, progress=progress),
+                                 key=lambda x: x[0]):
+        listings.append(Listing(position, d))
+        if isinstance(d['spotify_top_track_id'], str):
+            tracks.append(f"spotify:track:{d['spotify_top_track_id']}")
+
+    progress(stage='writing playlist')
+    playlist_id, playlist_uri, created = get_or_create_playlist(access_token, zipcode, daterange,
+                                                                distance)
+    tracks_written = save_playlist_tracks(access_token, playlist_id, tracks, created)
+    progress(stage='playlist written', tracks_written=tracks_written)
+
+    with metrics.timed('render_listings'):
+        listings_html = render_listings(listings)
+    return {'playlist_uri': playlist_uri, 'listings': listings_html,
+            'search_key': search_key(zipcode, daterange, distance, playlist_id)}
+
+
+def save_playlist_tracks(access_token, playlist_id, tracks, created):
+    '''
+    Fill a new playlist with ``tracks``, or bring one from an earlier search up to date
+    by adding and removing only the tracks that changed
+
+    Returns:
+        int: number of tracks added to the playlist
+    '''
+    if created:
+        return write_playlist_tracks(access_token, playlist_id, tracks)
+    return sync_playlist_tracks(access_token, playlist_id, tracks)['added']
+
+
+def stream_search(access_token, zipcode, daterange, distance, chunk_size=10,
+                  chunk_interval=0.5):
+    '''
+    Like ``run_search`` but finds or makes the playlist first and hands back the listings
+    as they are found, so the results page can be streamed to the browser. The playlist
+    tracks are saved once every listing row has been read.
+
+    Args:
+        access_token (str): ``Bearer`` token for the user the playlist is made for
+        zipcode (str): zipcode to search near
+        daterange (str): daterange from the search form, see ``process_daterange``
+        distance (str): search radius (mi)
+        chunk_size (int): most listing rows handed back at once (default: 10)
+        chunk_interval (float): longest time (s) a finished row waits for its chunk to
+            fill up (default: 0.5)
+
+    Returns:
+        dict: ``playlist_uri`` and ``rows``, a generator of lists of ``(position, values)``
+            listing rows where ``values`` match ``LISTING_COLUMNS`` and ``position`` is the
+            order the performer was first seen in, or ``error`` with a message for the user
+            if no concerts were found
+    '''
+    date1, date2 = process_daterange(daterange)
+    try:
+        concert_data = get_concert_information(zipcode, date1=date1, date2=date2, dist=distance,
+                                               stream=True)
+    except NoConcertsFound:
+        return {'error': f"We didn't find any concerts near {zipcode} :-("}
+    playlist_id, playlist_uri, created = get_or_create_playlist(access_token, zipcode, daterange,
+                                                                distance)
+
+    def _rows():
+        tracks = []
+        chunk, chunk_started = [], time.time()
+        for position, _, d in iter_performer_rows(concert_data):
+            if isinstance(d['spotify_top_track_id'], str):
+                tracks.append((position, f"spotify:track:{d['spotify_top_track_id']}"))
+            chunk.append((position, [d[field] for field in LISTING_FIELDS]))
+            if len(chunk) >= chunk_size or time.time() - chunk_started >= chunk_interval:
+                yield chunk
+                chunk, chunk_started = [], time.time()
+        if chunk:
+            yield chunk
+        save_playlist_tracks(access_token, playlist_id, [uri for _, uri in sorted(tracks)],
+                             created)
+
+    return {'playlist_uri': playlist_uri, 'rows': _rows()}
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+
+'''
+Creating and filling playlists in a user's Spotify account
+'''
+
+import config
+import json
+
+from listen_local_app import clients
+from listen_local_app import metrics
+
+
+# Spotify accepts at most this many uris per add-tracks call
+MAX_TRACKS_PER_REQUEST = 100
+
+playlist_search_pages = getattr(config, 'playlist_search_pages', 10)
+
+
+def playlist_name(zipcode, daterange, distance=None):
+    name = f"Concerts near {zipcode} {daterange}"
+    return name if distance is None else f"{name} ({str(distance).strip()}mi)"
+
+
+def create_playlist(access_token, zipcode, daterange, distance=None):
+    '''
+    Make an empty playlist for a search in the user's Spotify account
+
+    Args:
+        access_token (str): ``Bearer`` token for the user
+        zipcode (str): zipcode searched near
+        daterange (str): daterange searched
+        distance (str): search radius (mi) (default: None)
+
+    Returns:
+        tuple: ``(playlist_id, playlist_uri)``
+    '''
+    with metrics.timed('playlist_create'):
+        return _create_playlist(access_token, _get_user_id(access_token), zipcode, daterange,
+                                playlist_name(zipcode, daterange, distance))
+
+
+def get_or_create_playlist(access_token, zipcode, daterange, distance=None, name=None):
+    '''
+    Find the user's playlist from an earlier identical search, or make an empty one
+
+    Args:
+        access_token (str): ``Bearer`` token for the user
+        zipcode (str): zipcode searched near
+        daterange (str): daterange searched
+        distance (str): search radius (mi), part of the playlist name so searches of
+            different radius get playlists of their own (default: None)
+        name (str): playlist name to use instead of the one made from the search
+            (default: None)
+
+    Returns:
+        tuple: ``(playlist_id, playlist_uri, created)`` where ``created`` is True for a
+            new (empty) playlist
+    '''
+    with metrics.timed('playlist_create'):
+        user_id = _get_user_id(access_token)
+        name = name or playlist_name(zipcode, daterange, distance)
+        playlist = find_playlist(access_token, user_id, name)
+        if playlist is not None:
+            return playlist['id'], playlist['uri'], False
+        return _create_playlist(access_token, user_id, zipcode, daterange, name) + (True,)
+
+
+def _get_user_id(access_token):
+    # Find out who the user is
+    me_headers = {'Authorization': access_token}
+    r_me = clients.get(f"{clients.spotify_api_url}/me", headers=me_headers)
+    r_me_json = json.loads(r_me.text)
+    return r_me_json['id']
+
+
+def _create_playlist(access_token, user_id, zipcode, daterange, name=None):
+    # Make a Playlist
+    cp_headers = {'Authorization': access_token, 'Content-Type': 'application/json'}
+    cp_post = {'name': name or playlist_name(zipcode, daterange), 'public': 'true',
+               'collaborative': 'false', 'description': 'created by protype app'}
+    cp_url = f"{clients.spotify_api_url}/users/{user_id}/playlists"
+    r_cp = clients.post(cp_url, headers=cp_headers, data=json.dumps(cp_post))
+    playlist_id = json.loads(r_cp.text)['id']
+    playlist_uri = json.loads(r_cp.text)['uri']
+    return playlist_id, playlist_uri
+
+
+def find_playlist(access_token, user_id, name, max_pages=playlist_search_pages):
+    '''
+    Find a playlist owned by the user by name
+
+    Args:
+        access_token (str): ``Bearer`` token for the user
+        user_id (str): Spotify id of the user
+        name (str): playlist name
+        max_pages (int): most pages of 50 of the user's playlists to look through
+            (default: from config.py)
+
+    Returns:
+        dict: the Spotify playlist object (with ``id``, ``uri`` and ``snapshot_id``), or
+            ``None`` if the user has no such playlist
+    '''
+    headers = {'Authorization': access_token}
+    url = f"{clients.spotify_api_url}/me/playlists?limit=50"
+    for _ in range(max_pages):
+        r = clients.get(url, headers=headers)
+        if r.status_code != 200:
+            return None
+        page = json.loads(r.text)
+        for playlist in page.get('items') or []:
+            if playlist and playlist['name'] == name and \
+                    (playlist.get('owner') or {}).get('id') == user_id:
+                return playlist
+        url = page.get('next')
+        if not url:
+            break
+    return None
+
+
+def get_playlist_tracks(access_token, playlist_id):
+    '''
+    Read the tracks of a playlist
+
+    Returns:
+        tuple: ``(tracks, snapshot_id)``, the track uris in playlist order and the
+            snapshot they were read at
+    '''
+    headers = {'Authorization': access_token}
+    url = (f"{clients.spotify_api_url}/playlists/{playlist_id}"
+           "?fields=snapshot_id,tracks.items(track.uri),tracks.next")
+    r = clients.get(url, headers=headers)
+    r.raise_for_status()
+    playlist = json.loads(r.text)
+    page = playlist['tracks']
+    tracks = []
+    while True:
+        tracks.extend(item['track']['uri'] for item in page.get('items') or []
+                      if item and item.get('track'))
+        if not page.get('next'):
+            break
+        r = clients.get(page['next'], headers=headers)
+        r.raise_for_status()
+        page = json.loads(r.text)
+    return tracks, playlist['snapshot_id']
+
+
+def remove_playlist_tracks(access_token, playlist_id, removals, snapshot_id):
+    '''
+    Remove tracks at given positions from a playlist. Each removal names the track and
+    its position in the playlist at ``snapshot_id``, so Spotify turns the request down
+    if the playlist was changed in a way that moved or removed those tracks.
+
+    Args:
+        access_token (str): ``Bearer`` token for the playlist owner
+        playlist_id (str): id of the playlist
+        removals (list): ``(position, uri)`` pairs, in position order
+        snapshot_id (str): snapshot the positions were read at
+
+    Returns:
+        tuple: ``(removed, complete)``, the number of tracks removed and whether every
+            removal was made
+    '''
+    tracks_url = f"{clients.spotify_api_url}/playlists/{playlist_id}/tracks"
+    headers = {'Authorization': access_token, 'Content-Type': 'application/json'}
+    removed = 0
+    for i in range(0, len(removals), MAX_TRACKS_PER_REQUEST):
+        batch = removals[i:i + MAX_TRACKS_PER_REQUEST]
+        # Earlier batches moved every later track up by the number of tracks they removed
+        positions = {}
+        for position, uri in batch:
+            positions.setdefault(uri, []).append(position - removed)
+        body = {'tracks': [{'uri': uri, 'positions': uri_positions}
+                           for uri, uri_positions in positions.items()],
+                'snapshot_id': snapshot_id}
+        r = clients.delete(tracks_url, headers=headers, data=json.dumps(body))
+        if r.status_code not in (200, 201):
+            print(f"Failed to remove {len(batch)} tracks from playlist {playlist_id}: {r.text}")
+            return removed, False
+        snapshot_id = json.loads(r.text)['snapshot_id']
+        removed += len(batch)
+    return removed, True
+
+
+def sync_playlist_tracks(access_token, playlist_id, tracks, max_attempts=3):
+    '''
+    Make an existing playlist hold ``tracks`` by sending only the changes: tracks no
+    longer wanted, and repeats of tracks, are removed and new ones appended in ``tracks``
+    order, while tracks already there keep their place.
+
+    The removals are sent with their positions at the snapshot the playlist was read at
+    (see ``remove_playlist_tracks``). If Spotify turns them down because someone else
+    edited the playlist meanwhile, it is read and compared again, up to
+    ``max_attempts`` times, and nothing is added until the removals have gone through.
+
+    Args:
+        access_token (str): ``Bearer`` token for the playlist owner
+        playlist_id (str): id of the playlist
+        tracks (list): spotify track uris the playlist should hold
+        max_attempts (int): times to read and compare the playlist (default: 3)
+
+    Returns:
+        dict: counts of tracks ``added`` and ``removed``
+    '''
+    with metrics.timed('playlist_sync'):
+        wanted = list(dict.fromkeys(tracks))
+        wanted_set = set(wanted)
+        removed = 0
+        for attempt in range(max_attempts):
+            current, snapshot_id = get_playlist_tracks(access_token, playlist_id)
+            seen = set()
+            removals = []
+            for position, uri in enumerate(current):
+                if uri not in wanted_set or uri in seen:
+                    removals.append((position, uri))
+                seen.add(uri)
+            additions = [uri for uri in wanted if uri not in seen]
+            if not removals:
+                break
+            batch_removed, complete = remove_playlist_tracks(access_token, playlist_id,
+                                                             removals, snapshot_id)
+            removed += batch_removed
+            if complete:
+                break
+            print(f"Playlist {playlist_id} changed while syncing it; reading it again")
+        else:
+            return {'added': 0, 'removed': removed}
+
+        added = write_playlist_tracks(access_token, playlist_id, additions, position=None)
+        return {'added': added, 'removed': removed}
+
+
+def write_playlist_tracks(access_token, playlist_id, tracks, position=0):
+    '''
+    Add tracks to a playlist, dropping duplicates and splitting them into batches of at
+    most ``MAX_TRACKS_PER_REQUEST``.
+
+    Spotify can only insert at a position that already exists, so the batches are sent
+    one after another over the shared keep-alive session, each with the explicit
+    position of its first track, and writing stops at the first batch that fails.
+
+    Args:
+        access_token (str): ``Bearer`` token for the playlist owner
+        playlist_id (str): id of the playlist
+        tracks (list): spotify track uris to add, in playlist order
+        position (int): playlist position of the first track, or ``None`` to append
+            (default: 0)
+
+    Returns:
+        int: number of tracks written to the playlist
+    '''
+    with metrics.timed('playlist_write'):
+        return _write_playlist_tracks(access_token, playlist_id, tracks, position)
+
+
+def _write_playlist_tracks(access_token, playlist_id, tracks, position):
+    tracks = list(dict.fromkeys(tracks))
+    tracks_url = f"{clients.spotify_api_url}/playlists/{playlist_id}/tracks"
+    tracks_headers = {'Authorization': access_token, 'Content-Type': 'application/json'}
+    batches = [tracks[i:i + MAX_TRACKS_PER_REQUEST]
+               for i in range(0, len(tracks), MAX_TRACKS_PER_REQUEST)]
+
+    def _post(batch, batch_position=None):
+        tracks_post = {"uris": batch}
+        if batch_position is not None:
+            tracks_post["position"] = batch_position
+        r = clients.post(tracks_url, headers=tracks_headers, data=json.dumps(tracks_post))
+        if r.status_code not in (200, 201):
+            print(f"Failed to add {len(batch)} tracks to playlist {playlist_id}: {r.text}")
+            return 0
+        return len(batch)
+
+    written = 0
+    for batch in batches:
+        n = _post(batch, position + written if position is not None else None)
+        written += n
+        if n < len(batch):
+            # Later positions no longer exist, so stop rather than scramble the order
+            break
+    return written
@@ -0,0 +1,226 @@
+#!/usr/bin/python
+
+'''
+Opt-in profiling of slow searches. A ``/callback`` request is run under cProfile when it
+carries the admin ``X-Profile`` header with the token from config.py, or at random for a
+sampled share of requests. The profile covers the request thread and the worker threads
+doing its work (seatgeek pages, Spotify lookups, background jobs), and is written to the
+profile directory as:
+
+- ``<name>.prof``: pstats data, for ``python -m pstats`` or snakeviz
+- ``<name>.folded``: collapsed stacks in microseconds, for flamegraph.pl or speedscope
+
+Only the most recent ``profiling_keep`` profiles are kept. Nothing here runs unless
+``profiling_enabled`` is set in config.py.
+'''
+
+import config
+import cProfile
+import glob
+import hmac
+import itertools
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+
+enabled = getattr(config, 'profiling_enabled', False)
+token = getattr(config, 'profiling_token', None)
+sample_rate = getattr(config, 'profiling_sample_rate', 0.0)
+profile_dir = getattr(config, 'profiling_dir', 'profiles')
+profile_keep = getattr(config, 'profiling_keep', 50)
+
+HEADER = 'X-Profile'
+
+_local = threading.local()
+_sequence = itertools.count()
+
+
+def should_profile(header_value=None):
+    '''
+    Return whether to profile a request, given the value of its ``X-Profile`` header
+    '''
+    if not enabled:
+        return False
+    if token and header_value and hmac.compare_digest(header_value, token):
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+class Session:
+    '''
+    The profile of one request. Each thread taking part is profiled on its own and the
+    profiles are merged and written out every time the last running one finishes, so
+    work handed to a background job is added to the files once the job is done.
+
+    Args:
+        label (str): added to the profile's file names, e.g. 'callback'
+        directory (str): where profiles are written (default: from config.py)
+        keep (int): most profiles kept in ``directory`` (default: from config.py)
+    '''
+    def __init__(self, label, directory=profile_dir, keep=profile_keep):
+        self.name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_sequence)}-{label}"
+        self.directory = directory
+        self.keep = keep
+        self._profiles = []
+        self._running = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def start(self):
+        '''
+        Start profiling the calling thread for this session. Returns False if the thread
+        can't be profiled, as it is already being profiled or (from Python 3.12) another
+        thread is.
+        '''
+        if getattr(_local, 'session', None) is not None:
+            return False
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return False
+        _local.session, _local.profiler = self, profiler
+        with self._lock:
+            self._running += 1
+        return True
+
+    def stop(self):
+        '''
+        Stop profiling the calling thread, writing the profile if no other thread of the
+        session is still running
+        '''
+        profiler = _local.profiler
+        profiler.disable()
+        _local.session = _local.profiler = None
+        with self._lock:
+            self._profiles.append(profiler)
+            self._running -= 1
+            finished = self._running == 0
+        if finished:
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Could not write profile {self.name}: {e!r}")
+
+    def write(self):
+        with self._write_lock:
+            with self._lock:
+                profiles = list(self._profiles)
+            stats = pstats.Stats(*profiles)
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, self.name)
+            stats.dump_stats(path + '.prof')
+            with open(path + '.folded', 'w') as f:
+                for stack, microseconds in sorted(folded_stacks(stats).items()):
+                    f.write(f"{stack} {microseconds}\n")
+            _rotate(self.directory, self.keep)
+
+
+def start_request(label, header_value=None):
+    '''
+    Profile the request handled by this thread if ``should_profile`` says so
+
+    Returns:
+        Session: the request's profile, or ``None`` if it isn't profiled
+    '''
+    if not should_profile(header_value):
+        return None
+    session = Session(label, directory=profile_dir, keep=profile_keep)
+    return session if session.start() else None
+
+
+def finish_request():
+    '''
+    Stop profiling the request handled by this thread, if it was profiled
+    '''
+    if getattr(_local, 'session', None) is not None:
+        _local.session.stop()
+
+
+def current():
+    '''
+    Return the session profiling this thread, or ``None``
+    '''
+    return getattr(_local, 'session', None)
+
+
+def propagate(fn):
+    '''
+    Wrap ``fn`` so that when run on a worker thread it is profiled as part of the request
+    that submitted it. Returns ``fn`` itself when that request isn't profiled.
+    '''
+    session = getattr(_local, 'session', None)
+    if session is None:
+        return fn
+
+    def _run(*args, **kwargs):
+        if not session.start():
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            session.stop()
+    return _run
+
+
+def folded_stacks(stats, min_seconds=0.0001):
+    '''
+    Convert profile stats into collapsed stacks. cProfile only records caller/callee
+    pairs, so a function's time is split between the stacks leading to it in proportion
+    to the time each of its callers spent in it, as flameprof does.
+
+    Args:
+        stats (pstats.Stats): profile to convert
+        min_seconds (float): stacks with less time than this are left out
+
+    Returns:
+        dict: microseconds of own time by ``;`` separated stack, outermost call first
+    '''
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    folded = {}
+
+    def _walk(func, path, stack, share):
+        _, _, own_time, _, _ = entries[func]
+        stack = stack + (_frame_label(func),)
+        if own_time * share >= min_seconds:
+            key = ";".join(stack)
+            folded[key] = folded.get(key, 0) + int(round(own_time * share * 1e6))
+        for callee, edge_time in callees.get(func, ()):
+            callee_time = entries[callee][3]
+            if callee in path or callee_time <= 0 or edge_time * share < min_seconds:
+                continue
+            _walk(callee, path | {callee}, stack, share * edge_time / callee_time)
+
+    for func, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            _walk(func, {func}, (), 1.0)
+    return folded
+
+
+def _frame_label(func):
+    filename, line, name = func
+    if filename == '~':  # built-in
+        return name.replace(';', ',')
+    for root in sorted(sys.path, key=len, reverse=True):
+        if root and filename.startswith(root + os.sep):
+            filename = filename[len(root) + 1:]
+            break
+    return f"{name} ({filename}:{line})".replace(';', ',')
+
+
+def _rotate(directory, keep):
+    profiles = sorted(glob.glob(os.path.join(directory, '*.prof')), key=os.path.getmtime)
+    for path in profiles[:max(len(profiles) - keep, 0)]:
+        for old in (path, path[:-len('.prof')] + '.folded'):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+
+'''
+Rendered results pages kept under a stable key for their search, so a page can be served
+again from its permalink, or shared, without rerunning the search. Pages are compressed
+once when stored (gzip, and brotli when the optional ``brotli`` package is installed)
+and served with strong ETags so repeat views can be answered with ``304 Not Modified``.
+'''
+
+import config
+import gzip
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+from listen_local_app.cache import SQLiteStore
+
+try:
+    import brotli
+except ImportError:  # optional, pages are only gzipped without it
+    brotli = None
+
+
+results_cache_bytes = getattr(config, 'results_cache_bytes', 32 * 1024 * 1024)
+results_ttl = getattr(config, 'results_ttl', 24 * 3600)
+results_store_path = getattr(config, 'results_store_path', None)
+results_store_max_pages = getattr(config, 'results_store_max_pages', 10000)
+
+
+def search_key(zipcode, daterange, distance, playlist_id):
+    '''
+    Return the permalink key of a search, the same for every search of the same zipcode,
+    dates and distance filling the same playlist. The page embeds its user's playlist,
+    so searches by different users are kept apart.
+
+    Args:
+        zipcode (str): zipcode searched near
+        daterange (str): daterange from the search form, see ``process_daterange``
+        distance (str): search radius (mi)
+        playlist_id (str): Spotify id of the playlist the search filled
+    '''
+    dates = [part.strip() for part in str(daterange).split(" to ")]
+    if len(dates) == 2 and dates[0] == dates[1]:
+        dates = dates[:1]
+    search = "|".join([str(zipcode).strip(), " to ".join(dates), str(distance).strip(),
+                       str(playlist_id)])
+    return hashlib.sha256(search.encode()).hexdigest()[:24]
+
+
+class Page:
+    '''
+    A rendered page with its body in every encoding it is served in
+
+    Args:
+        html (str): the page
+        created (float): when the page was rendered (default: now)
+    '''
+    __slots__ = ('html', 'created', 'digest', 'bodies', 'size')
+
+    # Encodings tried in order when a client accepts several equally
+    ENCODINGS = ('br', 'gzip', 'identity')
+
+    def __init__(self, html, created=None):
+        self.html = html
+        self.created = time.time() if created is None else created
+        body = html.encode('utf-8')
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=6)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body)
+        self.size = sum(len(body) for body in self.bodies.values())
+
+    def negotiate(self, accept_encodings):
+        '''
+        Pick the encoding to send for an ``Accept-Encoding`` header
+
+        Args:
+            accept_encodings (werkzeug.datastructures.Accept): ``request.accept_encodings``
+
+        Returns:
+            str: 'br', 'gzip' or 'identity'
+        '''
+        best, best_quality = 'identity', 0
+        for encoding in self.ENCODINGS:
+            quality = accept_encodings[encoding] if encoding in self.bodies else 0
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def etag(self, encoding):
+        '''
+        Strong ETag of the page in ``encoding``. Each encoding gets its own as they are
+        different bytes.
+        '''
+        return self.digest if encoding == 'identity' else f"{self.digest}-{encoding}"
+
+
+class ResultPageCache:
+    '''
+    Thread-safe LRU cache of ``Page`` objects bounded by their total size in bytes and by
+    age. With ``path`` set the pages' html is also kept in SQLite, so any app process
+    sharing that file can serve a permalink; pages read from disk are compressed again
+    and kept in memory. Expired pages are deleted from disk every ``purge_every`` pages
+    stored, along with the oldest pages past ``max_stored``.
+
+    Args:
+        max_bytes (int): most bytes of page bodies, in every encoding, kept in memory;
+            the least recently used pages are evicted past it (default: from config.py)
+        ttl (float): seconds a page is served for after it was rendered (default: from
+            config.py)
+        path (str): SQLite database file to keep the pages in too, or ``None`` to keep
+            them in memory only (default: from config.py)
+        max_stored (int): most pages kept on disk (default: from config.py)
+        purge_every (int): pages stored between purges of the disk tier (default: 100)
+    '''
+    def __init__(self, max_bytes=results_cache_bytes, ttl=results_ttl,
+                 path=results_store_path, max_stored=results_store_max_pages,
+                 purge_every=100):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.store = (SQLiteStore(path, table='result_pages', purge_every=purge_every,
+                                  max_rows=max_stored) if path else None)
+
+    def put(self, key, html):
+        '''
+        Store the page rendered for search ``key``, replacing any earlier one
+
+        Returns:
+            Page: the stored page
+        '''
+        page = Page(html)
+        with self._lock:
+            self._insert(key, page)
+        if self.store is not None:
+            self.store.set(key, {'html': html, 'created': page.created}, self.ttl)
+        return page
+
+    def get(self, key):
+        '''
+        Return the page stored for search ``key`` or ``None`` if it is missing or too old
+        '''
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None and page.created + self.ttl > time.time():
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page
+            if page is not None:
+                self._remove(key)
+        stored = self.store.get(key) if self.store is not None else None
+        if stored is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        page = Page(stored[0]['html'], stored[0]['created'])
+        with self._lock:
+            self._insert(key, page)
+            self.hits += 1
+        return page
+
+    def max_age(self, page):
+        '''
+        Return the whole seconds ``page`` has left to be served for
+        '''
+        return max(int(page.created + self.ttl - time.time()), 0)
+
+    def _insert(self, key, page):
+        # Called with ``self._lock`` held
+        self._remove(key)
+        self._pages[key] = page
+        self._bytes += page.size
+        while self._bytes > self.max_bytes and len(self._pages) > 1:
+            self._remove(next(iter(self._pages)))
+
+    def _remove(self, key):
+        # Called with ``self._lock`` held
+        page = self._pages.pop(key, None)
+        if page is not None:
+            self._bytes -= page.size
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._bytes = 0
+            self.hits = self.misses = 0
+        if self.store is not None:
+            self.store.clear()
+
+    def stats(self):
+        '''
+        Return a dictionary of hit/miss counters, the pages kept in memory and their size
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._pages),
+                'bytes': self._bytes}
+
+
+pages = ResultPageCache()
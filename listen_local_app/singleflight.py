@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+'''
+Single-flight coalescing of identical upstream calls. The first caller for a key leads
+and makes the call; callers arriving while it is in flight wait for it to finish and
+then read its result from the cache the leader fills. With a lock directory the
+coalescing spans every app process sharing that directory (and a shared cache); a
+key's lock file only exists while a call for it is in flight.
+'''
+
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+class SingleFlight:
+    '''
+    Thread-safe registry of in-flight calls by key
+
+    Args:
+        name (str): name of the calls coalesced, used for lock file names
+        lock_dir (str): directory for the lock files coordinating app processes, or
+            ``None`` to coalesce within this process only (default: None)
+        timeout (float): longest time (s) a caller waits for an in-flight call before
+            making the call itself (default: 30)
+    '''
+    def __init__(self, name, lock_dir=None, timeout=30):
+        self.name = name
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def lead(self, key):
+        '''
+        Take the lead on the call for ``key``.
+
+        Returns:
+            Flight: handle whose ``done()`` must be called once the leader's result is
+                cached, or ``None`` after waiting for another caller's call to finish,
+                in which case its result should be read from the cache (and the call made
+                uncoordinated if it isn't there)
+        '''
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight(self, key)
+        if not leader:
+            # A thread still holding its own flight (e.g. an unread stream) can't wait on it
+            if flight.owner != threading.get_ident():
+                flight.wait(self.timeout)
+            return None
+        if self.lock_dir and not flight.lock_file():
+            # Another process was making the call
+            flight.done()
+            return None
+        return flight
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def _lock_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.lock_dir, f"{self.name}-{digest}.lock")
+
+
+class Flight:
+    '''
+    A call in flight, see ``SingleFlight.lead``
+    '''
+    __slots__ = ('group', 'key', 'owner', 'fd', 'path', '_event')
+
+    def __init__(self, group, key):
+        self.group = group
+        self.key = key
+        self.owner = threading.get_ident()
+        self.fd = None
+        self.path = None
+        self._event = threading.Event()
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+    def lock_file(self):
+        '''
+        Take the lock file for this key. Returns True if it was free; otherwise waits for
+        the process holding it to let go (or ``timeout``) and returns False.
+        '''
+        path = self.group._lock_path(self.key)
+        while True:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if not self._try_lock():
+                break
+            if self._holds(path):
+                self.path = path
+                return True
+            # The leader before us removed the file as we opened it; take a fresh one
+            os.close(self.fd)
+        deadline = time.time() + self.group.timeout
+        while time.time() < deadline and not self._try_lock():
+            time.sleep(0.05)
+        return False
+
+    def _try_lock(self):
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _holds(self, path):
+        # Whether ``path`` is still the file locked through ``self.fd``
+        try:
+            return os.stat(path).st_ino == os.fstat(self.fd).st_ino
+        except FileNotFoundError:
+            return False
+
+    def done(self):
+        '''
+        Finish the call, waking every caller waiting on it. A leader removes its lock
+        file first, while it still holds the lock, so lock files don't pile up.
+        '''
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+        with self.group._lock:
+            if self.group._flights.get(self.key) is self:
+                del self.group._flights[self.key]
+        self._event.set()
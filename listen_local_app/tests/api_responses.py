@@ -9,7 +9,17 @@ test_seatgeek_noconcert_response = '{"events": []}'
 test_auth_url = 'https://accounts.spotify.com/api/token'
 test_auth_response = '{"access_token": "test-access-token-1234", "token_type": "Bearer", "expires_in": 3600, "refresh_token": "test-refresh-token", "scope": "playlist-read-private user-library-read user-follow-read playlist-modify-private playlist-modify-public user-read-email user-top-read"}'  # noqa
 
+test_seatgeek_paged_url = f"https://api.seatgeek.com/2/events?client_id={fake_client_id}&geoip=22222&type=concert&per_page=1&range=3mi&datetime_local.gte=2019-01-22T00:00:00&datetime_local.lte=2019-01-22T23:00:00"  # noqa
+test_seatgeek_paged_response = '{"events": [{"id": 1}], "meta": {"total": 3, "page": 1, "per_page": 1}}'  # noqa
+test_seatgeek_paged_url2 = test_seatgeek_paged_url + "&page=2"
+test_seatgeek_paged_response2 = '{"events": [{"id": 2}], "meta": {"total": 3, "page": 2, "per_page": 1}}'  # noqa
+test_seatgeek_paged_url3 = test_seatgeek_paged_url + "&page=3"
+test_seatgeek_paged_response3 = '{"events": [{"id": 3}], "meta": {"total": 3, "page": 3, "per_page": 1}}'  # noqa
+
 
 TEST_URL2API_RESPONSE = {test_seatgeek_url: test_seatgeek_response,
                          test_auth_url: test_auth_response,
-                         test_seatgeek_noconcert_url: test_seatgeek_noconcert_response}  # noqa
\ No newline at end of file
+                         test_seatgeek_noconcert_url: test_seatgeek_noconcert_response,
+                         test_seatgeek_paged_url: test_seatgeek_paged_response,
+                         test_seatgeek_paged_url2: test_seatgeek_paged_response2,
+                         test_seatgeek_paged_url3: test_seatgeek_paged_response3}
@@ -0,0 +1,24 @@
+#!/usr/bin/python
+
+import subprocess
+import sys
+
+from listen_local_app import create_app
+
+
+def test_create_app():
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    response = client.get('/')
+    assert response.status_code == 200
+    assert b'Listen Local' in response.data
+    assert set(app.config['STARTUP_TIMINGS']) == {'create_app', 'first_request'}
+
+
+def test_heavy_modules_are_imported_lazily():
+    code = ("import sys; sys.path[:0] = {!r}; "
+            "from listen_local_app import create_app; create_app(); "
+            "print(sorted(m for m in ('pandas', 'numpy', 'spotipy') if m in sys.modules))")
+    output = subprocess.check_output([sys.executable, '-c', code.format(sys.path)])
+    assert output.decode().strip().splitlines()[-1] == '[]'
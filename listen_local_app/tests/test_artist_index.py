@@ -0,0 +1,61 @@
+#!/usr/bin/python
+
+import pytest
+
+from listen_local_app.artist_index import ArtistIndex
+from listen_local_app.artist_index import match_key
+
+
+@pytest.mark.parametrize("name,expected", [
+    ('The Beatles', 'beatles'),
+    ('  BEYONCÉ ', 'beyonce'),
+    ("Guns N' Roses", 'guns n roses'),
+    ('Simon & Garfunkel', 'simon and garfunkel'),
+    ('The The', 'the'),
+])
+def test_match_key(name, expected):
+    assert match_key(name) == expected
+
+
+def test_artist_index_matches_exact_and_near_exact_names():
+    index = ArtistIndex()
+    index.add('The Beatles', 'beatles-id')
+    index.add('Red Hot Chili Peppers', 'rhcp-id')
+
+    assert index.match('beatles') == 'beatles-id'
+    assert index.match('Red Hot Chilli Peppers') == 'rhcp-id'
+    assert index.match('Red Hot') is None
+    assert index.match('The Rolling Stones') is None
+    assert index.stats() == {'hits': 2, 'misses': 2, 'size': 2}
+
+
+def test_artist_index_matches_seatgeek_performer_ids():
+    index = ArtistIndex()
+    index.add('Prince', 'prince-id', performer_id=42)
+    assert index.match('The Artist Formerly Known As Prince', performer_id=42) == 'prince-id'
+    assert index.match('Somebody Else', performer_id=43) is None
+
+
+def test_artist_index_persists_and_seeds(tmp_path):
+    path = str(tmp_path / 'artists.db')
+    ArtistIndex(path=path).add('Band A', 'a', performer_id=1)
+
+    index = ArtistIndex(path=path, seed=lambda: [('Band B', 'b')])
+    assert index.match('band a') == 'a'
+    assert index.match('Renamed Band', performer_id=1) == 'a'
+    assert index.match('Band B') == 'b'
+
+
+def test_artist_index_keeps_most_recently_matched_names():
+    index = ArtistIndex(max_names=2)
+    index.add('Band A', 'a')
+    index.add('Band B', 'b')
+    assert index.match('band a') == 'a'
+    index.add('Band C', 'c')
+
+    assert len(index) == 2
+    assert index.match('Band B') is None
+    assert index.match('Band A') == 'a'
+    assert index.match('Band C') == 'c'
+    # The dropped name no longer takes part in near-exact matching
+    assert all('band b' not in keys for keys in index._trigrams.values())
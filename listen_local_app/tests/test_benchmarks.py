@@ -0,0 +1,21 @@
+#!/usr/bin/python
+
+import config
+
+from benchmarks.run import main
+from listen_local_app import clients
+from listen_local_app import functions
+from listen_local_app import views
+from unittest import mock
+
+
+def test_benchmark_smoke():
+    # The harness points the app at its fake servers; put everything back afterwards
+    with mock.patch.dict(config.__dict__), mock.patch.dict(clients.__dict__), \
+            mock.patch.dict(functions.__dict__), mock.patch.dict(views.__dict__):
+        results = main(['--requests', '2', '--concurrency', '1', '2', '--events', '5',
+                        '--throttle-rate', 'search=0.2', '--error-rate', 'events=0.2'])
+    assert [(r['scenario'], r['concurrency']) for r in results] == [
+        ('seatgeek', 1), ('seatgeek', 2), ('resolve', 1), ('resolve', 2),
+        ('callback', 1), ('callback', 2)]
+    assert all(r['errors'] == 0 and r['p50'] is not None for r in results)
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+
+import json
+
+from listen_local_app import bulk
+from listen_local_app.functions import NoConcertsFound
+from unittest import mock
+
+
+def _market(zipcode, playlist=''):
+    return {'zipcode': zipcode, 'daterange': '2019-01-22 to 2019-01-23', 'radius': '5',
+            'playlist': playlist}
+
+
+def test_read_markets(tmp_path):
+    path = tmp_path / 'markets.csv'
+    path.write_text("zipcode,daterange,radius,playlist\n"
+                    "19130, 2019-01-22 to 2019-01-23, 5, Philly weekend\n\n"
+                    "10001,2019-01-22,10\n"
+                    "60601,2019-01-22\n"
+                    "60602,,5\n")
+    assert bulk.read_markets(str(path)) == [
+        dict(_market('19130'), playlist='Philly weekend'),
+        {'zipcode': '10001', 'daterange': '2019-01-22', 'radius': '10', 'playlist': ''}]
+
+
+def _fake_concerts(zipcode, date1, date2, dist, stream):
+    if zipcode == '00000':
+        raise NoConcertsFound
+    if zipcode == '99999':
+        raise ValueError('boom')
+    return {'events': iter([{'zipcode': zipcode}])}
+
+
+def _fake_rows(data, progress):
+    progress(events_fetched=3)
+    yield 1, 11, {'spotify_top_track_id': 'b'}
+    yield 0, 10, {'spotify_top_track_id': 'a'}
+    yield 2, 12, {'spotify_top_track_id': float('nan')}
+
+
+@mock.patch('listen_local_app.pipeline.save_playlist_tracks', return_value=2)
+@mock.patch('listen_local_app.playlists.get_or_create_playlist',
+            return_value=('pl1', 'spotify:playlist:pl1', True))
+@mock.patch('listen_local_app.functions.iter_performer_rows', side_effect=_fake_rows)
+@mock.patch('listen_local_app.functions.get_concert_information', side_effect=_fake_concerts)
+def test_run_market(mock_concerts, mock_rows, mock_playlist, mock_save):
+    report = bulk.run_market('Bearer abc', _market('19130', 'Philly weekend'))
+    assert mock_concerts.call_args[1] == {'date1': '2019-01-22', 'date2': '2019-01-23',
+                                          'dist': '5', 'stream': True}
+    assert mock_playlist.call_args[1] == {'name': 'Philly weekend'}
+    assert mock_save.call_args[0] == ('Bearer abc', 'pl1',
+                                      ['spotify:track:a', 'spotify:track:b'], True)
+    assert {k: report[k] for k in ('outcome', 'playlist_uri', 'events', 'artists', 'tracks',
+                                   'tracks_added')} == {
+        'outcome': 'done', 'playlist_uri': 'spotify:playlist:pl1', 'events': 3, 'artists': 3,
+        'tracks': 2, 'tracks_added': 2}
+
+    # A playlist link is written to as it is
+    report = bulk.run_market('Bearer abc', _market(
+        '19130', 'https://open.spotify.com/playlist/xyz?si=1'))
+    assert report['playlist_uri'] == 'spotify:playlist:xyz'
+    assert mock_save.call_args[0][1:] == ('xyz', ['spotify:track:a', 'spotify:track:b'], False)
+    assert mock_playlist.call_count == 1
+
+    assert bulk.run_market('Bearer abc', _market('00000'))['outcome'] == 'no_concerts'
+    report = bulk.run_market('Bearer abc', _market('99999'))
+    assert report['outcome'] == 'failed' and 'boom' in report['error']
+
+
+def _fake_run_market(access_token, market):
+    outcome = 'failed' if market['zipcode'] == '99999' else 'done'
+    return dict(market, outcome=outcome, seconds=0.5, error=None)
+
+
+def test_run_markets_resumes_from_checkpoint(tmp_path):
+    path = str(tmp_path / 'markets.checkpoint.json')
+    markets = [_market('19130'), _market('99999'), _market('10001')]
+    with mock.patch.object(bulk, 'run_market', side_effect=_fake_run_market) as mock_run:
+        reports = bulk.run_markets(markets[:2], lambda: 'Bearer abc', max_workers=2,
+                                   checkpoint=bulk.Checkpoint(path))
+        assert [report['outcome'] for report in reports] == ['done', 'failed']
+        with open(path) as f:
+            assert len(json.load(f)) == 2
+
+        # Picking up again only runs the failed and new markets
+        mock_run.reset_mock()
+        reports = bulk.run_markets(markets, lambda: 'Bearer abc',
+                                   checkpoint=bulk.Checkpoint(path))
+        assert sorted(call[0][1]['zipcode'] for call in mock_run.call_args_list) == \
+            ['10001', '99999']
+        assert [report['zipcode'] for report in reports] == ['19130', '99999', '10001']
+        assert reports[0]['resumed'] and 'resumed' not in reports[2]
+
+        text = bulk.format_report(reports, seconds=1.5)
+        assert '19130' in text and 'done (resumed)' in text
+        assert text.splitlines()[-1] == "3 markets: 2 done, 1 failed in 1.5s"
+
+
+def test_run_markets_stops_at_budget():
+    def _spend(access_token, market):
+        bulk.clients._calls[0] += 5
+        return _fake_run_market(access_token, market)
+
+    with mock.patch.object(bulk, 'run_market', side_effect=_spend):
+        reports = bulk.run_markets([_market('19130'), _market('10001')], lambda: 'Bearer abc',
+                                   max_workers=1, budget=5)
+    assert [report['outcome'] for report in reports] == ['done', 'skipped']
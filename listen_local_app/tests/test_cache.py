@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+import time
+
+from listen_local_app.cache import SQLiteStore
+from listen_local_app.cache import TieredCache
+from listen_local_app.cache import TTLCache
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache()
+    cache.set('a', 1, ttl=0.05)
+    assert cache.get('a') == 1
+    time.sleep(0.06)
+    assert cache.get('a') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 0}
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1, ttl=60)
+    cache.set('b', 2, ttl=60)
+    cache.get('a')
+    cache.set('c', 3, ttl=60)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'cache.db'))
+    store.set('a', ['x', float('nan')], ttl=60)
+    value, expires = store.get('a')
+    assert value[0] == 'x' and value[1] != value[1]
+    store.set('b', 1, ttl=-1)
+    assert store.get('b') is None
+
+
+def test_sqlite_store_purges_expired_entries(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'cache.db'), purge_every=3)
+    store.set('a', 1, ttl=-1)
+    store.set('b', 2, ttl=60)
+
+    def _rows():
+        return store._connection().execute('SELECT key FROM cache ORDER BY key').fetchall()
+    assert _rows() == [('a',), ('b',)]
+    store.set('c', 3, ttl=60)
+    assert _rows() == [('b',), ('c',)]
+
+
+def test_tiered_cache_reads_through_to_disk(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    TieredCache(path=path).set('a', [1, 2], ttl=60)
+
+    # A fresh in-memory tier (e.g. after a restart) still finds the entry
+    cache = TieredCache(path=path)
+    assert cache.get('a') == [1, 2]
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 0
+    assert len(cache) == 1
+
+
+def test_tiered_cache_stores_tuple_keys_on_disk(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    key = ('19130', '2020-01-01', '2020-01-01')
+    TieredCache(path=path).set(key, (5.0, {'events': []}), ttl=60)
+    assert TieredCache(path=path).get(key) == [5.0, {'events': []}]
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+import io
+import pytest
+import requests
+
+from listen_local_app import clients
+from listen_local_app import metrics
+from listen_local_app.clients import get_session
+from listen_local_app.clients import RateLimiter
+from listen_local_app.clients import RetrySession
+from listen_local_app.clients import set_rate_limit
+from listen_local_app.clients import SpotifyAppToken
+from unittest import mock
+
+
+def _response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO()
+    response.headers.update(headers or {})
+    return response
+
+
+def _session_with(side_effect):
+    session = RetrySession(max_retries=2, backoff=0)
+    patcher = mock.patch('requests.Session.request', side_effect=side_effect)
+    return session, patcher
+
+
+def test_retries_server_errors():
+    session, patcher = _session_with([_response(503), _response(200)])
+    with patcher as mock_request:
+        assert session.get('https://api.seatgeek.com/2/events').status_code == 200
+        assert mock_request.call_count == 2
+        assert mock_request.call_args[1]['timeout'] == session.timeout
+
+
+def test_replaces_a_missing_timeout():
+    session, patcher = _session_with([_response(200), _response(200)])
+    with patcher as mock_request:
+        session.get('https://api.spotify.com/v1/search', timeout=None)
+        assert mock_request.call_args[1]['timeout'] == session.timeout
+        session.get('https://api.spotify.com/v1/search', timeout=1)
+        assert mock_request.call_args[1]['timeout'] == 1
+
+
+def test_counts_calls_for_the_calling_thread():
+    session, patcher = _session_with([_response(503), _response(200)])
+    with patcher, metrics.CallCounter() as calls:
+        session.get('https://api.seatgeek.com/2/events')
+    assert calls.count == 2
+
+
+def test_does_not_retry_server_errors_on_post():
+    session, patcher = _session_with([_response(500), _response(200)])
+    with patcher as mock_request:
+        assert session.post('https://api.spotify.com/v1/users/me/playlists').status_code == 500
+        assert mock_request.call_count == 1
+
+
+@mock.patch('time.sleep')
+def test_honors_retry_after(mock_sleep):
+    session, patcher = _session_with([_response(429, {'Retry-After': '2'}), _response(201)])
+    with patcher as mock_request:
+        assert session.post('https://api.spotify.com/v1/playlists/x/tracks').status_code == 201
+        assert mock_request.call_count == 2
+    mock_sleep.assert_called_once_with(2.0)
+
+
+def test_gives_up_on_long_retry_after():
+    session, patcher = _session_with([_response(429, {'Retry-After': '3600'})])
+    with patcher as mock_request:
+        assert session.get('https://api.spotify.com/v1/search').status_code == 429
+        assert mock_request.call_count == 1
+
+
+def test_retries_connection_errors_then_raises():
+    session, patcher = _session_with(requests.ConnectionError('boom'))
+    with patcher as mock_request:
+        with pytest.raises(requests.ConnectionError):
+            session.get('https://api.seatgeek.com/2/events')
+        assert mock_request.call_count == 3
+
+
+def test_sessions_are_shared_per_host():
+    assert get_session('https://api.spotify.com/v1/me') is get_session('https://api.spotify.com/v1/search')  # noqa
+    assert get_session('https://api.spotify.com/v1/me') is not get_session('https://api.seatgeek.com/2/events')  # noqa
+
+
+@mock.patch('listen_local_app.clients.post')
+def test_spotify_app_token_is_reused_until_close_to_expiry(mock_post):
+    mock_post.return_value.json.side_effect = [
+        {'access_token': 'token-1', 'expires_in': 3600},
+        {'access_token': 'token-2', 'expires_in': 30},
+        {'access_token': 'token-3', 'expires_in': 3600},
+    ]
+    token = SpotifyAppToken(authorization='Basic abc', refresh_margin=60)
+    assert token.get_access_token() == 'token-1'
+    assert token.get_access_token() == 'token-1'
+    assert mock_post.call_count == 1
+
+    # Pretend the first token is about to run out
+    token._expires_at = 0
+    assert token.get_access_token() == 'token-2'
+    # token-2 already expires within the refresh margin, so it is replaced right away
+    assert token.get_access_token(as_dict=True)['access_token'] == 'token-3'
+    assert mock_post.call_count == 3
+
+
+@mock.patch('time.sleep')
+def test_rate_limiter_spaces_calls_out(mock_sleep):
+    limiter = RateLimiter(rate=10, burst=2)
+    for _ in range(4):
+        limiter.acquire()
+    waits = [call[0][0] for call in mock_sleep.call_args_list]
+    assert len(waits) == 2
+    assert waits[0] == pytest.approx(0.1, abs=0.01) and waits[1] == pytest.approx(0.2, abs=0.01)
+
+
+def test_rate_limit_applies_to_every_attempt():
+    session, patcher = _session_with([_response(503), _response(200)])
+    limiter = mock.Mock()
+    with patcher, mock.patch('listen_local_app.clients._rate_limiter', limiter):
+        session.get('https://api.seatgeek.com/2/events')
+    assert limiter.acquire.call_count == 2
+    set_rate_limit(5)
+    try:
+        assert clients._rate_limiter.rate == 5 and clients._rate_limiter.burst == 5
+    finally:
+        set_rate_limit(None)
+    assert clients._rate_limiter is None
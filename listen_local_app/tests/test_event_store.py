@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+import pytest
+
+from listen_local_app.event_store import distance_miles
+from listen_local_app.event_store import EventStore
+from listen_local_app.event_store import read_gazetteer
+
+
+def _event(event_id, lat, day='2019-01-22'):
+    return {'id': event_id, 'datetime_local': f'{day}T20:00:00',
+            'venue': {'location': {'lat': lat, 'lon': -75.0}}}
+
+
+def test_distance_miles():
+    assert distance_miles(40.0, -75.0, 40.0, -75.0) == 0
+    assert distance_miles(40.0, -75.0, 40.1, -75.0) == pytest.approx(6.91, abs=0.01)
+
+
+def test_read_gazetteer(tmp_path):
+    census = tmp_path / 'zcta.txt'
+    census.write_text("GEOID\tALAND\tINTPTLAT\tINTPTLONG    \n"
+                      "19130\t2400000\t39.967\t-75.173\n")
+    assert read_gazetteer(str(census)) == [('19130', 39.967, -75.173)]
+    plain = tmp_path / 'zipcodes.csv'
+    plain.write_text("zipcode,lat,lon\n19123,39.964,-75.147\n\n")
+    assert read_gazetteer(str(plain)) == [('19123', 39.964, -75.147)]
+    plain.write_text("zipcode,x,y\n19123,39.964,-75.147\n")
+    with pytest.raises(ValueError):
+        read_gazetteer(str(plain))
+
+
+def test_centroids(tmp_path):
+    gazetteer = tmp_path / 'zipcodes.csv'
+    gazetteer.write_text("zipcode,lat,lon\n19130,39.967,-75.173\n")
+    store = EventStore(str(tmp_path / 'events.db'), gazetteer=str(gazetteer))
+    store.add_centroids([('19130', 40.0, -75.0)])
+    assert store.centroid('19130') == (40.0, -75.0)
+    assert store.centroid('99999') is None
+
+    missing = EventStore(str(tmp_path / 'other.db'), gazetteer=str(tmp_path / 'nope.csv'))
+    assert missing.centroid('19130') is None
+
+
+def test_searches_inside_a_complete_search_are_covered(tmp_path):
+    store = EventStore(str(tmp_path / 'events.db'))
+    days = ['2019-01-22']
+    store.add_events(40.0, -75.0, 10, days, [_event(1, 40.0), _event(2, 40.05),
+                                             _event(3, 40.1), _event(4, 40.0, '2019-01-23')])
+
+    assert store.covers(40.01, -75.0, 3, days)
+    assert not store.covers(40.0, -75.0, 10, days)  # the cells on the edge are cut off
+    assert not store.covers(40.01, -75.0, 3, days + ['2019-01-23'])
+    assert [event['id'] for event in store.events(40.01, -75.0, 3, days)] == [1, 2]
+    assert [event['id'] for event in store.events(40.0, -75.0, 7, days)] == [1, 2, 3]
+    assert store.stats() == {'hits': 1, 'misses': 2}
+
+    # A radius reaching past every touched cell covers the whole search
+    radius = store.fetch_radius(40.0, -75.0, 10)
+    assert 10 < radius < 16
+    store.add_events(40.0, -75.0, radius, days, [_event(1, 40.0)])
+    assert store.covers(40.0, -75.0, 10, days)
+    # Events in covered cells missing from a newer search are dropped
+    assert [event['id'] for event in store.events(40.0, -75.0, 10, days)] == [1]
+
+
+def test_incomplete_and_stale_searches_are_not_covered(tmp_path):
+    store = EventStore(str(tmp_path / 'events.db'))
+    store.add_events(40.0, -75.0, 10, ['2019-01-22'], [_event(1, 40.0)], complete=False)
+    assert not store.covers(40.0, -75.0, 1, ['2019-01-22'])
+    assert len(store.events(40.0, -75.0, 1, ['2019-01-22'])) == 1
+
+    stale = EventStore(str(tmp_path / 'stale.db'), ttl=0)
+    stale.add_events(40.0, -75.0, 10, ['2019-01-22'], [_event(1, 40.0)])
+    assert not stale.covers(40.0, -75.0, 1, ['2019-01-22'])
@@ -1,21 +1,47 @@
 #!/usr/bin/python
 
 import json
+import math
 import pytest
 import spotipy
+import threading
+import time
 
 from api_responses import TEST_URL2API_RESPONSE
+from concurrent.futures import ThreadPoolExecutor
 from conftest import _get_app_client
+from datetime import datetime
+from datetime import timedelta
+from listen_local_app.cache import TieredCache
+from listen_local_app.event_store import EventStore
+from listen_local_app.functions import artist_cache
+from listen_local_app.functions import artist_index
+from listen_local_app.functions import build_df_and_get_spotify_info
 from listen_local_app.functions import get_access_token
 from listen_local_app.functions import get_concert_information
+from listen_local_app.functions import get_lookup_pool
+from listen_local_app.functions import iter_spotify_artist_tracks
 from listen_local_app.functions import lookup_spotify_artist_track
 from listen_local_app.functions import make_spotify_play_button
 from listen_local_app.functions import NoConcertsFound, FailedApiRequestError
 from listen_local_app.functions import process_daterange
+from listen_local_app.functions import resolve_spotify_artist_tracks
+from listen_local_app.functions import seatgeek_cache
 from spotipy.oauth2 import SpotifyClientCredentials
 from unittest import mock
 
 
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    artist_cache.clear()
+    artist_index.clear()
+    seatgeek_cache.clear()
+    yield
+    artist_cache.clear()
+    artist_index.clear()
+    seatgeek_cache.clear()
+
+
 @pytest.mark.parametrize("daterange,expected", [
     ('2011-02-01', ('2011-02-01', None)),
     ('2011-02-01 to 2011-02-04', ('2011-02-01', '2011-02-04')),
@@ -39,7 +65,7 @@ def test_make_spotify_play_button():
     assert make_spotify_play_button(uri, height=height, width=width) == expected
 
 
-# This method will be used by the mock to replace requests.get
+# This method will be used by the mock to replace clients.get and clients.post
 # https://stackoverflow.com/questions/15753390/how-can-i-mock-requests-and-the-response
 def mocked_requests(*args, **kwargs):
     class MockResponse:
@@ -53,13 +79,21 @@ def mocked_requests(*args, **kwargs):
             else:
                 return None
 
+        def iter_content(self, chunk_size=1):
+            # Small chunks so values are split across them
+            body = (self.text or '').encode()
+            return (body[i:i + 7] for i in range(0, len(body), 7))
+
+        def close(self):
+            pass
+
     if args[0] in TEST_URL2API_RESPONSE.keys():
         return MockResponse(TEST_URL2API_RESPONSE[args[0]], 200)
     else:
         return MockResponse(None, 404)
 
 
-@mock.patch('requests.post', side_effect=mocked_requests)
+@mock.patch('listen_local_app.clients.post', side_effect=mocked_requests)
 def test_get_access_token(mock_post):
     app, client = _get_app_client()
     with app.test_request_context():
@@ -68,27 +102,227 @@ def test_get_access_token(mock_post):
         assert token == "Bearer test-access-token-1234"
 
 
-@mock.patch('requests.get', side_effect=mocked_requests)
+@mock.patch('listen_local_app.clients.get', side_effect=mocked_requests)
 def test_get_concert_information_success(mock_get):
     data = get_concert_information("19130", "2019-01-22", None, per_page=1,
                                    client_id="this_aint_real")
     assert data == {"events": [{}]}
 
 
-@mock.patch('requests.get', side_effect=mocked_requests)
+@mock.patch('listen_local_app.clients.get', side_effect=mocked_requests)
 def test_get_concert_information_no_concerts(mock_get):
     with pytest.raises(NoConcertsFound):
         get_concert_information("11111", "2019-01-22", None, per_page=1,
                                 client_id="this_aint_real")
 
 
-@mock.patch('requests.get', side_effect=mocked_requests)
+@mock.patch('listen_local_app.clients.get', side_effect=mocked_requests)
 def test_get_concert_information_404(mock_get):
     with pytest.raises(FailedApiRequestError):
         get_concert_information("11112", "2019-01-22", None, per_page=1,
                                 client_id="this_aint_real")
 
 
+@pytest.mark.parametrize("max_workers", [1, 4])
+@mock.patch('listen_local_app.clients.get', side_effect=mocked_requests)
+def test_get_concert_information_follows_pages(mock_get, max_workers):
+    data = get_concert_information("22222", "2019-01-22", None, per_page=1,
+                                   client_id="this_aint_real", max_workers=max_workers)
+    assert [event['id'] for event in data['events']] == [1, 2, 3]
+    assert mock_get.call_count == 3
+
+
+@mock.patch('listen_local_app.clients.get', side_effect=mocked_requests)
+def test_get_concert_information_stream(mock_get):
+    data = get_concert_information("22222", "2019-01-22", None, per_page=1,
+                                   client_id="this_aint_real", stream=True)
+    # Only the first page is fetched up front
+    assert mock_get.call_count == 1
+    assert next(data['events']) == {"id": 1}
+    assert [event['id'] for event in data['events']] == [2, 3]
+
+
+@mock.patch('listen_local_app.clients.get', side_effect=mocked_requests)
+def test_get_concert_information_cached(mock_get):
+    for _ in range(2):
+        data = get_concert_information("22222", "2019-01-22", None, per_page=1,
+                                       client_id="this_aint_real", stream=True)
+        assert [event['id'] for event in data['events']] == [1, 2, 3]
+    assert mock_get.call_count == 3
+
+    # A refresh fetches again even though the response is cached
+    data = get_concert_information("22222", "2019-01-22", None, per_page=1,
+                                   client_id="this_aint_real", refresh=True)
+    assert len(data['events']) == 3 and mock_get.call_count == 6
+    mock_get.reset_mock()
+
+    # Searches without concerts are cached too
+    with pytest.raises(NoConcertsFound):
+        get_concert_information("11111", "2019-01-22", None, per_page=1,
+                                client_id="this_aint_real")
+    with pytest.raises(NoConcertsFound):
+        get_concert_information("11111", "2019-01-22", None, per_page=1,
+                                client_id="this_aint_real")
+    assert mock_get.call_count == 1
+
+
+@mock.patch('listen_local_app.clients.get', side_effect=mocked_requests)
+def test_get_concert_information_cached_on_disk(mock_get, tmp_path):
+    path = str(tmp_path / 'seatgeek.db')
+    for _ in range(2):
+        # A fresh cache each time, so the second search is answered from disk
+        with mock.patch('listen_local_app.functions.seatgeek_cache', TieredCache(path=path)):
+            data = get_concert_information("22222", "2019-01-22", None, per_page=1,
+                                           client_id="this_aint_real")
+        assert [event['id'] for event in data['events']] == [1, 2, 3]
+    assert mock_get.call_count == 3
+
+
+def _day_of_events(url, **kwargs):
+    # Two events a day, one at 23:30, except on 2019-01-24
+    first = datetime.strptime(url.split('datetime_local.gte=')[1][:10], '%Y-%m-%d')
+    until = url.split('datetime_local.lte=')[1][:19]
+    events = []
+    day = first
+    while day.strftime('%Y-%m-%dT00:00:00') <= until:
+        name = day.strftime('%Y-%m-%d')
+        if name != '2019-01-24':
+            events += [{'id': f'{name}-1', 'datetime_local': f'{name}T20:00:00'},
+                       {'id': f'{name}-2', 'datetime_local': f'{name}T23:30:00'}]
+        day += timedelta(days=1)
+    events = [event for event in events if event['datetime_local'] <= until]
+    meta = {'total': len(events), 'page': 1, 'per_page': 100}
+    body = json.dumps({'events': events, 'meta': meta}).encode()
+    return mock.Mock(status_code=200, iter_content=lambda chunk_size: [body])
+
+
+@mock.patch('listen_local_app.clients.get', side_effect=_day_of_events)
+def test_get_concert_information_shards_days(mock_get):
+    data = get_concert_information("19130", "2019-01-22", "2019-01-24", max_workers=3,
+                                   shard=True)
+    # Late events are kept on every day but the last, as in an unsharded search
+    assert [event['id'] for event in data['events']] == [
+        '2019-01-22-1', '2019-01-22-2', '2019-01-23-1', '2019-01-23-2']
+    assert data['meta']['total'] == 4
+    assert mock_get.call_count == 3
+
+    # Sliding the window along only fetches the new day
+    data = get_concert_information("19130", "2019-01-23", "2019-01-25", stream=True,
+                                   shard=True)
+    assert [event['id'] for event in data['events']] == [
+        '2019-01-23-1', '2019-01-23-2', '2019-01-25-1']
+    assert mock_get.call_count == 4
+
+    # Single day searches end earlier, so they don't share the whole day shards
+    assert [event['id'] for event in get_concert_information(
+        "19130", "2019-01-23", None)['events']] == ['2019-01-23-1']
+    assert mock_get.call_count == 5
+    with pytest.raises(NoConcertsFound):
+        get_concert_information("19130", "2019-01-24", "2019-01-24", shard=True)
+
+
+@pytest.mark.parametrize("date2", ["2019-01-23", "2019-01-24", "2019-01-25"])
+def test_get_concert_information_shards_match_range_search(date2):
+    with mock.patch('listen_local_app.clients.get', side_effect=_day_of_events):
+        whole = get_concert_information("19130", "2019-01-22", date2, use_cache=False)
+        sharded = get_concert_information("19130", "2019-01-22", date2, shard=True)
+    assert sharded['events'] == whole['events']
+
+
+@mock.patch('listen_local_app.clients.get')
+def test_get_concert_information_keeps_only_used_fields(mock_get):
+    event = _make_event(1, [(10, 'Band A')])
+    event['venue']['location'] = {'lat': 40.0, 'lon': -75.0, 'zip': '19130'}
+    event.update(stats={'lowest_price': 20}, taxonomies=[{'name': 'concert'}])
+    body = json.dumps({'events': [event], 'meta': {'total': 1}}).encode()
+    mock_get.return_value = mock.Mock(status_code=200, iter_content=lambda chunk_size: [body])
+
+    data = get_concert_information("19130", "2019-01-22", None)
+    assert mock_get.call_args[1] == {'stream': True}
+    assert data['meta'] == {'total': 1}
+    assert data['events'] == [{
+        'id': 1, 'title': 'Show 1', 'datetime_local': '2019-01-22T20:00:00',
+        'venue': {'id': 9, 'name': 'The Venue', 'address': '1 Main St',
+                  'extended_address': 'Philadelphia, PA 19130',
+                  'location': {'lat': 40.0, 'lon': -75.0}},
+        'performers': [{'id': 10, 'short_name': 'Band A', 'genres': [{'name': 'rock'}]}]}]
+
+
+def _slow_day_of_events(url, **kwargs):
+    time.sleep(0.1)
+    return _day_of_events(url)
+
+
+@mock.patch('listen_local_app.clients.get', side_effect=_slow_day_of_events)
+def test_get_concert_information_coalesces_concurrent_searches(mock_get):
+    def _search(_):
+        data = get_concert_information("19130", "2019-01-22", None, stream=True)
+        return len(list(data['events']))
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(_search, range(4))) == [1] * 4
+    assert mock_get.call_count == 1
+
+    # A caller still holding the unread stream of a search doesn't wait on itself
+    data = get_concert_information("19130", "2019-01-23", None, stream=True)
+    started = time.time()
+    assert len(get_concert_information("19130", "2019-01-23", None)['events']) == 1
+    assert time.time() - started < 1
+    assert len(list(data['events'])) == 1
+
+
+@mock.patch('listen_local_app.clients.get')
+def test_get_concert_information_filters_larger_radius(mock_get):
+    def _event(event_id, lat):
+        return {'id': event_id, 'venue': {'location': {'lat': lat, 'lon': -75.0}}}
+
+    # ~0.7mi and ~6.9mi north of the search center
+    cached = {'meta': {'geolocation': {'lat': 40.0, 'lon': -75.0}},
+              'events': [_event(1, 40.01), _event(2, 40.1)]}
+    seatgeek_cache.set(("19130", "2019-01-22", "2019-01-22"), (10.0, cached), ttl=60)
+
+    data = get_concert_information("19130", "2019-01-22", None, dist=3)
+    assert [event['id'] for event in data['events']] == [1]
+    assert len(get_concert_information("19130", "2019-01-22", None, dist="10")['events']) == 2
+    with pytest.raises(NoConcertsFound):
+        get_concert_information("19130", "2019-01-22", None, dist=0.5)
+    assert mock_get.call_count == 0
+    assert len(cached['events']) == 2
+
+
+def _events_near_40n(url, **kwargs):
+    events = [{'id': n, 'datetime_local': '2019-01-22T20:00:00',
+               'venue': {'location': {'lat': lat, 'lon': -75.0}}}
+              for n, lat in enumerate([40.0, 40.03, 40.1])]
+    meta = {'total': 3, 'geolocation': {'lat': 40.0, 'lon': -75.0, 'postal_code': '19130'}}
+    body = json.dumps({'events': events, 'meta': meta}).encode()
+    return mock.Mock(status_code=200, iter_content=lambda chunk_size: [body])
+
+
+@mock.patch('listen_local_app.clients.get', side_effect=_events_near_40n)
+def test_get_concert_information_answers_nearby_zipcodes_from_event_store(mock_get,
+                                                                          tmp_path):
+    store = EventStore(str(tmp_path / 'events.db'))
+    with mock.patch('listen_local_app.functions.event_store', store):
+        assert len(get_concert_information("19130", "2019-01-22", None, dist=10)['events']) == 3
+        assert 'geoip=19130' in mock_get.call_args[0][0]
+
+        # ~0.7mi north, inside the area just fetched
+        store.add_centroids([('19123', 40.01, -75.0)])
+        data = get_concert_information("19123", "2019-01-22", None, dist=3)
+        assert [event['id'] for event in data['events']] == [0, 1]
+        assert data['meta']['geolocation']['postal_code'] == '19123'
+        assert mock_get.call_count == 1
+
+        # Reaching past it fetches the area around the zipcode
+        data = get_concert_information("19123", "2019-01-22", None, dist=8)
+        assert [event['id'] for event in data['events']] == [0, 1, 2]
+        assert 'lat=40.01&lon=-75.0' in mock_get.call_args[0][0]
+        data = get_concert_information("19123", "2019-01-22", None, dist=8, stream=True)
+        assert [event['id'] for event in data['events']] == [0, 1, 2]
+        assert mock_get.call_count == 2
+
+
 @pytest.mark.skip(reason="Test calls out to Spotify API")
 def test_lookup_spotify_artist_track():
     '''
@@ -100,3 +334,154 @@ def test_lookup_spotify_artist_track():
     sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
     artist_id, track_id = lookup_spotify_artist_track(sp, "Jay-Z")
     assert artist_id == '3nFkdlSjzX9mRTtwJOzDYB'
+
+
+class FakeSpotify:
+    '''
+    Stand in for ``spotipy.Spotify`` that answers searches from a dict of artist ids
+    '''
+    def __init__(self, artists, delay=0):
+        self.artists = artists
+        self.delay = delay
+        self.search_calls = 0
+
+    def search(self, q, type):
+        self.search_calls += 1
+        time.sleep(self.delay)
+        name = q.split(':', 1)[1]
+        if name == 'Broken Band':
+            raise spotipy.SpotifyException(500, -1, 'server error')
+        items = [{'id': self.artists[name]}] if name in self.artists else []
+        return {'artists': {'items': items}}
+
+    def artist_top_tracks(self, artist_id):
+        return {'tracks': [{'id': f'track-{artist_id}'}]}
+
+
+def test_lookup_spotify_artist_track_prefers_exact_name_match():
+    sp = mock.Mock()
+    sp.search.return_value = {'artists': {'items': [{'id': 'x', 'name': 'Beatles Tribute'},
+                                                    {'id': 'b', 'name': 'The Beatles'}]}}
+    sp.artist_top_tracks.return_value = {'tracks': [{'id': 't'}]}
+    assert lookup_spotify_artist_track(sp, 'Beatles', performer_id=7) == ('b', 't')
+
+    # Known performers, by name or seatgeek id, are matched without searching again
+    assert lookup_spotify_artist_track(sp, 'the beatles') == ('b', 't')
+    assert lookup_spotify_artist_track(sp, 'Fab Four', performer_id=7) == ('b', 't')
+    assert sp.search.call_count == 1
+
+
+def test_resolve_spotify_artist_tracks_keeps_order_and_isolates_failures(capsys):
+    sp = FakeSpotify({'Band A': 'a', 'Band B': 'b'})
+    results = resolve_spotify_artist_tracks(sp, ['Band B', 'Broken Band', 'Nobody', 'Band A'],
+                                            max_workers=4)
+    assert 'Spotify lookup failed for Broken Band: SpotifyException' in capsys.readouterr().out
+    assert results[0] == ('b', 'track-b')
+    assert all(math.isnan(x) for x in results[1])
+    assert all(math.isnan(x) for x in results[2])
+    assert results[3] == ('a', 'track-a')
+
+
+def test_resolve_spotify_artist_tracks_runs_concurrently():
+    names = [f'Band {i}' for i in range(8)]
+    sp = FakeSpotify({name: name for name in names}, delay=0.1)
+    start = time.time()
+    resolve_spotify_artist_tracks(sp, names, max_workers=8)
+    assert time.time() - start < 0.5
+
+
+def test_resolve_spotify_artist_tracks_share_one_lookup_pool():
+    threads = set()
+
+    class _Spotify(FakeSpotify):
+        def search(self, q, type):
+            threads.add(threading.current_thread().name)
+            return super().search(q, type)
+
+    for i in range(3):
+        resolve_spotify_artist_tracks(_Spotify({}), [f'Pooled Band {i}-{j}' for j in range(4)])
+    assert get_lookup_pool() is get_lookup_pool()
+    assert threads and all(name.startswith('spotify-lookup') for name in threads)
+    assert len(threads) <= get_lookup_pool()._max_workers
+
+
+def test_resolve_spotify_artist_tracks_uses_cache():
+    sp = FakeSpotify({'Band A': 'a'})
+    resolve_spotify_artist_tracks(sp, ['Band A', 'Nobody'])
+    assert sp.search_calls == 2
+
+    # Repeat lookups, including the negative result and a differently cased name, are cached
+    results = resolve_spotify_artist_tracks(sp, ['band  a', 'Nobody'])
+    assert sp.search_calls == 2
+    assert results[0] == ('a', 'track-a')
+    assert artist_cache.stats()['hits'] == 2
+
+
+def test_resolve_spotify_artist_tracks_looks_up_each_artist_once():
+    # Without de-duplication the slow concurrent lookups would all miss the cache
+    sp = FakeSpotify({'Band A': 'a', 'Band B': 'b'}, delay=0.05)
+    results = resolve_spotify_artist_tracks(
+        sp, ['Band A', 'Band B', 'band a', 'Band A ', 'Band B'], max_workers=8)
+    assert sp.search_calls == 2
+    assert results == [('a', 'track-a'), ('b', 'track-b'), ('a', 'track-a'),
+                       ('a', 'track-a'), ('b', 'track-b')]
+
+
+def _make_event(event_id, performers, datetime_local="2019-01-22T20:00:00"):
+    return {'id': event_id, 'title': f'Show {event_id}', 'datetime_local': datetime_local,
+            'venue': {'id': 9, 'name': 'The Venue', 'address': '1 Main St',
+                      'extended_address': 'Philadelphia, PA 19130'},
+            'performers': [{'id': pid, 'short_name': name, 'genres': [{'name': 'rock'}]}
+                           for pid, name in performers]}
+
+
+@mock.patch('listen_local_app.functions.get_spotify_client')
+def test_build_df_and_get_spotify_info(mock_spotify):
+    sp = mock_spotify.return_value = FakeSpotify({'Band A': 'a', 'Band B': 'b'})
+    events = (event for event in [_make_event(1, [(10, 'Band A'), (11, 'Nobody')]),
+                                  _make_event(2, [(12, 'Band B'), (10, 'Band A')],
+                                              datetime_local="2019-01-23T19:30:00")])
+    df = build_df_and_get_spotify_info({'events': events})
+
+    assert list(df.index) == [10, 11, 12]
+    assert sp.search_calls == 3
+    assert df.loc[10, 'event_id'] == 2
+    assert df.loc[10, 'date_local'] == 'Jan 23 2019' and df.loc[10, 'time_local'] == '07:30PM'
+    assert df.loc[12, 'spotify_top_track_uri'] == 'spotify:track:track-b'
+    assert df.spotify_top_track_uri.isnull().loc[11]
+
+
+@mock.patch('listen_local_app.functions.get_spotify_client')
+def test_build_df_and_get_spotify_info_shares_lookups_between_performer_ids(mock_spotify):
+    sp = mock_spotify.return_value = FakeSpotify({'Band A': 'a'}, delay=0.05)
+    events = [_make_event(1, [(10, 'Band A')]), _make_event(2, [(20, 'BAND A')])]
+    df = build_df_and_get_spotify_info({'events': events})
+
+    assert sp.search_calls == 1
+    assert list(df.spotify_artist_id) == ['a', 'a']
+
+
+def test_iter_spotify_artist_tracks_reraises_producer_errors():
+    def _performers():
+        yield 'a', 'Band A'
+        raise FailedApiRequestError
+
+    results = []
+    with pytest.raises(FailedApiRequestError):
+        for key, info in iter_spotify_artist_tracks(FakeSpotify({'Band A': 'a'}), _performers()):
+            results.append((key, info))
+    assert results == [('a', ('a', 'track-a'))]
+
+
+def test_iter_spotify_artist_tracks_stops_reading_performers():
+    read = []
+
+    def _performers():
+        for i in range(10):
+            read.append(i)
+            yield i, f'Stopped Band {i}'
+
+    results = list(iter_spotify_artist_tracks(FakeSpotify({}), _performers(),
+                                              should_stop=lambda: len(read) >= 2))
+    assert read == [0, 1]
+    assert sorted(key for key, _ in results) == [0, 1]
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+import socket
+import time
+
+from listen_local_app import jobs
+from listen_local_app.jobs import JobQueue
+from unittest import mock
+
+
+def _wait_for(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in ('done', 'error'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def _search(zipcode, progress):
+    progress(stage='resolving artists', artists_found=2)
+    progress(artists_resolved=2)
+    return {'zipcode': zipcode}
+
+
+def _broken_search(zipcode, progress):
+    raise RuntimeError('upstream exploded')
+
+
+def test_job_queue_reports_progress_and_result():
+    queue = JobQueue(max_workers=1)
+    job = _wait_for(queue, queue.submit(_search, '19130'))
+    assert job['status'] == 'done' and job['stage'] == 'done'
+    assert job['progress'] == {'artists_found': 2, 'artists_resolved': 2}
+    assert job['result'] == {'zipcode': '19130'}
+
+
+def _busy_search(zipcode, progress):
+    progress(stage='resolving artists')
+    for n in range(1, 101):
+        progress(artists_found=n)
+    progress(stage='writing playlist')
+    progress(tracks_written=5)
+    return {'zipcode': zipcode}
+
+
+def test_job_queue_throttles_progress_saves(tmp_path):
+    queue = JobQueue(max_workers=1, path=str(tmp_path / 'jobs.db'), progress_interval=60)
+    with mock.patch.object(queue, '_save', wraps=queue._save) as save:
+        job = _wait_for(queue, queue.submit(_busy_search, '19130'))
+    # queued, running, each stage and the final state
+    assert save.call_count == 5
+    assert job['progress'] == {'artists_found': 100, 'tracks_written': 5}
+
+
+def test_job_queue_reports_errors():
+    queue = JobQueue(max_workers=1)
+    job = _wait_for(queue, queue.submit(_broken_search, '19130'))
+    assert job['status'] == 'error'
+    assert 'upstream exploded' not in job['error']
+
+
+def test_job_queue_state_is_shared_through_sqlite(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    job_id = JobQueue(max_workers=1, path=path).submit(_search, '19130')
+    other_process_queue = JobQueue(max_workers=1, path=path)
+    assert _wait_for(other_process_queue, job_id)['result'] == {'zipcode': '19130'}
+    assert JobQueue(path=path).get('not-a-job') is None
+
+
+def test_job_queue_recovers_jobs_of_stopped_processes(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    queue = JobQueue(max_workers=1, path=path)
+    job_id = queue.submit(_search, '19130')
+    assert _wait_for(queue, job_id)['call'] is None
+
+    # A job left running by a process that has stopped
+    stopped = dict(queue.get(job_id), status='running', stage='resolving artists',
+                   result=None, owner=f"{socket.gethostname()}:999999999",
+                   call={'task': jobs._task_name(_search), 'args': ['10001'], 'kwargs': {}})
+    queue._save(stopped)
+    restarted = JobQueue(max_workers=1, path=path)
+    assert _wait_for(restarted, job_id)['result'] == {'zipcode': '10001'}
+    assert restarted.get(job_id)['owner'] == restarted.owner
+    assert JobQueue(max_workers=1, path=path).recover() == []
+
+    # Jobs that can't be found again by name aren't kept on disk
+    job = _wait_for(queue, queue.submit(lambda zipcode, progress: None, '19130'))
+    assert job['call'] is None
@@ -0,0 +1,37 @@
+#!/usr/bin/python
+
+import json
+import pytest
+
+from listen_local_app.jsonstream import iter_array_items
+
+
+def _chunks(document, size):
+    body = json.dumps(document, ensure_ascii=False).encode()
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("size", [1, 3, 64, 100000])
+def test_iter_array_items(size):
+    document = {'before': {'a': [1, 2]},
+                'events': [{'id': 12345, 'title': 'Björk, "live"', 'tags': [[], {}]},
+                           67.5, None, 'Motörhead'],
+                'meta': {'total': 4}}
+    other = {}
+    items = iter_array_items(_chunks(document, size), 'events', other)
+    assert next(items) == document['events'][0]
+    assert other == {'before': {'a': [1, 2]}}
+    assert list(items) == document['events'][1:]
+    assert other == {'before': {'a': [1, 2]}, 'meta': {'total': 4}}
+
+
+def test_iter_array_items_empty():
+    other = {}
+    assert list(iter_array_items([b' { "events" : [ ] , "meta": {}} '], 'events', other)) == []
+    assert other == {'meta': {}}
+    assert list(iter_array_items([b'{}'], 'events')) == []
+
+
+def test_iter_array_items_truncated():
+    with pytest.raises(ValueError):
+        list(iter_array_items([b'{"events": [{"id": 1}, {"id"'], 'events'))
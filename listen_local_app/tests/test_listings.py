@@ -0,0 +1,37 @@
+#!/usr/bin/python
+
+import pandas as pd
+
+from listen_local_app.listings import format_local_datetime
+from listen_local_app.listings import Listing
+from listen_local_app.listings import LISTING_COLUMNS
+from listen_local_app.listings import LISTING_FIELDS
+from listen_local_app.listings import render_listings
+
+
+def _row(performer, datetime_local, title=None):
+    date_local, time_local = format_local_datetime(datetime_local)
+    return {'date_local': date_local, 'time_local': time_local,
+            'event_title': title or f'{performer} live', 'performer': performer,
+            'genre': 'NA', 'venue_name': 'The Venue',
+            'venue_address': '1 Main St, Philadelphia, PA 19130'}
+
+
+def test_format_local_datetime():
+    assert format_local_datetime('2019-01-22T20:05:00') == ('Jan 22 2019', '08:05PM')
+
+
+def test_render_listings_matches_dataframe_to_html():
+    rows = [_row('Band B', '2019-01-23T20:00:00'),
+            _row('Band A', '2019-01-22T21:00:00', title='Rock & <Roll> "Night"'),
+            _row('Band C', '2019-01-22T19:00:00'),
+            _row('Band D', '2019-01-22T21:00:00'),
+            dict(_row('Band E', '2019-02-01T12:00:00'), venue_name=float('nan'))]
+
+    df = pd.DataFrame(rows)
+    listings_df = df[LISTING_FIELDS].sort_values(by=["date_local", "time_local"])
+    listings_df.columns = LISTING_COLUMNS
+    expected = listings_df.to_html(index=False, classes=["dataframe", "text-left"])
+    expected = expected.replace('border="1"', '')
+
+    assert render_listings(Listing(i, row) for i, row in enumerate(rows)) == expected
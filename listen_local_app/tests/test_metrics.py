@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+import pytest
+import threading
+import time
+
+from listen_local_app import create_app
+from listen_local_app import metrics
+from unittest import mock
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.reset()
+    with mock.patch.object(metrics, 'enabled', True):
+        yield
+    metrics.reset()
+
+
+def test_timed_is_a_no_op_when_disabled():
+    metrics.reset()
+    metrics.start_request()
+    with metrics.timed('seatgeek'):
+        pass
+    assert metrics.finish_request() is None
+    assert metrics.render() == "\n"
+
+
+def test_request_timings_include_worker_threads(enabled_metrics):
+    metrics.start_request()
+    with metrics.timed('seatgeek'):
+        pass
+
+    def _lookup():
+        with metrics.timed('spotify_search'):
+            pass
+    threads = [threading.Thread(target=metrics.propagate(_lookup)) for _ in range(2)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    server_timing = metrics.finish_request()
+    assert 'seatgeek;dur=' in server_timing
+    assert 'spotify_search;dur=' in server_timing and 'desc="2 call(s)"' in server_timing
+    assert 'total;dur=' in server_timing
+
+    text = metrics.render()
+    assert '# TYPE listen_local_stage_seconds histogram' in text
+    assert 'listen_local_stage_seconds_count{stage="spotify_search"} 2' in text
+    assert 'listen_local_stage_seconds_bucket{stage="seatgeek",le="+Inf"} 1' in text
+
+
+def test_timed_iter_times_producing_items_only(enabled_metrics):
+    closed = []
+
+    def _slow_items():
+        try:
+            for n in range(3):
+                time.sleep(0.01)
+                yield n
+        finally:
+            closed.append(True)
+
+    metrics.start_request()
+    items = metrics.timed_iter('seatgeek_events', _slow_items())
+    assert next(items) == 0
+    time.sleep(0.2)  # the consumer's time isn't counted
+    items.close()
+    assert closed == [True]
+
+    server_timing = metrics.finish_request()
+    stage = next(entry for entry in server_timing.split(", ")
+                 if entry.startswith('seatgeek_events;'))
+    assert 'desc="1 call(s)"' in stage
+    assert 10 <= float(stage.split('dur=')[1].split(';')[0]) < 150
+
+
+def test_app_serves_metrics_and_server_timing(enabled_metrics):
+    app = create_app()
+    client = app.test_client()
+    metrics.observe('listen_local_upstream_seconds', 0.2, host='api.spotify.com', status=200)
+
+    response = client.get('/')
+    assert response.headers['Server-Timing'].startswith('total;dur=')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert ('listen_local_upstream_seconds_bucket{host="api.spotify.com",status="200",le="0.25"} 1'
+            in text)
+
+
+def test_render_with_mixed_label_types(enabled_metrics):
+    metrics.observe('listen_local_upstream_seconds', 0.2, host='api.spotify.com', status=200)
+    metrics.observe('listen_local_upstream_seconds', 0.2, host='api.spotify.com', status='error')
+    metrics.observe('listen_local_upstream_seconds', 0.2, host='api.spotify.com', status='200')
+    text = metrics.render()
+    assert 'listen_local_upstream_seconds_count{host="api.spotify.com",status="200"} 2' in text
+    assert 'listen_local_upstream_seconds_count{host="api.spotify.com",status="error"} 1' in text
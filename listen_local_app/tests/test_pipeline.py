@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+import json
+
+from listen_local_app.functions import NoConcertsFound
+from listen_local_app.pipeline import run_search
+from listen_local_app.pipeline import stream_search
+from unittest import mock
+
+
+def _listing(performer, date, time, track):
+    return {'date_local': date, 'time_local': time, 'event_title': f'{performer} live',
+            'performer': performer, 'genre': 'rock', 'venue_name': 'The Venue',
+            'venue_address': '1 Main St, Philadelphia, PA 19130',
+            'spotify_top_track_uri': track}
+
+
+def _fake_rows(data, progress=None):
+    return iter([
+        (2, 12, dict(_listing('Nobody', 'Jan 22 2019', '07:00PM', None),
+                     spotify_top_track_id=float('nan'))),
+        (0, 10, dict(_listing('Band B', 'Jan 23 2019', '08:00PM', None),
+                     spotify_top_track_id='b')),
+        (1, 11, dict(_listing('Band A', 'Jan 22 2019', '09:00PM', None),
+                     spotify_top_track_id='a')),
+    ])
+
+
+class FakeSpotifyUserApi:
+    '''
+    Records the user-scoped Spotify calls made through ``clients.get`` and ``clients.post``
+    '''
+    def __init__(self):
+        self.posts = []
+
+    def get(self, url, **kwargs):
+        if url.startswith('https://api.spotify.com/v1/me/playlists'):
+            return mock.Mock(status_code=200, text=json.dumps({'items': [], 'next': None}))
+        assert url == 'https://api.spotify.com/v1/me'
+        return mock.Mock(text=json.dumps({'id': 'user1'}))
+
+    def post(self, url, **kwargs):
+        self.posts.append((url, json.loads(kwargs['data'])))
+        return mock.Mock(status_code=201,
+                         text=json.dumps({'id': 'pl1', 'uri': 'spotify:playlist:pl1',
+                                          'snapshot_id': 's1'}))
+
+
+@mock.patch('listen_local_app.pipeline.iter_performer_rows', side_effect=_fake_rows)
+@mock.patch('listen_local_app.pipeline.get_concert_information')
+def test_run_search(mock_concerts, mock_rows):
+    api = FakeSpotifyUserApi()
+    stages = []
+    with mock.patch('listen_local_app.clients.get', api.get), \
+            mock.patch('listen_local_app.clients.post', api.post):
+        result = run_search('Bearer abc', '19130', '2019-01-22 to 2019-01-23', '5',
+                            progress=lambda stage=None, **kw: stage and stages.append(stage))
+
+    assert mock_concerts.call_args[1]['date2'] == '2019-01-23'
+    assert result['playlist_uri'] == 'spotify:playlist:pl1'
+    assert api.posts[0][0] == 'https://api.spotify.com/v1/users/user1/playlists'
+    assert api.posts[0][1]['name'] == 'Concerts near 19130 2019-01-22 to 2019-01-23 (5mi)'
+    assert api.posts[1][1] == {'uris': ['spotify:track:b', 'spotify:track:a'], 'position': 0}
+    assert stages == ['fetching events', 'resolving artists', 'writing playlist',
+                      'playlist written']
+
+    # Listings are sorted by date then time
+    listings = result['listings']
+    assert listings.index('Nobody') < listings.index('Band A') < listings.index('Band B')
+    assert 'border="1"' not in listings
+
+
+@mock.patch('listen_local_app.pipeline.get_concert_information', side_effect=NoConcertsFound)
+def test_run_search_no_concerts(mock_concerts):
+    result = run_search('Bearer abc', '19130', '2019-01-22', '5')
+    assert result == {'error': "We didn't find any concerts near 19130 :-("}
+
+
+@mock.patch('listen_local_app.pipeline.get_concert_information')
+@mock.patch('listen_local_app.pipeline.iter_performer_rows')
+def test_stream_search(mock_rows, mock_concerts):
+    mock_rows.return_value = iter([
+        (1, 11, dict(_listing('Band B', 'Jan 23 2019', '08:00PM', None),
+                     spotify_top_track_id='b')),
+        (2, 12, dict(_listing('Nobody', 'Jan 22 2019', '07:00PM', None),
+                     spotify_top_track_id=float('nan'))),
+        (0, 10, dict(_listing('Band A', 'Jan 22 2019', '09:00PM', None),
+                     spotify_top_track_id='a')),
+    ])
+    api = FakeSpotifyUserApi()
+    with mock.patch('listen_local_app.clients.get', api.get), \
+            mock.patch('listen_local_app.clients.post', api.post):
+        result = stream_search('Bearer abc', '19130', '2019-01-22', '5', chunk_size=2)
+        # The playlist exists before any listing is read
+        assert result['playlist_uri'] == 'spotify:playlist:pl1' and len(api.posts) == 1
+        chunks = list(result['rows'])
+
+    assert [[position for position, _ in chunk] for chunk in chunks] == [[1, 2], [0]]
+    assert chunks[0][0][1][3] == 'Band B'
+    # Tracks are added once all rows are read, in the order performers were first seen
+    assert api.posts[1][1]['uris'] == ['spotify:track:a', 'spotify:track:b']
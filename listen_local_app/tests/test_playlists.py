@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+import json
+import threading
+
+from listen_local_app.playlists import get_or_create_playlist
+from listen_local_app.playlists import sync_playlist_tracks
+from listen_local_app.playlists import write_playlist_tracks
+from unittest import mock
+
+
+class FakePlaylistApi:
+    '''
+    Applies add-tracks calls to an in-memory playlist the way Spotify does
+    '''
+    def __init__(self, fail_on_call=None, playlist=None):
+        self.playlist = list(playlist or [])
+        self.calls = 0
+        self.fail_on_call = fail_on_call
+        self.snapshot = 0
+        self.edit_on_read = []
+        self.deletes = []
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        if url.endswith('/me'):
+            return mock.Mock(status_code=200, text=json.dumps({'id': 'user1'}))
+        if '/me/playlists' in url:
+            items = [{'id': 'other', 'name': 'Concerts near 19130 2019-01-22 (5mi)',
+                      'owner': {'id': 'someone-else'}, 'uri': 'spotify:playlist:other'},
+                     {'id': 'pl1', 'name': 'Concerts near 19130 2019-01-22 (5mi)',
+                      'owner': {'id': 'user1'}, 'uri': 'spotify:playlist:pl1'}]
+            return mock.Mock(status_code=200, text=json.dumps({'items': items, 'next': None}))
+        items = [{'track': {'uri': uri}} for uri in self.playlist] + [{'track': None}]
+        response = {'snapshot_id': self.snapshot, 'tracks': {'items': items, 'next': None}}
+        if self.edit_on_read:
+            # Someone else edits the playlist right after we read it
+            self.playlist.insert(0, self.edit_on_read.pop())
+            self.snapshot += 1
+        return mock.Mock(status_code=200, text=json.dumps(response))
+
+    def delete(self, url, **kwargs):
+        body = json.loads(kwargs['data'])
+        self.deletes.append(body)
+        removals = [(position, track['uri']) for track in body['tracks']
+                    for position in track['positions']]
+        if any(position >= len(self.playlist) or self.playlist[position] != uri
+               for position, uri in removals):
+            return mock.Mock(status_code=400, text='{"error": "Could not remove tracks"}')
+        positions = {position for position, _ in removals}
+        self.playlist = [uri for i, uri in enumerate(self.playlist) if i not in positions]
+        self.snapshot += 1
+        return mock.Mock(status_code=200, text=json.dumps({'snapshot_id': self.snapshot}))
+
+    def post(self, url, **kwargs):
+        body = json.loads(kwargs['data'])
+        with self._lock:
+            self.calls += 1
+            position = body.get('position', len(self.playlist))
+            if (len(body['uris']) > 100 or position > len(self.playlist)
+                    or self.calls == self.fail_on_call):
+                return mock.Mock(status_code=400, text='{"error": "bad request"}')
+            self.playlist[position:position] = body['uris']
+            return mock.Mock(status_code=201, text='{"snapshot_id": "s"}')
+
+
+def test_write_playlist_tracks_batches_in_order_without_duplicates():
+    tracks = [f'spotify:track:{i}' for i in range(250)]
+    api = FakePlaylistApi()
+    with mock.patch('listen_local_app.clients.post', api.post):
+        written = write_playlist_tracks('Bearer abc', 'pl1', tracks + tracks[:10])
+    assert written == 250
+    assert api.calls == 3
+    assert api.playlist == tracks
+
+
+def test_write_playlist_tracks_stops_after_failed_batch():
+    tracks = [f'spotify:track:{i}' for i in range(250)]
+    api = FakePlaylistApi(fail_on_call=2)
+    with mock.patch('listen_local_app.clients.post', api.post):
+        written = write_playlist_tracks('Bearer abc', 'pl1', tracks)
+    assert written == 100
+    assert api.playlist == tracks[:100]
+
+
+def test_get_or_create_playlist_finds_earlier_playlist():
+    api = FakePlaylistApi()
+    with mock.patch('listen_local_app.clients.get', api.get):
+        assert get_or_create_playlist('Bearer abc', '19130', '2019-01-22', '5') == \
+            ('pl1', 'spotify:playlist:pl1', False)
+        # A search of another radius gets a playlist of its own
+        with mock.patch('listen_local_app.playlists._create_playlist',
+                        return_value=('pl2', 'spotify:playlist:pl2')) as create:
+            assert get_or_create_playlist('Bearer abc', '19130', '2019-01-22', '10') == \
+                ('pl2', 'spotify:playlist:pl2', True)
+        assert create.call_args[0][4] == 'Concerts near 19130 2019-01-22 (10mi)'
+
+
+def test_sync_playlist_tracks_sends_only_changes():
+    api = FakePlaylistApi(playlist=['spotify:track:a', 'spotify:track:b', 'spotify:track:a',
+                                    'spotify:track:c'])
+    with mock.patch('listen_local_app.clients.get', api.get), \
+            mock.patch('listen_local_app.clients.post', api.post), \
+            mock.patch('listen_local_app.clients.delete', api.delete):
+        result = sync_playlist_tracks('Bearer abc', 'pl1', ['spotify:track:c', 'spotify:track:d',
+                                                            'spotify:track:a'])
+        # The unwanted track and the repeat of a wanted one are removed by position
+        assert result == {'added': 1, 'removed': 2}
+        assert api.playlist == ['spotify:track:a', 'spotify:track:c', 'spotify:track:d']
+        assert api.deletes == [{'tracks': [{'uri': 'spotify:track:b', 'positions': [1]},
+                                           {'uri': 'spotify:track:a', 'positions': [2]}],
+                                'snapshot_id': 0}]
+        assert api.calls == 1
+
+        # Nothing left to change
+        assert sync_playlist_tracks('Bearer abc', 'pl1', ['spotify:track:a', 'spotify:track:c',
+                                                          'spotify:track:d']) == \
+            {'added': 0, 'removed': 0}
+        assert api.calls == 1
+
+
+def test_sync_playlist_tracks_rereads_after_concurrent_edit():
+    api = FakePlaylistApi(playlist=['spotify:track:a', 'spotify:track:b'])
+    api.edit_on_read = ['spotify:track:x']
+    with mock.patch('listen_local_app.clients.get', wraps=api.get) as mock_get, \
+            mock.patch('listen_local_app.clients.post', api.post), \
+            mock.patch('listen_local_app.clients.delete', api.delete):
+        result = sync_playlist_tracks('Bearer abc', 'pl1', ['spotify:track:a', 'spotify:track:c'])
+    # The removal made against the first read is turned down, and the second read sees
+    # the track someone else added
+    assert mock_get.call_count == 2
+    assert [body['snapshot_id'] for body in api.deletes] == [0, 1]
+    assert result == {'added': 1, 'removed': 2}
+    assert api.playlist == ['spotify:track:a', 'spotify:track:c']
+
+
+def test_sync_playlist_tracks_adds_nothing_until_removals_go_through():
+    api = FakePlaylistApi(playlist=['spotify:track:a', 'spotify:track:b'])
+    api.edit_on_read = ['spotify:track:x', 'spotify:track:y']
+    with mock.patch('listen_local_app.clients.get', api.get), \
+            mock.patch('listen_local_app.clients.post', api.post), \
+            mock.patch('listen_local_app.clients.delete', api.delete):
+        result = sync_playlist_tracks('Bearer abc', 'pl1', ['spotify:track:c'], max_attempts=2)
+    assert result == {'added': 0, 'removed': 0}
+    assert len(api.deletes) == 2
+    assert api.calls == 0
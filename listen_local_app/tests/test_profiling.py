@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+import os
+import pstats
+import pytest
+import threading
+
+from listen_local_app import create_app
+from listen_local_app import metrics
+from listen_local_app import profiling
+from unittest import mock
+
+
+def _busy(n=20000):
+    return sum(i * i for i in range(n))
+
+
+@pytest.fixture
+def enabled_profiling(tmp_path):
+    with mock.patch.multiple(profiling, enabled=True, token='s3cret', sample_rate=0.0,
+                             profile_dir=str(tmp_path)):
+        yield tmp_path
+
+
+def test_should_profile(enabled_profiling):
+    assert profiling.should_profile('s3cret')
+    assert not profiling.should_profile('wrong')
+    assert not profiling.should_profile(None)
+    with mock.patch.object(profiling, 'sample_rate', 1.0):
+        assert profiling.should_profile(None)
+    with mock.patch.object(profiling, 'enabled', False):
+        assert not profiling.should_profile('s3cret')
+
+
+def test_propagate_is_a_no_op_when_not_profiling():
+    assert profiling.propagate(_busy) is _busy
+    assert metrics.propagate(_busy) is _busy
+
+
+def test_session_includes_worker_threads(enabled_profiling):
+    session = profiling.start_request('test', 's3cret')
+    _busy()
+    thread = threading.Thread(target=metrics.propagate(_busy))
+    thread.start()
+    thread.join()
+    profiling.finish_request()
+    assert profiling.current() is None
+
+    path = os.path.join(str(enabled_profiling), session.name)
+    stats = pstats.Stats(path + '.prof')
+    busy = [func for func in stats.stats if func[2] == '_busy']
+    assert stats.stats[busy[0]][1] == 2
+
+    with open(path + '.folded') as f:
+        lines = f.read().splitlines()
+    assert lines
+    for line in lines:
+        stack, microseconds = line.rsplit(' ', 1)
+        assert int(microseconds) > 0
+    assert any(line.startswith('_busy (') for line in lines)  # worker thread root
+
+
+def test_profiles_are_written_once_the_last_thread_finishes(enabled_profiling):
+    session = profiling.start_request('test', 's3cret')
+    job = profiling.propagate(_busy)
+    profiling.finish_request()
+    first = pstats.Stats(os.path.join(str(enabled_profiling), session.name + '.prof'))
+    assert not any(func[2] == '_busy' for func in first.stats)
+
+    thread = threading.Thread(target=job)
+    thread.start()
+    thread.join()
+    second = pstats.Stats(os.path.join(str(enabled_profiling), session.name + '.prof'))
+    assert any(func[2] == '_busy' for func in second.stats)
+
+
+def test_old_profiles_are_removed(tmp_path):
+    for _ in range(3):
+        session = profiling.Session('test', directory=str(tmp_path), keep=2)
+        assert session.start()
+        _busy(10)
+        session.stop()
+    assert len(list(tmp_path.glob('*.prof'))) == 2
+    assert len(list(tmp_path.glob('*.folded'))) == 2
+
+
+def test_folded_stacks_split_time_between_callers():
+    stats = mock.Mock(stats={
+        ('app.py', 1, 'main'): (1, 1, 0.001, 0.010, {}),
+        ('app.py', 5, 'a'): (1, 1, 0.001, 0.003, {('app.py', 1, 'main'): (1, 1, 0.001, 0.003)}),
+        ('app.py', 9, 'b'): (1, 1, 0.0, 0.006, {('app.py', 1, 'main'): (1, 1, 0.0, 0.006)}),
+        ('app.py', 13, 'c'): (2, 2, 0.008, 0.008, {('app.py', 5, 'a'): (1, 1, 0.002, 0.002),
+                                                   ('app.py', 9, 'b'): (1, 1, 0.006, 0.006)}),
+    })
+    assert profiling.folded_stacks(stats) == {
+        'main (app.py:1)': 1000,
+        'main (app.py:1);a (app.py:5)': 1000,
+        'main (app.py:1);a (app.py:5);c (app.py:13)': 2000,
+        'main (app.py:1);b (app.py:9);c (app.py:13)': 6000,
+    }
+
+
+@mock.patch('listen_local_app.views.background_jobs', False)
+@mock.patch('listen_local_app.views.run_search',
+            return_value={'playlist_uri': 'spotify:playlist:abc123', 'listings': ''})
+@mock.patch('listen_local_app.views.get_access_token', return_value='Bearer abc')
+def test_callback_is_profiled_with_the_admin_header(mock_token, mock_search,
+                                                    enabled_profiling):
+    app = create_app()
+    client = app.test_client()
+    assert profiling.HEADER not in client.get('/callback?code=1234').headers
+    assert profiling.HEADER not in client.get('/', headers={'X-Profile': 's3cret'}).headers
+
+    response = client.get('/callback?code=1234', headers={'X-Profile': 's3cret'})
+    assert response.status_code == 200
+    name = response.headers[profiling.HEADER]
+    assert os.path.exists(os.path.join(str(enabled_profiling), name + '.folded'))
+    assert len(list(enabled_profiling.glob('*.prof'))) == 1
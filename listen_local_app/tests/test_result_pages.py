@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+import gzip
+import time
+
+from listen_local_app.result_pages import Page
+from listen_local_app.result_pages import ResultPageCache
+from listen_local_app.result_pages import search_key
+from unittest import mock
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+
+def test_search_key():
+    key = search_key('19130', '2019-01-22', '5', 'abc')
+    assert key == search_key(' 19130', '2019-01-22 ', 5, 'abc')
+    assert key == search_key('19130', '2019-01-22 to 2019-01-22', '5', 'abc')
+    assert key != search_key('19130', '2019-01-22', '10', 'abc')
+    assert key != search_key('19130', '2019-01-22 to 2019-01-23', '5', 'abc')
+    assert key != search_key('19130', '2019-01-22', '5', 'def')
+
+
+def test_page_encodings():
+    page = Page('<p>Show</p>' * 100)
+    assert gzip.decompress(page.bodies['gzip']) == page.bodies['identity']
+    assert page.etag('identity') != page.etag('gzip')
+    assert Page('<p>Show</p>' * 100).etag('gzip') == page.etag('gzip')
+
+    def _accept(header):
+        return parse_accept_header(header, Accept)
+    assert page.negotiate(_accept('gzip, deflate')) == 'gzip'
+    assert page.negotiate(_accept('gzip;q=0.5, identity')) == 'identity'
+    assert page.negotiate(_accept('')) == 'identity'
+
+
+def test_cache_evicts_by_size_and_age():
+    cache = ResultPageCache(max_bytes=2 * Page('x' * 1000).size, ttl=60, path=None)
+    for key in 'abc':
+        cache.put(key, key * 1000)
+    assert cache.get('a') is None
+    assert cache.get('c').html == 'c' * 1000
+    assert cache.stats()['size'] == 2
+
+    with mock.patch('time.time', return_value=time.time() + 61):
+        assert cache.get('c') is None
+
+
+def test_cache_reads_pages_from_disk(tmp_path):
+    path = str(tmp_path / 'pages.db')
+    page = ResultPageCache(path=path).put('a', '<p>Show</p>')
+    other_process = ResultPageCache(path=path)
+    assert other_process.get('a').etag('gzip') == page.etag('gzip')
+    assert 0 < other_process.max_age(other_process.get('a')) <= other_process.ttl
+
+
+def test_disk_tier_is_purged_and_capped(tmp_path):
+    cache = ResultPageCache(ttl=60, path=str(tmp_path / 'pages.db'), max_stored=2,
+                            purge_every=2)
+    for key in 'abcd':
+        cache.put(key, f'<p>{key}</p>')
+    rows = cache.store._connection().execute('SELECT key FROM result_pages').fetchall()
+    assert sorted(rows) == [('c',), ('d',)]
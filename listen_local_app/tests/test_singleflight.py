@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from listen_local_app.singleflight import SingleFlight
+
+
+def _coalesced_call(flights, key, cache, calls):
+    if key in cache:
+        return cache[key]
+    flight = flights.lead(key)
+    if flight is None and key in cache:
+        return cache[key]
+    try:
+        calls.append(key)
+        time.sleep(0.1)
+        cache[key] = f'result for {key}'
+    finally:
+        if flight is not None:
+            flight.done()
+    return cache[key]
+
+
+def test_single_flight_coalesces_threads():
+    flights, cache, calls = SingleFlight('test'), {}, []
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda key: _coalesced_call(flights, key, cache, calls),
+                                    ['a'] * 6 + ['b'] * 2))
+    assert sorted(calls) == ['a', 'b']
+    assert results == ['result for a'] * 6 + ['result for b'] * 2
+    assert flights.in_flight() == 0
+
+
+def test_single_flight_waiters_call_after_failed_leader():
+    flights = SingleFlight('test')
+    flight = flights.lead('a')
+    waiter = []
+    thread = threading.Thread(target=lambda: waiter.append(flights.lead('a')))
+    thread.start()
+    time.sleep(0.05)
+    assert thread.is_alive()
+
+    # The leader failed without caching anything: the waiter wakes and makes the call
+    flight.done()
+    thread.join(1)
+    assert waiter == [None]
+    assert flights.lead('a') is not None
+
+
+def test_single_flight_lock_files_coalesce_processes(tmp_path):
+    # Two registries sharing a lock directory stand in for two app processes
+    cache, calls = {}, []
+    process1 = SingleFlight('test', lock_dir=str(tmp_path))
+    process2 = SingleFlight('test', lock_dir=str(tmp_path))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(lambda flights: _coalesced_call(flights, 'a', cache, calls),
+                                    [process1, process2]))
+    assert calls == ['a']
+    assert results == ['result for a'] * 2
+    # Lock files are removed once their call is done
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_single_flight_times_out():
+    flights = SingleFlight('test', timeout=0.05)
+    flights.lead('a')
+    started = time.time()
+    assert flights.lead('a') is None
+    assert time.time() - started < 1
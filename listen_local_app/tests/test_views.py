@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+import gzip
+import time
+
+from listen_local_app import create_app
+from listen_local_app import result_pages
+from unittest import mock
+
+
+def _fake_run_search(access_token, zipcode, daterange, distance, progress=None):
+    if progress:
+        progress(stage='resolving artists', artists_found=1, artists_resolved=1)
+    return {'playlist_uri': 'spotify:playlist:abc123',
+            'listings': f'<table><tr><td>Show near {zipcode}</td></tr></table>'}
+
+
+def _get_client():
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update({'zipcode': '19130', 'daterange': '2019-01-22', 'distance': '5'})
+    return client
+
+
+@mock.patch('listen_local_app.views.run_search', side_effect=_fake_run_search)
+@mock.patch('listen_local_app.views.get_access_token', return_value='Bearer abc')
+def test_callback_runs_search_in_background(mock_token, mock_search):
+    client = _get_client()
+    response = client.get('/callback?code=1234')
+    assert response.status_code == 302
+    job_url = response.headers['Location']
+    assert '/jobs/' in job_url
+    page = client.get(job_url)
+    assert page.status_code == 200
+    # layout.html loads the slim jQuery build, which has no ajax
+    assert b'XMLHttpRequest' in page.data and b'$.getJSON' not in page.data
+
+    for _ in range(500):
+        status = client.get(job_url + '/status').get_json()
+        if status['status'] == 'done':
+            break
+        time.sleep(0.01)
+    assert status['progress'] == {'artists_found': 1, 'artists_resolved': 1}
+    assert mock_search.call_args[0] == ('Bearer abc', '19130', '2019-01-22', '5')
+
+    results = client.get(job_url + '/results')
+    assert b'Show near 19130' in results.data
+    assert b'embed/playlist/abc123' in results.data
+
+
+@mock.patch('listen_local_app.views.background_jobs', False)
+@mock.patch('listen_local_app.views.run_search', side_effect=_fake_run_search)
+@mock.patch('listen_local_app.views.get_access_token', return_value='Bearer abc')
+def test_callback_without_background_jobs(mock_token, mock_search):
+    response = _get_client().get('/callback?code=1234')
+    assert response.status_code == 200
+    assert b'Show near 19130' in response.data
+
+
+def _fake_run_search_with_key(*args, **kwargs):
+    return dict(_fake_run_search(*args, **kwargs), search_key='abc123key')
+
+
+@mock.patch('listen_local_app.views.background_jobs', False)
+@mock.patch('listen_local_app.views.run_search', side_effect=_fake_run_search_with_key)
+@mock.patch('listen_local_app.views.get_access_token', return_value='Bearer abc')
+def test_results_are_served_from_their_permalink(mock_token, mock_search):
+    client = _get_client()
+    response = client.get('/callback?code=1234', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    html = gzip.decompress(response.data).decode()
+    assert 'Show near 19130' in html and 'href="/results/abc123key"' in html
+
+    response = client.get('/results/abc123key')
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data(as_text=True) == html
+    etag = response.headers['ETag']
+    assert not etag.startswith('W/')
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+    response = client.get('/results/abc123key', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+    assert client.get('/results/nope').status_code == 404
+
+
+@mock.patch('listen_local_app.views.run_search', side_effect=_fake_run_search_with_key)
+@mock.patch('listen_local_app.views.get_access_token', return_value='Bearer abc')
+def test_finished_job_redirects_to_its_permalink(mock_token, mock_search):
+    result_pages.pages.clear()
+    client = _get_client()
+    job_url = client.get('/callback?code=1234').headers['Location']
+    for _ in range(500):
+        if client.get(job_url + '/status').get_json()['status'] == 'done':
+            break
+        time.sleep(0.01)
+
+    with mock.patch.object(result_pages.pages, 'put', wraps=result_pages.pages.put) as put:
+        for _ in range(2):
+            response = client.get(job_url + '/results')
+            assert response.status_code == 302
+            assert response.headers['Location'].endswith('/results/abc123key')
+    # The page is rendered on the first visit only
+    assert put.call_count == 1
+    assert b'Show near 19130' in client.get('/results/abc123key').data
+
+
+def test_unknown_job():
+    client = _get_client()
+    assert client.get('/jobs/nope').status_code == 404
+    assert client.get('/jobs/nope/status').status_code == 404
+
+
+def _fake_stream_search(access_token, zipcode, daterange, distance):
+    def _rows():
+        yield [(1, ['Jan 23 2019', '08:00PM', 'Show', 'Band <B>', 'rock', 'Venue', 'Addr'])]
+        yield [(0, ['Jan 22 2019', '09:00PM', 'Show', 'Band A', 'rock', 'Venue', 'Addr'])]
+    return {'playlist_uri': 'spotify:playlist:abc123', 'rows': _rows()}
+
+
+@mock.patch('listen_local_app.views.stream_results', True)
+@mock.patch('listen_local_app.views.stream_search', side_effect=_fake_stream_search)
+@mock.patch('listen_local_app.views.get_access_token', return_value='Bearer abc')
+def test_callback_streams_results(mock_token, mock_search):
+    response = _get_client().get('/callback?code=1234')
+    assert response.is_streamed
+    html = response.get_data(as_text=True)
+    assert html.index('embed/playlist/abc123') < html.index('Band &lt;B&gt;')
+    assert '<th>Genre(s)</th>' in html
+    assert 'data-position="0"' in html
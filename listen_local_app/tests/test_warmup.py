@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+import datetime
+import threading
+
+from listen_local_app import metrics
+from listen_local_app import warmup
+from listen_local_app.functions import NoConcertsFound
+from unittest import mock
+
+
+TODAY = datetime.date(2019, 1, 22)
+
+
+def test_read_targets(tmp_path):
+    path = tmp_path / 'targets.csv'
+    path.write_text("zipcode,radius,days\n19130, 5, 1\n\n10001,10,7\n")
+    assert warmup.read_targets(str(path)) == [('19130', 5.0, 1), ('10001', 10.0, 7)]
+
+
+def test_plan_searches_keeps_largest_radius_per_window():
+    searches = warmup.plan_searches([('19130', 5, 1), ('19130', 10, 1), ('19130', 3, 7)],
+                                    today=TODAY)
+    assert searches == [('19130', '2019-01-22', None, 10.0),
+                        ('19130', '2019-01-22', '2019-01-28', 3.0)]
+
+
+def _fake_concerts(zipcode, date1, date2, dist, stream, refresh):
+    if zipcode == '00000':
+        raise NoConcertsFound
+    # Each search costs two upstream calls, one of them on a worker thread
+    metrics.count_call()
+    worker = threading.Thread(target=metrics.propagate(metrics.count_call))
+    worker.start()
+    worker.join()
+    # Calls made for users at the same time don't count against the budget
+    user_request = threading.Thread(target=metrics.count_call)
+    user_request.start()
+    user_request.join()
+    return {'events': iter([{'zipcode': zipcode}])}
+
+
+def _fake_rows(data, progress, should_stop):
+    for n, event in enumerate(data['events'], 1):
+        progress(events_fetched=n, artists_found=2)
+        yield n, n, event
+
+
+@mock.patch('listen_local_app.functions.iter_performer_rows', side_effect=_fake_rows)
+@mock.patch('listen_local_app.functions.get_concert_information', side_effect=_fake_concerts)
+def test_warm_caches_within_budget(mock_concerts, mock_rows):
+    targets = [('00000', 5, 1), ('19130', 5, 1), ('10001', 5, 1), ('60601', 5, 1)]
+    report = warmup.warm_caches(targets, budget=4, today=TODAY)
+
+    assert [c[0][0] for c in mock_concerts.call_args_list] == ['00000', '19130', '10001']
+    assert mock_concerts.call_args[1]['refresh'] is True
+    assert report['searches'] == 2 and report['no_concerts'] == 1
+    assert report['skipped'] == 1
+    assert report['api_calls'] == 4
+    assert report['events'] == 2 and report['artists'] == 4
+    assert 0 <= report['artist_hit_rate'] <= 1
+
+
+def _costly_concerts(zipcode, date1, date2, dist, stream, refresh):
+    return {'events': iter(range(100))}
+
+
+def _costly_rows(data, progress, should_stop):
+    # Every artist lookup costs an upstream call
+    for n, event in enumerate(data['events'], 1):
+        if should_stop():
+            return
+        metrics.count_call()
+        progress(events_fetched=n, artists_found=n)
+        yield n, n, event
+
+
+@mock.patch('listen_local_app.functions.iter_performer_rows', side_effect=_costly_rows)
+@mock.patch('listen_local_app.functions.get_concert_information',
+            side_effect=_costly_concerts)
+def test_warm_caches_stops_within_a_search(mock_concerts, mock_rows):
+    report = warmup.warm_caches([('19130', 5, 1), ('10001', 5, 1)], budget=10, today=TODAY)
+
+    assert report['api_calls'] == 10
+    assert report['searches'] == 1 and report['cut_short'] == 1
+    assert report['skipped'] == 1
+    assert report['artists'] == 10
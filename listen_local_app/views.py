@@ -5,32 +5,38 @@ This file contains all the code to run the app pages
 '''
 
 import config
-import json
-import requests
 # import spotipy
 
+from flask import Blueprint
+from flask import current_app
+from flask import jsonify
 from flask import make_response
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import Response
 from flask import session
+from flask import stream_with_context
+from flask import url_for
 
-from listen_local_app import app
+from listen_local_app import jobs
+from listen_local_app import result_pages
 from listen_local_app.forms import SearchForm
-from listen_local_app.functions import build_df_and_get_spotify_info
 from listen_local_app.functions import get_access_token
-from listen_local_app.functions import get_concert_information
 from listen_local_app.functions import make_spotify_play_button
-from listen_local_app.functions import NoConcertsFound
-from listen_local_app.functions import process_daterange
+from listen_local_app.listings import LISTING_COLUMNS
+from listen_local_app.pipeline import run_search
+from listen_local_app.pipeline import stream_search
 
 
-app.config.from_object('config')
+bp = Blueprint('views', __name__)
 client_id = config.spotify_client_id.decode("utf-8")
+background_jobs = getattr(config, 'background_jobs', True)
+stream_results = getattr(config, 'stream_results', False)
 
 
-@app.route('/', methods=['GET', 'POST'])
-@app.route('/index', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
+@bp.route('/index', methods=['GET', 'POST'])
 def index():
     session.clear()
     form = SearchForm(request.form)
@@ -49,7 +55,7 @@ def index():
     return render_template('index.html', form=form)
 
 
-@app.route('/callback')
+@bp.route('/callback')
 def process():
     # Get varaibles in more usable namespace
     if request.args.get('error'):
@@ -60,49 +66,118 @@ def process():
     distance = session.get('distance')
     access_token = get_access_token(code)
 
-    date1, date2 = process_daterange(daterange)
-
-    # Get Concert information
-    try:
-        concert_data = get_concert_information(zipcode, date1=date1, date2=date2, dist=distance)
-    except NoConcertsFound:
-        msg = f"We didn't find any concerts near {zipcode} :-("
-        return render_template("error.html", error_text=msg)
-
-    df = build_df_and_get_spotify_info(concert_data)
-
-    # Find out who the user is
-    me_headers = {'Authorization': access_token}
-    r_me = requests.get('https://api.spotify.com/v1/me', headers=me_headers)
-    r_me_json = json.loads(r_me.text)
-    user_id = r_me_json['id']
-
-    # Make a Playlist
-    playlist_name = f"Concerts near {zipcode} {daterange}"
-    cp_headers = {'Authorization': access_token, 'Content-Type': 'application/json'}
-    cp_post = {'name': playlist_name, 'public': 'true', 'collaborative': 'false',
-               'description': 'created by protype app'}
-    cp_url = 'https://api.spotify.com/v1/users/' + user_id + '/playlists'
-    r_cp = requests.post(cp_url, headers=cp_headers, data=json.dumps(cp_post))
-    playlist_id = json.loads(r_cp.text)['id']
-    playlist_uri = json.loads(r_cp.text)['uri']
-
-    # Post Tracks to the playlist
-    tracks_headers = {'Authorization': access_token, 'Content-Type': 'application/json'}
-    tracks = df.spotify_top_track_uri.dropna().tolist()
-    tracks_url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    tracks_post = {"uris": tracks}
-    r_tracks = requests.post(tracks_url, headers=tracks_headers, data=json.dumps(tracks_post))  # noqa
-
-    # Create listings table from df
-    listing_fields = ["date_local", "time_local", "event_title", "performer",
-                      "genre", "venue_name", "venue_address"]
-    listings_df = df[listing_fields].sort_values(by=["date_local", "time_local"])
-    listings_df.columns = ["Date", "Time", "Event", "Performer",
-                           "Genre(s)", "Venue", "Address"]
-
-    listings_html = listings_df.to_html(index=False, classes=["dataframe", "text-left"])
-    listings_html = listings_html.replace('border="1"', '')
+    if stream_results:
+        result = stream_search(access_token, zipcode, daterange, distance)
+        if 'error' in result:
+            return render_template("error.html", error_text=result['error'])
+        return stream_template("results_stream.html",
+                               playlist_html=make_spotify_play_button(result['playlist_uri'],
+                                                                      width="100%"),
+                               columns=LISTING_COLUMNS,
+                               rows=result['rows'])
+
+    if not background_jobs:
+        return render_search_results(run_search(access_token, zipcode, daterange, distance))
+
+    # Hand the search to a background worker and let the browser poll for progress
+    job_id = jobs.get_queue().submit(run_search, access_token, zipcode, daterange, distance)
+    return redirect(url_for('views.job_page', job_id=job_id))
+
+
+@bp.route('/jobs/<job_id>')
+def job_page(job_id):
+    if jobs.get_queue().get(job_id) is None:
+        return render_template("error.html", error_text="We couldn't find that search"), 404
+    return render_template("status.html", job_id=job_id)
+
+
+@bp.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    job = jobs.get_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify({k: job[k] for k in ('id', 'status', 'stage', 'progress', 'error')})
+
+
+@bp.route('/jobs/<job_id>/results')
+def job_results(job_id):
+    job = jobs.get_queue().get(job_id)
+    if job is None:
+        return render_template("error.html", error_text="We couldn't find that search"), 404
+    if job['status'] == 'error':
+        return render_template("error.html", error_text=job['error'])
+    if job['status'] != 'done':
+        return redirect(url_for('views.job_page', job_id=job_id))
+    key = job['result'].get('search_key')
+    if key is None:
+        return render_search_results(job['result'])
+    # Render the page once, then send every visit to its permalink
+    if result_pages.pages.get(key) is None:
+        store_results_page(job['result'])
+    return redirect(url_for('views.results_page', key=key))
+
+
+@bp.route('/results/<key>')
+def results_page(key):
+    page = result_pages.pages.get(key)
+    if page is None:
+        return render_template("error.html",
+                               error_text="These results have expired, try searching again"), 404
+    return send_results_page(page)
+
+
+def render_search_results(result):
+    '''
+    Render the page for a result from ``pipeline.run_search``, keeping it under the
+    search's key so it can be served again from its permalink
+    '''
+    if 'error' in result:
+        return render_template("error.html", error_text=result['error'])
+    if result.get('search_key') is None:
+        return _render_results(result)
+    return send_results_page(store_results_page(result))
+
+
+def store_results_page(result):
+    '''
+    Render the page for a result from ``pipeline.run_search`` and keep it under the
+    search's key
+
+    Returns:
+        result_pages.Page: the stored page
+    '''
+    return result_pages.pages.put(result['search_key'], _render_results(result))
+
+
+def _render_results(result):
+    key = result.get('search_key')
     return render_template("results.html",
-                           playlist_html=make_spotify_play_button(playlist_uri, width="100%"),
-                           listings=listings_html)
+                           playlist_html=make_spotify_play_button(result['playlist_uri'],
+                                                                  width="100%"),
+                           listings=result['listings'],
+                           permalink=url_for('views.results_page', key=key) if key else None)
+
+
+def send_results_page(page):
+    '''
+    Respond with a stored results page in the best encoding the browser accepts, or
+    ``304 Not Modified`` if it already has it
+    '''
+    encoding = page.negotiate(request.accept_encodings)
+    response = Response(page.bodies[encoding], mimetype='text/html')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={result_pages.pages.max_age(page)}'
+    response.set_etag(page.etag(encoding))
+    return response.make_conditional(request)
+
+
+def stream_template(template_name, **context):
+    '''
+    Render a template as a streamed response, sending each part of the page as soon as it
+    is rendered (http://flask.pocoo.org/docs/1.0/patterns/streaming/)
+    '''
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    return Response(stream_with_context(template.stream(context)))
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+
+'''
+Cache warm-up for popular searches. Runs the seatgeek fetch and the Spotify artist
+lookups for a list of hot zipcodes ahead of time so the first user of the day in each
+one is answered from the caches.
+
+Targets are ``(zipcode, radius, days)``: a search within ``radius`` miles of
+``zipcode`` for the ``days`` days starting today (1 is just today). They come from
+``warmup_targets`` in config.py or a CSV file with those three columns.
+
+Run once from the command line, which warms the caches kept on disk for the app to read
+(the artist cache with ``artist_cache_path`` set, and the seatgeek responses and events
+with ``seatgeek_cache_path`` and ``event_store_path`` set)::
+
+    python -m listen_local_app.warmup --targets hot_zipcodes.csv --budget 300
+
+or every ``warmup_interval`` seconds on a background thread of the app process, which
+also keeps its in-memory seatgeek responses warm, by setting ``warmup_enabled`` in
+config.py.
+'''
+
+import argparse
+import config
+import csv
+import threading
+import time
+
+from datetime import date
+from datetime import timedelta
+from listen_local_app import metrics
+
+
+warmup_targets = getattr(config, 'warmup_targets', [])
+warmup_targets_path = getattr(config, 'warmup_targets_path', None)
+warmup_interval = getattr(config, 'warmup_interval', 5 * 60)
+warmup_budget = getattr(config, 'warmup_budget', 500)
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def read_targets(path):
+    '''
+    Read warm-up targets from a CSV file of ``zipcode,radius,days`` rows. A header row
+    and blank lines are skipped.
+
+    Args:
+        path (str): location of the CSV file
+
+    Returns:
+        list: ``(zipcode, radius, days)`` tuples
+    '''
+    targets = []
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].strip() == 'zipcode':
+                continue
+            zipcode, radius, days = (value.strip() for value in row[:3])
+            targets.append((zipcode, float(radius), int(days)))
+    return targets
+
+
+def plan_searches(targets, today=None):
+    '''
+    Turn targets into the searches to run, keeping only the largest radius asked for
+    each zipcode and date window since smaller radius searches are answered from it
+
+    Args:
+        targets (iterable): ``(zipcode, radius, days)`` tuples
+        today (datetime.date): first day of every window (default: today)
+
+    Returns:
+        list: ``(zipcode, date1, date2, radius)`` tuples, with ``date2`` ``None`` for
+            single day windows as in ``process_daterange``
+    '''
+    today = today or date.today()
+    searches = {}
+    for zipcode, radius, days in targets:
+        date1 = today.isoformat()
+        date2 = (today + timedelta(days=int(days) - 1)).isoformat() if int(days) > 1 else None
+        key = (str(zipcode), date1, date2)
+        searches[key] = max(float(radius), searches.get(key, 0))
+    return [key + (radius,) for key, radius in searches.items()]
+
+
+def warm_caches(targets, budget=warmup_budget, today=None):
+    '''
+    Fetch the events for every target and look up their artists on Spotify, filling
+    ``seatgeek_cache`` and ``artist_cache``. Stops once ``budget`` upstream requests have
+    been sent for the warm-up (requests made for users at the same time don't count): the
+    search under way reads no more event pages and starts no more artist lookups, so a run
+    only goes over by the lookups and page fetch already in flight.
+
+    Args:
+        targets (iterable): ``(zipcode, radius, days)`` tuples
+        budget (int): most upstream requests to spend (default: from config.py)
+        today (datetime.date): first day of every window (default: today)
+
+    Returns:
+        dict: counts of ``searches`` warmed (``cut_short`` of them when the budget ran
+            out part way through), ``skipped`` for lack of budget, searches
+            with ``no_concerts`` and ``failed``, ``events`` and ``artists`` seen,
+            ``api_calls`` spent, and the ``seatgeek_hit_rate`` and ``artist_hit_rate``
+            of the caches
+    '''
+    from listen_local_app.functions import artist_cache
+    from listen_local_app.functions import get_concert_information
+    from listen_local_app.functions import iter_performer_rows
+    from listen_local_app.functions import NoConcertsFound
+    from listen_local_app.functions import seatgeek_cache
+
+    searches = plan_searches(targets, today=today)
+    report = {'searches': 0, 'cut_short': 0, 'skipped': 0, 'no_concerts': 0, 'failed': 0,
+              'events': 0, 'artists': 0, 'api_calls': 0}
+    with metrics.CallCounter() as calls:
+
+        def _over_budget():
+            return calls.count >= budget
+
+        for zipcode, date1, date2, radius in searches:
+            if _over_budget():
+                report['skipped'] += 1
+                continue
+            counts = {}
+            try:
+                data = get_concert_information(zipcode, date1, date2, dist=radius,
+                                               stream=True, refresh=True)
+                for _ in iter_performer_rows(data, progress=counts.update,
+                                             should_stop=_over_budget):
+                    pass
+            except NoConcertsFound:
+                report['no_concerts'] += 1
+                continue
+            except Exception as e:
+                print(f"Warm-up failed for {zipcode} {date1} to {date2 or date1}: {e!r}")
+                report['failed'] += 1
+                continue
+            report['searches'] += 1
+            report['cut_short'] += _over_budget()
+            report['events'] += counts.get('events_fetched', 0)
+            report['artists'] += counts.get('artists_found', 0)
+
+    report['api_calls'] = calls.count
+    report['seatgeek_hit_rate'] = _hit_rate(seatgeek_cache.stats())
+    report['artist_hit_rate'] = _hit_rate(artist_cache.stats())
+    print("Warm-up: {searches} searches warmed ({events} events, {artists} artists, "
+          "{cut_short} cut short), {skipped} skipped over budget, {no_concerts} without "
+          "concerts, {failed} failed; {api_calls} API calls; hit rates seatgeek "
+          "{seatgeek_hit_rate:.0%}, "
+          "artists {artist_hit_rate:.0%}".format(**report))
+    return report
+
+
+def _hit_rate(stats):
+    lookups = stats['hits'] + stats['misses']
+    return stats['hits'] / lookups if lookups else 0.0
+
+
+def load_targets():
+    '''
+    Return the warm-up targets from config.py, including those in ``warmup_targets_path``
+    '''
+    targets = list(warmup_targets)
+    if warmup_targets_path:
+        targets.extend(read_targets(warmup_targets_path))
+    return targets
+
+
+def start_background(interval=warmup_interval, budget=warmup_budget):
+    '''
+    Start warming the caches for the configured targets every ``interval`` seconds on
+    a daemon thread. Only one warm-up thread is started per process.
+
+    Returns:
+        threading.Thread: the warm-up thread
+    '''
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_warm_forever,
+                                       args=(load_targets, interval, budget),
+                                       name='cache-warmup', daemon=True)
+            _thread.start()
+        return _thread
+
+
+def _warm_forever(get_targets, interval, budget):
+    while True:
+        started = time.time()
+        try:
+            warm_caches(get_targets(), budget=budget)
+        except Exception as e:
+            print(f"Warm-up run failed: {e!r}")
+        time.sleep(max(0, interval - (time.time() - started)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', help='CSV file of zipcode,radius,days rows '
+                                          '(default: warmup targets from config.py)')
+    parser.add_argument('--budget', type=int, default=warmup_budget,
+                        help='most upstream API calls to spend per run')
+    parser.add_argument('--loop', action='store_true',
+                        help='keep warming every --interval seconds')
+    parser.add_argument('--interval', type=float, default=warmup_interval)
+    args = parser.parse_args(argv)
+
+    def get_targets():
+        return read_targets(args.targets) if args.targets else load_targets()
+
+    if args.loop:
+        _warm_forever(get_targets, args.interval, args.budget)
+    return warm_caches(get_targets(), budget=args.budget)
+
+
+if __name__ == '__main__':
+    main()